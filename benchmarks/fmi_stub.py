@@ -0,0 +1,92 @@
+"""
+fmi_stub.py
+
+Local stand-in for the FMI OpenData timeseries endpoint. It answers the same
+query fetch_icedata sends (fmisid list, starttime, endtime, param, format=csv)
+with synthetic data from benchmarks.synthetic, so fetching can be benchmarked and the
+app can be run without network access:
+
+    python -m benchmarks.fmi_stub --port 8765
+    FMI_TIMESERIES_URL=http://127.0.0.1:8765/timeseries streamlit run main.py
+
+Functions:
+- start_stub(port, latency): Käynnistää palvelimen taustasäikeeseen ja palauttaa sen.
+"""
+
+import argparse
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import pandas as pd
+from benchmarks.synthetic import synthetic_csv, CSV_COLUMNS
+
+
+class FmiStubHandler(BaseHTTPRequestHandler):
+    """Serves /timeseries CSV responses from synthetic data."""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/timeseries":
+            self.send_error(404)
+            return
+
+        query = parse_qs(url.query)
+        try:
+            fmisids = [int(x) for x in query["fmisid"][0].split(",") if x]
+            start = pd.Timestamp(query["starttime"][0])
+            end = pd.Timestamp(query["endtime"][0])
+            # Parametrin alias (esim. "fzfreq_pt1m_instant(:37) as fzfreq") on sarakkeen nimi.
+            columns = [param.split(" as ")[-1].strip() for param in query["param"][0].split(",")]
+            columns = ["fzfreq" if column.startswith("fzfreq") else column for column in columns]
+        except (KeyError, ValueError):
+            self.send_error(400, "fmisid, starttime, endtime and param are required")
+            return
+        if not set(columns) <= set(CSV_COLUMNS):
+            self.send_error(400, f"unknown param: {columns}")
+            return
+
+        # Keinotekoinen vasteaika sekunteina, asetetaan palvelimelle start_stub:ssa.
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        body = synthetic_csv(fmisids, start, end, columns)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/csv; charset=UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub(port: int = 0, latency: float = 0.0) -> ThreadingHTTPServer:
+    """
+    Starts the stand-in in a daemon thread.
+
+    Args:
+        port (int): Port to listen on, 0 picks a free port.
+        latency (float): Extra delay added to every response, in seconds.
+
+    Returns:
+        ThreadingHTTPServer: Running server. The endpoint URL is
+            f"http://127.0.0.1:{server.server_port}/timeseries". Stop with shutdown().
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), FmiStubHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the FMI timeseries endpoint.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="extra delay per response in seconds")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), FmiStubHandler)
+    server.latency = args.latency
+    print(f"Serving http://127.0.0.1:{args.port}/timeseries")
+    server.serve_forever()
@@ -0,0 +1,85 @@
+"""
+import_time.py
+
+Cold-start check: imports each entry module in a fresh interpreter, takes the
+fastest of --repeat runs and fails if it exceeds its budget or if the import
+pulled in the plotting stack. matplotlib, folium and cmocean are loaded only
+when the first map or graph is drawn.
+
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --repeat 5 --scale 1.5
+
+The exit code is 1 if any module is over its budget or imports a heavy module.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Tuontiaikabudjetit sekunteina, mitattu tavallisella kehityskoneella noin kaksinkertaisella varalla.
+BUDGETS = {
+    "main": 0.8,
+    "data_fetchers": 0.7,
+    "icing_cli": 0.8,
+    "plotters": 0.7,
+    "render_service": 0.7,
+}
+
+# Näitä ei saa tuoda moduulien tuonnin yhteydessä.
+HEAVY_MODULES = ("matplotlib", "folium", "cmocean")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - t0
+print(json.dumps({{"seconds": seconds, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module: str, repeat: int = 3) -> dict:
+    """
+    Imports module in fresh interpreters.
+
+    Args:
+        module (str): Module name.
+        repeat (int): Number of interpreters, the fastest import is reported.
+
+    Returns:
+        dict: Fastest import time in seconds and the heavy modules the import loaded.
+    """
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+            cwd=ROOT, capture_output=True, text=True, check=True)
+        runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {"seconds": min(run["seconds"] for run in runs), "heavy": runs[0]["heavy"]}
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Check the cold import time of the entry modules.")
+    parser.add_argument("--repeat", type=int, default=3, help="fresh interpreters per module")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplier for the budgets on slow machines")
+    args = parser.parse_args(argv)
+
+    failed = False
+    for module, budget in BUDGETS.items():
+        result = measure(module, args.repeat)
+        limit = budget * args.scale
+        problems = []
+        if result["seconds"] > limit:
+            problems.append(f"over budget {limit:.2f} s")
+        if result["heavy"]:
+            problems.append(f"imports {', '.join(result['heavy'])}")
+        failed = failed or bool(problems)
+        print(f"{module:16s} {result['seconds']:6.3f} s  {'; '.join(problems) or 'ok'}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
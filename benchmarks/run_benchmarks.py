@@ -0,0 +1,205 @@
+"""
+run_benchmarks.py
+
+Benchmark suite for the icing pipeline. Every stage is timed for several range
+lengths and station counts against synthetic data and the local FMI stand-in:
+
+- fetch:                  fetch_raw_stations from the stand-in (HTTP, parse, split)
+- parse:                  parse_csv on a ready CSV body
+- calculate_icing:        per-station calculate_icing
+- calculate_icing_batch:  all stations with calculate_icing_batch
+- extract_station_info:   per-station extract_station_info
+- plot_icing_map:         plot_icing_map and rendering the map to HTML
+- plot_icegraph:          one station's graph rendered to PNG
+
+Results are written as JSON, by default to benchmarks/results/<time>.json (not
+tracked by git). The reference result is kept in git as benchmarks/baseline.json,
+and a run can be compared with it or with any earlier result file:
+
+    python -m benchmarks.run_benchmarks --output benchmarks/baseline.json
+    python -m benchmarks.run_benchmarks --compare
+    python -m benchmarks.run_benchmarks --compare benchmarks/results/20250131T120000.json
+
+With --compare the exit code is 1 if any stage is slower than the baseline by
+more than --tolerance.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+
+import data_fetchers
+from data_fetchers import fetch_raw_stations, parse_csv, calculate_icing
+from icing_batch import calculate_icing_batch
+from plotters import extract_station_info, plot_icing_map
+from render_service import render_png
+from benchmarks.fmi_stub import start_stub
+from benchmarks.synthetic import STATIONS, synthetic_csv, synthetic_station_frame, synthetic_meta
+
+DURATIONS = {
+    "1h": pd.Timedelta(hours=1),
+    "1d": pd.Timedelta(days=1),
+    "1w": pd.Timedelta(days=7),
+    "1m": pd.Timedelta(days=30),
+}
+STATION_COUNTS = [1, 5, 23]
+# Kiinteä loppuhetki, jotta tulokset ovat vertailukelpoisia ajosta toiseen.
+END_TIME = pd.Timestamp("2025-01-31 00:00")
+
+# Versionhallinnassa pidettävä vertailutulos, yksittäisten ajojen tulokset menevät RESULTS_DIR:iin.
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+RESULTS_DIR = os.path.join("benchmarks", "results")
+
+
+def _time(func, repeat: int) -> list[float]:
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - t0)
+    return timings
+
+
+def _record(stage: str, duration: str, stations: int, timings: list[float], **extra) -> dict:
+    return {
+        "stage": stage,
+        "duration": duration,
+        "stations": stations,
+        "repeat": len(timings),
+        "min_s": min(timings),
+        "median_s": statistics.median(timings),
+        **extra,
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def run(durations: list[str], station_counts: list[int], repeat: int) -> dict:
+    """Runs every stage for every (duration, station count) and returns the result document."""
+    server = start_stub()
+    data_fetchers.FMI_TIMESERIES_URL = f"http://127.0.0.1:{server.server_port}/timeseries"
+    all_ids = list(STATIONS)
+    records = []
+
+    try:
+        for duration in durations:
+            start = END_TIME - DURATIONS[duration]
+            starttime = start.strftime("%Y%m%dT%H%M")
+            endtime = END_TIME.strftime("%Y%m%dT%H%M")
+
+            for count in station_counts:
+                ids = all_ids[:count]
+                stations = [(fmisid, None) for fmisid in ids]
+                raw = {fmisid: synthetic_station_frame(fmisid, start, END_TIME) for fmisid in ids}
+                rows = sum(len(df) for df in raw.values())
+                body = synthetic_csv(ids, start, END_TIME)
+                print(f"{duration} x {count} stations ({rows} rows)", file=sys.stderr)
+
+                timings = _time(lambda: fetch_raw_stations(stations, starttime, endtime), repeat)
+                records.append(_record("fetch", duration, count, timings, rows=rows, bytes=len(body)))
+
+                timings = _time(lambda: parse_csv(body), repeat)
+                records.append(_record("parse", duration, count, timings, rows=rows, bytes=len(body)))
+
+                timings = _time(lambda: [calculate_icing(df.copy()) for df in raw.values()], repeat)
+                records.append(_record("calculate_icing", duration, count, timings, rows=rows))
+
+                timings = _time(lambda: calculate_icing_batch(raw), repeat)
+                records.append(_record("calculate_icing_batch", duration, count, timings, rows=rows))
+
+                computed = [calculate_icing(df.copy()) for df in raw.values()]
+                metas = [dict(zip(("stationname", "lat", "lon"), synthetic_meta(fmisid))) for fmisid in ids]
+                timings = _time(lambda: [extract_station_info(df, meta) for df, meta in zip(computed, metas)], repeat)
+                records.append(_record("extract_station_info", duration, count, timings, rows=rows))
+
+                station_data = [extract_station_info(df, meta) for df, meta in zip(computed, metas)]
+                timings = _time(lambda: plot_icing_map(station_data).get_root().render(), repeat)
+                records.append(_record("plot_icing_map", duration, count, timings))
+
+                # Kuvaaja piirretään aina yhdelle asemalle, joten se mitataan vain kerran per aikaväli.
+                if count == station_counts[0]:
+                    df = computed[0]
+                    images = []
+                    timings = _time(lambda: images.append(render_png(
+                        df, "bench", ids[0], start.to_pydatetime(), END_TIME.to_pydatetime())), repeat)
+                    records.append(_record(
+                        "plot_icegraph", duration, 1, timings, rows=len(df), bytes=len(images[-1])))
+    finally:
+        server.shutdown()
+
+    return {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": records,
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Returns a line for every stage whose median is slower than the baseline by more than tolerance."""
+    previous = {(r["stage"], r["duration"], r["stations"]): r for r in baseline["results"]}
+    regressions = []
+    for r in current["results"]:
+        old = previous.get((r["stage"], r["duration"], r["stations"]))
+        if old is None or old["median_s"] <= 0:
+            continue
+        ratio = r["median_s"] / old["median_s"]
+        if ratio > 1 + tolerance:
+            regressions.append(
+                f"{r['stage']} {r['duration']} x {r['stations']}: "
+                f"{old['median_s']:.4f} s -> {r['median_s']:.4f} s ({ratio:.2f}x)")
+    return regressions
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the icing pipeline against synthetic data.")
+    parser.add_argument("--durations", nargs="+", default=list(DURATIONS), choices=list(DURATIONS))
+    parser.add_argument("--stations", nargs="+", type=int, default=STATION_COUNTS)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default=None, help="JSON result file (default: benchmarks/results/<time>.json)")
+    parser.add_argument("--compare", nargs="?", const=BASELINE_PATH, default=None,
+                        help="earlier JSON result file to compare against (default: benchmarks/baseline.json)")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown, 0.2 = 20 %%")
+    args = parser.parse_args(argv)
+
+    result = run(args.durations, sorted(args.stations), args.repeat)
+
+    output = args.output or os.path.join(RESULTS_DIR, datetime.now().strftime("%Y%m%dT%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"Results written to {output}", file=sys.stderr)
+
+    for r in result["results"]:
+        print(f"{r['stage']:<24}{r['duration']:>4} x {r['stations']:<3}{r['median_s'] * 1000:10.1f} ms")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
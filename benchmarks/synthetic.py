@@ -0,0 +1,158 @@
+"""
+synthetic.py
+
+Synthetic MSO (fzfreq) data for benchmarks. The generated series look like real
+icing sensor data: slow icing ramps that lower the frequency, de-icing periods
+(NaN while the probe is heated, then a jump back to the dry frequency), rain noise
+that makes the frequency jitter without real accretion, short sensor dropouts and
+small Gaussian noise.
+
+Each UTC day is generated independently from (fmisid, date), so any time range
+gives the same values for the same minutes no matter how it is requested.
+
+Functions:
+- synthetic_fzfreq(fmisid, start, end): Palauttaa aseman synteettisen fzfreq-aikasarjan.
+- synthetic_station_frame(fmisid, start, end): Palauttaa raakadatan kuten fetch_raw_stations.
+- synthetic_meta(fmisid): Palauttaa aseman nimen ja koordinaatit.
+- synthetic_csv(fmisids, start, end, columns): Palauttaa FMI:n timeseries-rajapinnan CSV-muotoisen vastauksen tavuina.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Havaintoasemat kuten main.py:ssä, koordinaatit likimääräisiä.
+STATIONS = {
+    100968: ("Vantaa Helsinki-Vantaan lentoasema", 60.327, 24.957),
+    101065: ("Turku lentoasema", 60.514, 22.262),
+    100907: ("Maarianhamina lentoasema", 60.127, 19.906),
+    101044: ("Pori lentoasema", 61.462, 21.800),
+    101118: ("Tampere-Pirkkala lentoasema", 61.418, 23.604),
+    101315: ("Jämsä Halli lentoasema", 61.855, 24.787),
+    137208: ("Jyväskylä lentoasema", 62.400, 25.670),
+    137188: ("Seinäjoki lentoasema", 62.944, 22.828),
+    101462: ("Vaasa lentoasema", 63.044, 21.762),
+    101662: ("Kruunupyy Kokkola-Pietarsaari lentoasema", 63.721, 23.143),
+    101570: ("Siilinjärvi Kuopio lentoasema", 63.005, 27.797),
+    101608: ("Joensuu lentoasema", 62.662, 29.608),
+    101191: ("Kouvola Utti lentoasema", 60.896, 26.938),
+    101237: ("Lappeenranta lentoasema", 61.045, 28.144),
+    101430: ("Savonlinna lentoasema", 61.944, 28.944),
+    855522: ("Mikkeli lentoasema", 61.688, 27.202),
+    101725: ("Kajaani lentoasema", 64.285, 27.692),
+    101786: ("Oulu lentoasema", 64.937, 25.374),
+    101840: ("Kemi-Tornio lentoasema", 65.778, 24.582),
+    101886: ("Kuusamo lentoasema", 65.988, 29.239),
+    137190: ("Rovaniemi lentoasema", 66.564, 25.830),
+    102033: ("Inari Ivalo lentoasema", 68.607, 27.405),
+    101986: ("Kittilä lentoasema", 67.700, 24.846),
+}
+
+DRY_FREQUENCY = 40000.0
+# Anturi sulattaa jään, kun taajuus on laskenut tämän verran kuivasta arvosta.
+DEICE_DROP = 130.0
+MINUTES_PER_DAY = 1440
+
+
+def _synthetic_day(fmisid: int, day: pd.Timestamp) -> np.ndarray:
+    """Returns 1440 fzfreq values for one UTC day."""
+    rng = np.random.default_rng([fmisid, day.toordinal()])
+    n = MINUTES_PER_DAY
+    dry = DRY_FREQUENCY + (fmisid % 97) * 0.5
+
+    # Jäätämisjaksot: taajuus laskee tasaisesti 0.03-0.6 Hz/min 0.5-6 tunnin ajan.
+    rate = np.zeros(n)
+    for _ in range(rng.poisson(0.8)):
+        start = rng.integers(0, n)
+        length = rng.integers(30, 360)
+        rate[start:start + length] += rng.uniform(0.03, 0.6)
+    accreted = np.cumsum(rate)
+
+    # Sulatus: kun jäätä on kertynyt DEICE_DROP verran, taajuus palaa kuivaan arvoon.
+    freq = dry - np.mod(accreted, DEICE_DROP)
+    deice_count = np.floor_divide(accreted, DEICE_DROP)
+    deice_starts = np.flatnonzero(np.diff(deice_count) > 0) + 1
+
+    # Vesisade: taajuus värähtelee ylös ja alas ilman todellista kertymää.
+    for _ in range(rng.poisson(0.6)):
+        start = rng.integers(0, n)
+        length = rng.integers(30, 240)
+        stop = min(start + length, n)
+        hit = rng.random(stop - start) < 0.3
+        freq[start:stop] += np.where(hit, rng.uniform(-0.6, 0.6, stop - start), 0.0)
+
+    freq += rng.normal(0.0, 0.02, n)
+
+    # Sulatuksen aikana anturi on lämmitettynä, eikä havaintoja ole.
+    for start in deice_starts:
+        freq[start:start + rng.integers(15, 40)] = np.nan
+    # Lyhyet satunnaiset katkot.
+    for start in rng.integers(0, n, rng.poisson(1.0)):
+        freq[start:start + rng.integers(1, 4)] = np.nan
+    return freq
+
+
+def synthetic_fzfreq(fmisid: int, start: pd.Timestamp, end: pd.Timestamp) -> pd.Series:
+    """
+    Returns a synthetic 1-minute fzfreq series for [start, end].
+
+    Args:
+        fmisid (int): Station ID, used as the random seed.
+        start (pd.Timestamp): First minute (UTC).
+        end (pd.Timestamp): Last minute (UTC), inclusive.
+
+    Returns:
+        pd.Series: fzfreq indexed by utctime.
+    """
+    start = pd.Timestamp(start).floor("min")
+    end = pd.Timestamp(end).floor("min")
+    days = pd.date_range(start.normalize(), end.normalize(), freq="D")
+    values = np.concatenate([_synthetic_day(fmisid, day) for day in days])
+    index = pd.date_range(days[0], periods=len(values), freq="min", name="utctime")
+    return pd.Series(values, index=index, name="fzfreq").loc[start:end]
+
+
+def synthetic_station_frame(fmisid: int, start: pd.Timestamp, end: pd.Timestamp) -> pd.DataFrame:
+    """Returns a raw station frame with the same columns as fetch_raw_stations gives."""
+    return synthetic_fzfreq(fmisid, start, end).to_frame()
+
+
+def synthetic_meta(fmisid: int) -> tuple[str, float, float]:
+    """Returns the (stationname, lat, lon) of a station."""
+    return STATIONS.get(fmisid, (f"Asema {fmisid}", 64.0, 26.0))
+
+
+# Sarakkeet, joita rajapinnan param-listassa voi pyytää.
+CSV_COLUMNS = ["fmisid", "stationname", "name", "utctime", "localtime", "lat", "lon", "fzfreq"]
+DATA_COLUMNS = ["fmisid", "utctime", "fzfreq"]
+
+
+def synthetic_csv(
+    fmisids: list[int],
+    start: pd.Timestamp,
+    end: pd.Timestamp,
+    columns: list[str] = DATA_COLUMNS
+) -> bytes:
+    """
+    Returns a timeseries CSV body like FMI sends with timeformat=sql, for the
+    requested param columns (any of CSV_COLUMNS, in the requested order).
+    """
+    parts = []
+    for fmisid in fmisids:
+        fzfreq = synthetic_fzfreq(fmisid, start, end)
+        name, lat, lon = synthetic_meta(fmisid)
+        n = len(fzfreq)
+        df = pd.DataFrame({
+            "fmisid": np.full(n, fmisid, dtype=np.int32),
+            "stationname": [name] * n,
+            "name": [name] * n,
+            "utctime": fzfreq.index,
+            "localtime": fzfreq.index.tz_localize("UTC").tz_convert("Europe/Helsinki").tz_localize(None),
+            "lat": lat,
+            "lon": lon,
+            "fzfreq": fzfreq.to_numpy(),
+        })
+        parts.append(df[columns])
+    if not parts:
+        return (",".join(columns) + "\n").encode("utf-8")
+    return pd.concat(parts).to_csv(
+        index=False, date_format="%Y-%m-%d %H:%M:%S", na_rep="NaN").encode("utf-8")
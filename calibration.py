@@ -0,0 +1,108 @@
+"""
+calibration.py
+
+Calibration runs for the rain-noise filter and the other constants of calculate_icing.
+The raw data of the stations is read once (through raw_store) and calibration_sweep
+evaluates every combination of the given parameter values in one pass:
+
+    python calibration.py --start 2024-12-01 --end 2025-01-01 \\
+        --thresholds 0.10 0.13 0.17 0.20 0.25 --mean-minutes 6 10 14 --min-minutes 10 15 20 \\
+        --output sweep.parquet
+
+The output has one row per station, UTC day and combination with the summed mm and
+mm_filtered, e.g. for comparing with reference days of observed icing. The printed
+table has the totals of each combination over all stations.
+
+Functions:
+- run_sweep(stations, start, end, thresholds, min_minutes, mean_minutes, mm_per_hz, freq): Hakee asemien datan
+  ja laskee kertymät kaikille parametriyhdistelmille.
+"""
+
+import sys
+import argparse
+import pandas as pd
+from data_fetchers import fetch_raw_cached
+from icing_batch import (
+    calibration_sweep, RAIN_NOISE_THRESHOLD, MM_PER_HZ, MIN_MINUTES, MEAN_MINUTES, GAP_MINUTES,
+)
+from stations import PLACES, place_station
+
+
+def run_sweep(
+    stations: list[tuple[int, int]],
+    start: pd.Timestamp,
+    end: pd.Timestamp,
+    thresholds: list[float] = (RAIN_NOISE_THRESHOLD,),
+    min_minutes: list[int] = (MIN_MINUTES,),
+    mean_minutes: list[int] = (MEAN_MINUTES,),
+    mm_per_hz: list[float] = (MM_PER_HZ,),
+    freq: str = "D"
+) -> tuple[pd.DataFrame, dict[tuple[int, int], str]]:
+    """
+    Fetches the raw data of the stations and runs calibration_sweep over [start, end).
+
+    The data is read with enough context before start and after end for the widest
+    windows, so the sums of the range do not depend on where it begins.
+
+    Args:
+        stations (list): List of (FMISID, sensor_id) pairs, sensor_id may be None.
+        start (pd.Timestamp): Start of the range (UTC).
+        end (pd.Timestamp): End of the range (UTC), exclusive.
+        thresholds, min_minutes, mean_minutes, mm_per_hz, freq: See calibration_sweep.
+
+    Returns:
+        tuple: (sweep, failures), failures as in fetch_raw_stations.
+    """
+    # Konteksti: pisin minimi-ikkuna, puolikas keskiarvoikkuna ja sulatusaukon täyttö.
+    before = pd.Timedelta(minutes=max(min_minutes) + 1 + max(mean_minutes) // 2 + GAP_MINUTES)
+    after = pd.Timedelta(minutes=max(mean_minutes) // 2 + 1)
+    raw, failures = fetch_raw_cached(
+        stations, (start - before).strftime("%Y%m%dT%H%M"), (end + after).strftime("%Y%m%dT%H%M"))
+    sweep = calibration_sweep(
+        raw, thresholds, min_minutes, mean_minutes, mm_per_hz,
+        start=start, end=end - pd.Timedelta(minutes=1), freq=freq)
+    return sweep, failures
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Evaluate a grid of icing calculation parameters.")
+    parser.add_argument("--stations", nargs="*", default=None, help="place names (default: all stations of the app)")
+    parser.add_argument("--start", required=True, help="start time (UTC), e.g. 2024-12-01")
+    parser.add_argument("--end", required=True, help="end time (UTC), exclusive")
+    parser.add_argument("--thresholds", nargs="+", type=float, default=[RAIN_NOISE_THRESHOLD],
+                        help="rain-noise thresholds (Hz)")
+    parser.add_argument("--min-minutes", nargs="+", type=int, default=[MIN_MINUTES],
+                        help="trailing minimum windows (minutes)")
+    parser.add_argument("--mean-minutes", nargs="+", type=int, default=[MEAN_MINUTES],
+                        help="centered mean windows (minutes)")
+    parser.add_argument("--mm-per-hz", nargs="+", type=float, default=[MM_PER_HZ], help="mm/Hz factors")
+    parser.add_argument("--freq", default="D", choices=["h", "D", "total"], help="period of the sums")
+    parser.add_argument("--output", help="write the sweep to this Parquet file")
+    args = parser.parse_args(argv)
+
+    places = args.stations or list(PLACES)
+    unknown = [place for place in places if place not in PLACES]
+    if unknown:
+        parser.error(f"unknown stations: {', '.join(unknown)}")
+    start = pd.Timestamp(args.start)
+    end = pd.Timestamp(args.end)
+    if start >= end:
+        parser.error("--start must be before --end")
+
+    sweep, failures = run_sweep(
+        [place_station(place) for place in places], start, end,
+        args.thresholds, args.min_minutes, args.mean_minutes, args.mm_per_hz,
+        None if args.freq == "total" else args.freq)
+    for (FMISID, _), error in failures.items():
+        print(f"Failed: {FMISID}: {error}")
+
+    if args.output:
+        sweep.to_parquet(args.output, index=False)
+    combination = ["min_minutes", "mean_minutes", "threshold", "mm_per_hz"]
+    totals = sweep.groupby(combination)[["mm", "mm_filtered"]].sum().reset_index()
+    print(totals.to_string(index=False))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,18 @@
-import streamlit as st
 import pandas as pd
-# import matplotlib.pyplot as plt
 import requests
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-from io import StringIO
-import chardet
-from datetime import timedelta
-import copy
+from io import BytesIO
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import raw_store
+import perf
+from result_cache import get_result_cache
 
 """
 data_fetchers.py
@@ -17,22 +21,145 @@ Sisältää datan hakemiseen ja jäätymisarvojen laskentaan liittyvät funktiot
 
 Funktiot:
 - fetch_icedata(FMISID, starttime, endtime, place, sensor_id): Hakee säähavaintodataa ja laskee jäätymisarvot.
-- calculate_icing(df): Laskee jäätymisintensiteetin ja kertymän MSO-taajuuden perusteella. Sisältää suodatuksia ja NaN-käsittelyä.
+- request_groups(stations, stations_per_request): Jakaa asemat ryhmiin, jotka haetaan yhdellä pyynnöllä.
+- fetch_raw_stations(stations, starttime, endtime, max_workers, stations_per_request): Hakee asemat rinnakkain
+  jaetulla HTTP-sessiolla ja raportoi epäonnistuneet asemat erikseen.
+- fetch_raw_cached(stations, starttime, endtime): Kuten fetch_raw_stations, mutta lukee ensin paikallisesta
+  raw_store-välimuistista ja lataa vain puuttuvat aikavälit.
+- fetch_icing_batch(stations, starttime, endtime, profile, float32): Palauttaa lasketut jäätämisdatat tulosvälimuistista,
+  puuttuvat asemat haetaan fetch_raw_cached-funktiolla ja lasketaan.
+- fetch_icing_season(stations, starttime, endtime, profile, float32, chunk, progress): Kuten fetch_icing_batch, mutta
+  pitkä aikaväli haetaan ja lasketaan viikon paloissa IcingStreamilla, kertymät jatkuvat palojen yli.
+- fetch_station_meta(FMISIDs, time): Hakee asemien nimet ja sijainnit yhdellä pienellä pyynnöllä asemarekisterille.
+- parse_csv(raw_data, encoding): Jäsentää FMI:n CSV-vastauksen suoraan tavuista pyarrow:lla kompakteilla tietotyypeillä.
+- fill_melt_gaps(series): Täyttää sulatusjaksojen NaN-arvot vektoroidusti 15 min ikkunan perusteella.
+- select_output(df, profile, float32): Karsii tuloksesta profiilin ulkopuoliset sarakkeet ja muuntaa float32:ksi.
+- calculate_icing(df, profile, float32): Laskee jäätymisintensiteetin ja kertymän MSO-taajuuden perusteella. Sisältää suodatuksia ja NaN-käsittelyä.
 
 Käyttää:
 - pandas
 - numpy
 - requests
-- chardet
+- pyarrow
 - datetime
+- raw_store
+- result_cache
+- perf
 """
 
-def calculate_icing(df: pd.DataFrame) -> pd.DataFrame:
+logger = logging.getLogger(__name__)
+
+# Sulatusjakson NaN-arvot täytetään, jos viimeisin ei-NaN-arvo on korkeintaan näin vanha.
+MELT_GAP_WINDOW = pd.Timedelta(minutes=15)
+
+
+def fill_melt_gaps(series: pd.Series, window: pd.Timedelta = MELT_GAP_WINDOW) -> pd.Series:
+    """Fills NaN values caused by sensor de-icing (melt) periods.
+
+    A NaN at time t is replaced with the mean of the values in the window
+    [t_valid - window, t_valid], where t_valid is the latest non-NaN time in
+    [t - window, t]. If there is no valid value within the window the NaN is kept.
+    All windows are evaluated against the original, unfilled values.
+
+    Runs in O(n): the trailing means come from one time-based rolling pass and
+    the latest valid position from a cumulative maximum.
+
+    Args:
+        series (pd.Series): Values with a sorted DatetimeIndex.
+        window (pd.Timedelta): Look-back window, 15 minutes by default.
+
+    Returns:
+        pd.Series: Copy of the series with the melt gaps filled.
+    """
+    values = series.to_numpy(dtype=float)
+    missing = np.isnan(values)
+    if not missing.any():
+        return series.copy()
+
+    # Viimeisimmän ei-NaN-arvon sijainti kullekin riville (-1, jos sellaista ei vielä ole).
+    positions = np.arange(len(values))
+    latest_valid = np.maximum.accumulate(np.where(missing, -1, positions))
+
+    gap_pos = positions[missing & (latest_valid >= 0)]
+    src_pos = latest_valid[gap_pos]
+
+    # Täytetään vain, jos viimeisin ei-NaN-arvo on korkeintaan 15 min vanha.
+    index = series.index
+    recent = (index[gap_pos] - index[src_pos]) <= window
+    gap_pos = gap_pos[recent]
+    src_pos = src_pos[recent]
+
+    # Keskiarvo aikaikkunasta [t_valid - 15min, t_valid] lasketaan kerralla kaikille riveille.
+    window_means = series.rolling(window, closed="both").mean().to_numpy()
+
+    filled = values.copy()
+    filled[gap_pos] = window_means[src_pos]
+    return pd.Series(filled, index=index, name=series.name)
+
+
+# Laskettavat sarakkeet järjestyksessä.
+DERIVED_COLUMNS = [
+    "moving_minimun_15minutes", "NFC_orig", "NFC_mean_10min", "NFC", "NFC_filtered",
+    "mm_orig", "cumul_mm_orig", "mm_mean_10min", "cumul_mm_mean_10min",
+    "mm_instant", "cumul_mm", "mm_instant_filtered", "cumul_mm_filtered",
+]
+
+# Tulosprofiilit: mitkä lasketuista sarakkeista jätetään tulokseen. Syötteen sarakkeet säilyvät aina.
+# "map-only" riittää extract_station_info:lle, "plot" myös plot_icegraph:lle.
+OUTPUT_PROFILES = {
+    "map-only": ["cumul_mm_filtered"],
+    "plot": [
+        "moving_minimun_15minutes", "NFC", "NFC_filtered",
+        "mm_instant", "mm_instant_filtered", "cumul_mm", "cumul_mm_filtered",
+    ],
+    "full": DERIVED_COLUMNS,
+}
+
+
+def select_output(df: pd.DataFrame, profile: str = "full", float32: bool = False) -> pd.DataFrame:
+    """
+    Drops the derived columns not needed by the profile and optionally stores floats as float32.
+
+    Everything is computed in float64 and rounded to float32 only once at the end, so
+    the float32 error of every value v is at most 2**-24 * |v| (about 6e-8 relative).
+    For the accumulated columns this means less than 0.00001 mm for 100 mm of ice.
+    fzfreq (about 40 kHz, between 2**15 and 2**16) has a float32 spacing of 2**-8 Hz,
+    so its rounding error is at most 2**-9 Hz (about 0.002 Hz, the relative bound
+    gives 0.0024 Hz). A difference of two rounded fzfreq values can be off by 0.004 Hz,
+    which is why NFC and the 0.17 threshold are always evaluated on the float64 input,
+    never on a float32 output.
+
+    Args:
+        df (pd.DataFrame): Output of the full calculation.
+        profile (str): "map-only", "plot" or "full".
+        float32 (bool): Store fzfreq and the derived columns as float32.
+
+    Returns:
+        pd.DataFrame: Frame with the input columns and the selected derived columns.
+    """
+    if profile not in OUTPUT_PROFILES:
+        raise ValueError(f"Unknown output profile: {profile}. Choose from {list(OUTPUT_PROFILES)}")
+
+    keep = set(OUTPUT_PROFILES[profile])
+    drop = [column for column in DERIVED_COLUMNS if column not in keep and column in df.columns]
+    if drop:
+        df = df.drop(columns=drop)
+
+    if float32:
+        columns = [column for column in ["fzfreq", *DERIVED_COLUMNS] if column in df.columns]
+        df = df.astype({column: "float32" for column in columns})
+    return df
+
+
+def calculate_icing(df: pd.DataFrame, profile: str = "full", float32: bool = False) -> pd.DataFrame:
     """Calculation of basic icing related variables based on the sensor MSO-frequency.
     These are icing intensity and ice accumulation. And some simple signal filtering has to be made in order 
     to calculate icing. Mostly based on the https://doi.org/10.1175/JAM2535.1 
     Quantitative Ice Accretion Information from the Automated Surface Observing System
-    Charles C. Ryerson and Allan C. Ramsay. Sorry most of the comments are in Finnish!"""
+    Charles C. Ryerson and Allan C. Ramsay. Sorry most of the comments are in Finnish!
+
+    profile ("map-only", "plot" or "full") and float32 select the output columns and
+    precision, see select_output. The defaults return every column in float64."""
 
     # Lasketaan 15 min liukuva minimi taajuudesta FZFREQ
     # HUOM. Liukuva minimi täytyy määrittää s.e. kyseisen ajan hetki ei ole mukana vain edeltävät 15 min
@@ -100,37 +227,7 @@ def calculate_icing(df: pd.DataFrame) -> pd.DataFrame:
     # Käsitellään mahdollisten sulatusjaksojen NaN arvoja vähäisemmäksi.
     # Logiigalla, että NaN korvataan edellisell ei-NaN-arvolla, jos se ei ole vanhempi kuin 15min.
     # Tämä idea tulee myös kirjallisuudesta
-    nan_times = df[df["mm_instant"].isna()].index
-    # Pitää kopioida taulukko toiseen muuttamattomaan taulukkoon, koska nyt taulukon arvoja korjataan.
-    df_orig = df.copy()
-    # print(f"mm_instant")
-    # Käydään läpi jokainen mittausaika, jossa on NaN arvo.
-    for mittausaika in nan_times:
-        # Muodostetaan aikaikkuna, joka on tarkasteltavan Nan-mittausjasta taaksepäin 15 minuuuttia.
-        window_start = mittausaika - timedelta(minutes=15)
-        # Otetaan kaikki tuon aikaikkunan arvot tarkasteluun.
-        window_df = df_orig.loc[window_start:mittausaika]
-        # valid = window_df[f"mm_instant"].dropna()
-        # Pudotetaan kaikki NaN arvot pois aikaikkunan datasta.-
-        valid_df = window_df.dropna(subset=["mm_instant"]) # vaihtoehtoinen tapa jos halutaan säilyttää df:n rakenne.
-        # Jos jäi vielä ei NaN arvoja jäljelle, niin muutetaan NaN arvo sopivasti. 
-        # Jos ei ole enää NaN arvoja, niin "sulatusjakso" on kestänyt yli 15 minuuttia eikä sen jälkeen enää muuteta arvoja.
-        if not valid_df.empty:
-            # latest_valid = valid.iloc[-1]
-            # Tarkastellaan suurin kellonaika, jolloin vielä saatiin ei NaN-arvo.
-            latest_valid_time = valid_df.index.max()
-            # katsotaan 15 min taaksepäin viimeisestä non-NaN-arvon kellonajasta.
-            start_time =  latest_valid_time - timedelta(minutes=15)
-            # Määritetään tämän uuden aikaikkunan (suurin non-NaN aika - 15 minuuttia) keskiarvoistusdata 
-            mean_window_df = df_orig.loc[start_time:latest_valid_time]
-            # Lasketaan uuden aikaikkunan keskiarvo.
-            mean_value = mean_window_df["mm_instant"].mean()
-            # latest_valid = valid.mean()
-            # Sijoitetaan saatu keskiarvo tarkasteltavan NaN-arvon paikalle
-            df.loc[mittausaika,f'mm_instant'] = mean_value
-            #print(f"{mittausaika},{latest_valid}")
-        #else:
-            #print(f"{mittausaika}")
+    df["mm_instant"] = fill_melt_gaps(df["mm_instant"])
 
     # Calculate the cumulative sum
     df[f"cumul_mm"] = df[f"mm_instant"].cumsum()
@@ -139,60 +236,22 @@ def calculate_icing(df: pd.DataFrame) -> pd.DataFrame:
 
     # instant luvuet
     df[f"mm_instant_filtered"] = df[f"NFC_filtered"] * 0.00381
-    # Käsitellään mahdollisten sulatusjaksojen NaN arvoja vähäisemmäksi.
-    # Logiigalla, että NaN korvataan edellisell ei-NaN-arvolla, jos se ei ole vanhempi kuin 15min.
-    nan_times = df[df["mm_instant_filtered"].isna()].index
-    df_orig = df.copy()
-    # Pitää kopioida taulukko toiseen muuttamattomaan taulukkoon, koska nyt taulukon arvoja korjataan.
-    # print(f"mm_instant_new")
-    for mittausaika in nan_times:
-        # print(f"{mittausaika}")
-        window_start = mittausaika - timedelta(minutes=15)
-        # print(f"{mittausaika}")
-        window_df = df_orig.loc[window_start:mittausaika]
-        #print(f"{mittausaika}")
-        # valid = window_df[f"mm_instant_new"].dropna()
-        # print(f"{mittausaika},{valid}")
-        valid_df = window_df.dropna(subset=["mm_instant_filtered"]) # vaihtoehtoinen tapa jos halutaan säilyttää df:n rakenne.
-        # Valitaan viimeisin, koska nehän on aikajärjestyksessä
-        if not valid_df.empty: 
-            # latest_valid = valid.iloc[-1]
-            latest_valid_time = valid_df.index.max()
-            start_time =  latest_valid_time - timedelta(minutes=15)
-            mean_window_df = df_orig.loc[start_time:latest_valid_time]
-            mean_value = mean_window_df["mm_instant_filtered"].mean()
-            # latest_valid = valid.mean()
-            df.loc[mittausaika,f'mm_instant_filtered'] = mean_value
-            # print(f"{mittausaika},{latest_valid}")
-            # df.loc[mittausaika,f'mm_instant_new'] = latest_valid
-            # print(f"{mittausaika},{latest_valid}")
-            # print(f"{df.loc[time]},{df.loc[time,'mm_instant_new']}")
-        #else:
-            # print(f"{mittausaika}")
+    # Käsitellään mahdollisten sulatusjaksojen NaN arvoja vähäisemmäksi samalla logiikalla.
+    df["mm_instant_filtered"] = fill_melt_gaps(df["mm_instant_filtered"])
 
     # Calculate the cumulative sum
     df[f"cumul_mm_filtered"] = df[f"mm_instant_filtered"].cumsum()
     # Poistetaan NaN arvot
     df["cumul_mm_filtered"] = df["cumul_mm_filtered"].ffill()   
     
-    return df
+    return select_output(df, profile, float32)
+
+# FMI OpenData-server. Voidaan ohjata esim. paikalliseen testipalvelimeen (benchmarks/fmi_stub.py).
+FMI_TIMESERIES_URL = os.environ.get("FMI_TIMESERIES_URL", 'http://opendata.fmi.fi/timeseries')
 
-# @st.cache_data
-def fetch_icedata(
-    FMISID: int, 
-    starttime: str, 
-    endtime: str, 
-    place: str = None, 
-    sensor_id: int = None) -> pd.DataFrame:
-    """ Valitaan paikkakunta ja tarkasteluaika, Jäätävä räntä nuoskatykky, ehkä jäätävä sumu,
-    clambing/bridging tapahtuu klo 12UTC, mutta jäätäminenkin (nuoskatykky) voi jatkua vielä EFMA 22.12.2023 klo 12 UTC
-    lumisade tuulen kanssa ja nollakeli jatkuu tuolloin myös
-    place     = place
-    starttime = start_datetime.strftime("%Y%m%dT%H%M")
-    endtime   = end_datetime.strftime("%Y%m%dT%H%M") """
 
-    # FMI OpenData-server
-    url = 'http://opendata.fmi.fi/timeseries'
+def _build_payload(FMISIDs: list[int], starttime: str, endtime: str, sensor_id: int = None) -> dict:
+    """Builds the timeseries query for one or more stations sharing the same sensor_id."""
     producer_string = "opendata"
 
     # If there is more than one sensor in a site then the download string is a bit different compared to single sensor case.
@@ -203,7 +262,7 @@ def fetch_icedata(
         fzfreq_string = f"fzfreq_pt1m_instant as fzfreq"
 
     # definitions for data download
-    payload = {
+    return {
         "format": "csv",
         "timeformat": "sql",
         "producer": f"{producer_string}",
@@ -213,36 +272,156 @@ def fetch_icedata(
         "timestep": "1m",
         "starttime": f"{starttime}",
         "endtime": f"{endtime}",
-        "fmisid": f"{FMISID}",
-        "param": (
-            "fmisid,stationname,name,utctime,localtime,lat,lon,"
-            f"{fzfreq_string}"
-        )
+        # Rajapinta hyväksyy pilkuilla erotetun asemalistan.
+        "fmisid": ",".join(str(FMISID) for FMISID in FMISIDs),
+        # Aseman nimi ja sijainti tulevat asemarekisteristä (stations.py), joten jokaisella
+        # minuuttirivillä haetaan vain aseman tunnus (vastauksen jakamiseen), aika ja taajuus.
+        "param": f"fmisid,utctime,{fzfreq_string}"
     }
 
+
+def _build_meta_payload(FMISIDs: list[int], time: pd.Timestamp) -> dict:
+    """Builds a one-row-per-station query for the station metadata at the given minute."""
+    return {
+        "format": "csv",
+        "producer": "opendata",
+        "groupareas": "0",
+        "precision": "double",
+        "tz": "UTC",
+        "timestep": "1m",
+        "starttime": time.strftime("%Y%m%dT%H%M"),
+        "endtime": time.strftime("%Y%m%dT%H%M"),
+        "fmisid": ",".join(str(FMISID) for FMISID in FMISIDs),
+        "param": "fmisid,stationname,lat,lon",
+    }
+
+
+# Yhteyden muodostuksen ja vastauksen lukemisen aikakatkaisut sekunteina.
+REQUEST_TIMEOUT = (5, 30)
+# Uudelleenyritykset eksponentiaalisella viiveellä: 0.5 s, 1 s, 2 s.
+RETRY_TOTAL = 3
+RETRY_BACKOFF = 0.5
+# Rinnakkaisten pyyntöjen ja yhteen pyyntöön niputettujen asemien enimmäismäärä.
+MAX_FETCH_WORKERS = 4
+STATIONS_PER_REQUEST = 6
+# Pitkät aikavälit (koko kausi) haetaan ja lasketaan näin pitkissä paloissa.
+SEASON_CHUNK = pd.Timedelta(days=7)
+
+# Virheet, jotka koskevat vain yhtä pyyntöä: lataus, tai vastaus jota ei voi jäsentää
+# (esim. HTML-virhesivu, pa.ArrowInvalid ja UnicodeDecodeError ovat ValueErroreita).
+FETCH_ERRORS = (requests.RequestException, ValueError, KeyError)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Returns the process-wide pooled HTTP session.
+
+    The session keeps connections alive between requests and retries failed
+    requests (connection errors, timeouts, 429 and 5xx) with exponential backoff.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=RETRY_TOTAL,
+                backoff_factor=RETRY_BACKOFF,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=frozenset(["GET"]),
+            )
+            adapter = HTTPAdapter(
+                pool_connections=MAX_FETCH_WORKERS,
+                pool_maxsize=MAX_FETCH_WORKERS,
+                max_retries=retry,
+            )
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+    return _session
+
+
+# Sarakkeiden tietotyypit. Asemien nimet tallennetaan kategorioina. Vastauksessa olevat sarakkeet
+# riippuvat pyynnöstä: datapyynnöissä fmisid, utctime ja fzfreq, asemarekisterin pyynnössä nimi ja sijainti.
+CSV_COLUMN_TYPES = {
+    "fmisid": pa.int32(),
+    "stationname": pa.dictionary(pa.int32(), pa.string()),
+    "name": pa.dictionary(pa.int32(), pa.string()),
+    "utctime": pa.timestamp("ns"),
+    "localtime": pa.timestamp("ns"),
+    "lat": pa.float64(),
+    "lon": pa.float64(),
+    "fzfreq": pa.float64(),
+}
+
+
+def parse_csv(raw_data: bytes, encoding: str = "utf-8") -> pd.DataFrame:
+    """
+    Parses a timeseries CSV response directly from bytes.
+
+    The multithreaded pyarrow reader is used with explicit column types, so there is
+    no decoding into a Python string and no dtype inference. If the body is not valid
+    in the given encoding it is re-read as ISO-8859-1, which accepts any byte sequence.
+
+    Args:
+        raw_data (bytes): Response body.
+        encoding (str): Declared encoding of the body, FMI uses UTF-8.
+
+    Returns:
+        pd.DataFrame: Parsed data, stationname and name as categoricals.
+    """
+    if not raw_data.strip():
+        return pd.DataFrame()
+
+    convert_options = pa_csv.ConvertOptions(column_types=CSV_COLUMN_TYPES)
+    try:
+        table = pa_csv.read_csv(
+            BytesIO(raw_data),
+            read_options=pa_csv.ReadOptions(encoding=encoding),
+            convert_options=convert_options)
+    except (pa.ArrowInvalid, UnicodeDecodeError):
+        table = pa_csv.read_csv(
+            BytesIO(raw_data),
+            read_options=pa_csv.ReadOptions(encoding="iso-8859-1"),
+            convert_options=convert_options)
+    return table.to_pandas()
+
+
+def _download_csv(payload: dict) -> pd.DataFrame:
+    """Downloads the CSV for the payload. Raises requests.RequestException if the download fails."""
     # Creating and initializing Request-object
-    req = requests.Request('GET',url,params=payload)
+    req = requests.Request('GET', FMI_TIMESERIES_URL, params=payload)
     prepared = req.prepare()
 
-    # Print URL for debugging purposes just in case.
-    # st.info(prepared.url)
-    print(prepared.url)
+    # URL lokiin vianetsintää varten (näkyy, kun lokitaso on DEBUG).
+    logger.debug("GET %s", prepared.url)
 
     # Download data
-    response = requests.get(prepared.url)
+    with perf.stage("download", fmisid=payload["fmisid"]) as timer:
+        response = get_session().get(prepared.url, timeout=REQUEST_TIMEOUT)
+        timer.set(bytes=len(response.content), status=response.status_code)
 
     # Check if download was succesfull. 
-    if response.status_code == 200:
-        # Read CSV-data to df pd.DataFrame
-        raw_data = response.content
-        result = chardet.detect(raw_data)
-        encoding = result['encoding']
-        df = pd.read_csv(StringIO(raw_data.decode(encoding)))
-        # print(df.head())
-    else:
-        print(f"Download failed with statuscode: {response.status_code}")
-        return pd.DataFrame()
+    if response.status_code != 200:
+        raise requests.HTTPError(f"Download failed with statuscode: {response.status_code}", response=response)
+
+    # Merkistö otetaan Content-Type-otsakkeesta, jos se on annettu, muuten oletetaan UTF-8.
+    content_type = response.headers.get("Content-Type", "")
+    encoding = "utf-8"
+    if "charset=" in content_type:
+        encoding = content_type.split("charset=")[-1].split(";")[0].strip().strip('"') or encoding
+
+    # Read CSV-data to df pd.DataFrame
+    with perf.stage("parse", bytes=len(response.content)) as timer:
+        df = parse_csv(response.content, encoding)
+        timer.set(rows=len(df))
+    return df
+
 
+def _prepare_raw(df: pd.DataFrame, sensor_id: int = None) -> pd.DataFrame:
+    """Renames the sensor column and sets a sorted UTC index, ready for calculate_icing."""
     # If there is more than one sensor in a site convert column name to ordinary.
     if f"fzfreq_#{sensor_id}" in df.columns:
         df = df.rename(columns={f"fzfreq_#{sensor_id}": "fzfreq"})
@@ -251,13 +430,368 @@ def fetch_icedata(
     df["utctime"] = pd.to_datetime(df["utctime"], format="%Y-%m-%d %H:%M:%S")
 
     # UTC-time as index. Needed later.
-    df.set_index('utctime', inplace=True)
+    df = df.set_index('utctime')
     
     # Make sure there is timely order
-    df = df.sort_index()
+    return df.sort_index()
+
+
+def _fetch_group(FMISIDs: list[int], starttime: str, endtime: str, sensor_id: int = None) -> dict[int, pd.DataFrame]:
+    """Fetches one request worth of stations and splits the CSV by fmisid."""
+    df = _download_csv(_build_payload(FMISIDs, starttime, endtime, sensor_id))
+    frames = {FMISID: pd.DataFrame() for FMISID in FMISIDs}
+    if not df.empty:
+        for FMISID, part in df.groupby("fmisid", sort=False):
+            if FMISID in frames:
+                frames[FMISID] = _prepare_raw(part.drop(columns="fmisid"), sensor_id)
+    return frames
+
+
+def fetch_station_meta(FMISIDs: list[int], time: pd.Timestamp = None) -> dict[int, dict]:
+    """
+    Downloads the name and location of stations with one small request.
+
+    Args:
+        FMISIDs (list): FMI station IDs.
+        time (pd.Timestamp): Minute to ask the metadata for (UTC), defaults to the
+            start of the current hour.
+
+    Returns:
+        dict: FMISID -> {"fmisid", "stationname", "lat", "lon"} for the stations
+            the service knows. Raises one of FETCH_ERRORS if the download or parsing fails.
+    """
+    if time is None:
+        time = pd.Timestamp.now(tz="UTC").tz_localize(None).floor("h")
+    df = _download_csv(_build_meta_payload(FMISIDs, time))
+    meta = {}
+    for row in df.drop_duplicates("fmisid").itertuples(index=False) if not df.empty else []:
+        meta[int(row.fmisid)] = {
+            "fmisid": int(row.fmisid),
+            "stationname": str(row.stationname),
+            "lat": float(row.lat),
+            "lon": float(row.lon),
+        }
+    return meta
+
+
+def request_groups(
+    stations: list[tuple[int, int]],
+    stations_per_request: int = STATIONS_PER_REQUEST
+) -> list[list[tuple[int, int]]]:
+    """
+    Splits stations into the groups that fetch_raw_stations downloads with one request each.
+
+    Args:
+        stations (list): List of (FMISID, sensor_id) pairs, sensor_id may be None.
+        stations_per_request (int): Maximum number of stations in one group,
+            None puts each sensor_id into a single group.
+
+    Returns:
+        list: Groups of (FMISID, sensor_id) pairs with the same sensor_id.
+    """
+    by_sensor: dict[int, list[tuple[int, int]]] = {}
+    for FMISID, sensor_id in stations:
+        by_sensor.setdefault(sensor_id, []).append((FMISID, sensor_id))
+
+    groups = []
+    for keys in by_sensor.values():
+        size = stations_per_request or len(keys)
+        for i in range(0, len(keys), size):
+            groups.append(keys[i:i + size])
+    return groups
+
+
+def fetch_raw_stations(
+    stations: list[tuple[int, int]],
+    starttime: str,
+    endtime: str,
+    max_workers: int = MAX_FETCH_WORKERS,
+    stations_per_request: int = STATIONS_PER_REQUEST
+) -> tuple[dict[tuple[int, int], pd.DataFrame], dict[tuple[int, int], str]]:
+    """
+    Downloads raw fzfreq data for several stations concurrently.
+
+    The sensor_id is part of the requested parameter, so stations are grouped by
+    sensor_id and each group is split into requests of at most stations_per_request
+    stations. The requests run in a bounded thread pool on the shared pooled session,
+    so one slow request does not hold back the others.
+
+    Args:
+        stations (list): List of (FMISID, sensor_id) pairs, sensor_id may be None.
+        starttime (str): Start time in format YYYYMMDDTHHMM.
+        endtime (str): End time in format YYYYMMDDTHHMM.
+        max_workers (int): Maximum number of concurrent requests.
+        stations_per_request (int): Maximum number of stations in one request,
+            None puts each sensor_id group into a single request.
+
+    Returns:
+        tuple: (frames, failures) where frames maps (FMISID, sensor_id) to a raw
+            DataFrame ready for calculate_icing (empty if the station had no data)
+            and failures maps (FMISID, sensor_id) to an error message for stations
+            whose request failed after all retries or returned a response that
+            could not be parsed.
+    """
+    chunks = [
+        (group[0][1], [FMISID for FMISID, _ in group])
+        for group in request_groups(stations, stations_per_request)
+    ]
+
+    frames = {}
+    failures = {}
+    if not chunks:
+        return frames, failures
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks)))) as executor:
+        futures = {
+            executor.submit(perf.propagate(_fetch_group), FMISIDs, starttime, endtime, sensor_id): (sensor_id, FMISIDs)
+            for sensor_id, FMISIDs in chunks
+        }
+        for future in as_completed(futures):
+            sensor_id, FMISIDs = futures[future]
+            try:
+                for FMISID, df in future.result().items():
+                    frames[(FMISID, sensor_id)] = df
+            except FETCH_ERRORS as e:
+                # Epäonnistunut pyyntö merkitään vain sen asemille, muut asemat jatkavat.
+                logger.warning("Download failed for %s: %s", FMISIDs, e)
+                for FMISID in FMISIDs:
+                    failures[(FMISID, sensor_id)] = str(e) or type(e).__name__
+
+    return frames, failures
+
+
+def fetch_raw_cached(
+    stations: list[tuple[int, int]],
+    starttime: str,
+    endtime: str,
+    root: str = raw_store.RAW_STORE_DIR,
+    max_workers: int = MAX_FETCH_WORKERS
+) -> tuple[dict[tuple[int, int], pd.DataFrame], dict[tuple[int, int], str]]:
+    """
+    Returns raw fzfreq data for several stations, downloading only what is not on disk.
+
+    Each station's missing sub-ranges are planned by raw_store. Stations that miss
+    the same ranges are downloaded together with fetch_raw_stations, the results are
+    merged into the store and the requested range is read back from it.
+
+    Args:
+        stations (list): List of (FMISID, sensor_id) pairs, sensor_id may be None.
+        starttime (str): Start time in format YYYYMMDDTHHMM.
+        endtime (str): End time in format YYYYMMDDTHHMM.
+        root (str): Raw store directory.
+        max_workers (int): Maximum number of concurrent requests.
+
+    Returns:
+        tuple: (frames, failures) as in fetch_raw_stations.
+    """
+    start = pd.Timestamp(starttime)
+    end = pd.Timestamp(endtime)
+    now = pd.Timestamp.now(tz="UTC").tz_localize(None)
+
+    # Ryhmitellään asemat puuttuvien aikavälien mukaan, jotta samat välit haetaan yhdessä.
+    plans: dict[tuple, list[tuple[int, int]]] = {}
+    for FMISID, sensor_id in stations:
+        ranges = tuple(raw_store.plan_fetch(FMISID, sensor_id, start, end, now, root))
+        if ranges:
+            plans.setdefault(ranges, []).append((FMISID, sensor_id))
+
+    failures = {}
+    for ranges, group in plans.items():
+        fetched = {key: [] for key in group}
+        for range_start, range_end in ranges:
+            frames, range_failures = fetch_raw_stations(
+                group,
+                range_start.strftime("%Y%m%dT%H%M"),
+                range_end.strftime("%Y%m%dT%H%M"),
+                max_workers)
+            failures.update(range_failures)
+            for key, df in frames.items():
+                if not df.empty:
+                    fetched[key].append(df)
+
+        for FMISID, sensor_id in group:
+            if (FMISID, sensor_id) in failures:
+                continue
+            parts = fetched[(FMISID, sensor_id)]
+            df = pd.concat(parts) if parts else pd.DataFrame()
+            with perf.stage("store_write", station=FMISID, rows=len(df)):
+                raw_store.store_fetched(FMISID, sensor_id, df, list(ranges), now, root)
+
+    frames = {}
+    for FMISID, sensor_id in stations:
+        if (FMISID, sensor_id) not in failures:
+            with perf.stage("store_read", station=FMISID) as timer:
+                frames[(FMISID, sensor_id)] = raw_store.read_range(FMISID, sensor_id, start, end, root)
+                timer.set(rows=len(frames[(FMISID, sensor_id)]))
+    return frames, failures
+
+
+def fetch_icing_batch(
+    stations: list[tuple[int, int]],
+    starttime: str,
+    endtime: str,
+    profile: str = "full",
+    float32: bool = False,
+    cache_results: bool = True
+) -> tuple[dict[tuple[int, int], pd.DataFrame], dict[tuple[int, int], str]]:
+    """
+    Returns calculate_icing output for several stations, using the shared result cache.
+
+    Only stations missing from the cache are fetched (through fetch_raw_cached) and
+    computed, all together with calculate_icing_batch. The returned frames are shared with other sessions and must not be modified.
+
+    Args:
+        stations (list): List of (FMISID, sensor_id) pairs, sensor_id may be None.
+        starttime (str): Start time in format YYYYMMDDTHHMM.
+        endtime (str): End time in format YYYYMMDDTHHMM.
+        profile (str): Output profile of calculate_icing.
+        float32 (bool): Float32 output mode of calculate_icing.
+        cache_results (bool): Put the computed frames into the result cache. Callers
+            that keep the frames in a store of their own (frame_store) pass False,
+            so a frame is not held by two caches. Cached frames are still used.
+
+    Returns:
+        tuple: (frames, failures) as in fetch_raw_stations, but frames hold computed
+            icing variables.
+    """
+    cache = get_result_cache()
+
+    frames = {}
+    missing = []
+    with perf.stage("result_cache", stations=len(stations)) as timer:
+        for FMISID, sensor_id in stations:
+            df = cache.get(cache.make_key(FMISID, sensor_id, starttime, endtime, profile, float32))
+            if df is None:
+                missing.append((FMISID, sensor_id))
+            else:
+                frames[(FMISID, sensor_id)] = df
+        timer.set(hits=len(frames))
+
+    failures = {}
+    if missing:
+        # icing_batch tuo tästä moduulista calculate_icing:n, joten se tuodaan vasta täällä.
+        from icing_batch import calculate_icing_batch
+
+        raw_frames, failures = fetch_raw_cached(missing, starttime, endtime)
+        # Kaikki puuttuvat asemat lasketaan kerralla yhteisellä minuuttiruudukolla.
+        with perf.stage("calculate_icing", stations=len(raw_frames)) as timer:
+            computed = calculate_icing_batch(raw_frames, profile, float32)
+            timer.set(rows=sum(len(df) for df in computed.values()))
+        for (FMISID, sensor_id), df in computed.items():
+            if cache_results and not df.empty:
+                cache.put(cache.make_key(FMISID, sensor_id, starttime, endtime, profile, float32), df, endtime)
+            frames[(FMISID, sensor_id)] = df
+
+    return frames, failures
+
+
+def fetch_icing_season(
+    stations: list[tuple[int, int]],
+    starttime: str,
+    endtime: str,
+    profile: str = "full",
+    float32: bool = False,
+    chunk: pd.Timedelta = SEASON_CHUNK,
+    progress=None,
+    cache_results: bool = True
+) -> tuple[dict[tuple[int, int], pd.DataFrame], dict[tuple[int, int], str]]:
+    """
+    Returns calculate_icing output for a long range, e.g. a whole icing season.
+
+    The range is fetched chunk by chunk with fetch_raw_cached and every station's
+    chunk is fed to its own IcingStream, which carries the trailing windows and the
+    cumulative sums (cumul_mm, cumul_mm_filtered, ...) over the chunk boundaries.
+    Only the finalized rows reduced to the output profile are kept, so the raw data
+    and the full-width intermediate frames in memory never exceed about one chunk.
+    The result equals fetch_icing_batch over the same range up to floating point
+    rounding in the rolling mean. A station whose download fails in any chunk is
+    reported in failures and dropped from the remaining chunks.
+
+    Args:
+        stations (list): List of (FMISID, sensor_id) pairs, sensor_id may be None.
+        starttime (str): Start time in format YYYYMMDDTHHMM.
+        endtime (str): End time in format YYYYMMDDTHHMM.
+        profile (str): Output profile of calculate_icing.
+        float32 (bool): Float32 output mode of calculate_icing.
+        chunk (pd.Timedelta): Length of one fetched chunk.
+        progress (callable): Called as progress(done, total) after every chunk.
+        cache_results (bool): See fetch_icing_batch.
+
+    Returns:
+        tuple: (frames, failures) as in fetch_icing_batch.
+    """
+    # icing_stream tuo tästä moduulista calculate_icing:n, joten se tuodaan vasta täällä.
+    from icing_stream import IcingStream
+
+    cache = get_result_cache()
+    frames = {}
+    active = []
+    for FMISID, sensor_id in stations:
+        df = cache.get(cache.make_key(FMISID, sensor_id, starttime, endtime, profile, float32))
+        if df is None:
+            active.append((FMISID, sensor_id))
+        else:
+            frames[(FMISID, sensor_id)] = df
+
+    start = pd.Timestamp(starttime)
+    end = pd.Timestamp(endtime)
+    # Palat eivät mene päällekkäin: seuraava alkaa minuutti edellisen lopun jälkeen.
+    bounds = []
+    chunk_start = start
+    while chunk_start <= end:
+        chunk_end = min(chunk_start + chunk - pd.Timedelta(minutes=1), end)
+        bounds.append((chunk_start, chunk_end))
+        chunk_start = chunk_end + pd.Timedelta(minutes=1)
+
+    streams = {key: IcingStream() for key in active}
+    parts = {key: [] for key in active}
+    failures = {}
+    for done, (chunk_start, chunk_end) in enumerate(bounds, start=1):
+        if active:
+            with perf.stage("season_chunk", stations=len(active), start=chunk_start) as timer:
+                raw_frames, chunk_failures = fetch_raw_cached(
+                    active, chunk_start.strftime("%Y%m%dT%H%M"), chunk_end.strftime("%Y%m%dT%H%M"))
+                failures.update(chunk_failures)
+                active = [key for key in active if key not in chunk_failures]
+                for key in active:
+                    final = streams[key].update(raw_frames[key])
+                    if not final.empty:
+                        parts[key].append(select_output(final, profile, float32))
+                timer.set(rows=sum(len(df) for df in raw_frames.values()))
+        if progress is not None:
+            progress(done, len(bounds))
+
+    for key in active:
+        final = streams[key].flush()
+        if not final.empty:
+            parts[key].append(select_output(final, profile, float32))
+        df = pd.concat(parts[key]) if parts[key] else pd.DataFrame()
+        if cache_results and not df.empty:
+            cache.put(cache.make_key(*key, starttime, endtime, profile, float32), df, endtime)
+        frames[key] = df
+
+    return frames, failures
+
+
+def fetch_icedata(
+    FMISID: int, 
+    starttime: str, 
+    endtime: str, 
+    place: str = None, 
+    sensor_id: int = None) -> pd.DataFrame:
+    """ Valitaan paikkakunta ja tarkasteluaika, Jäätävä räntä nuoskatykky, ehkä jäätävä sumu,
+    clambing/bridging tapahtuu klo 12UTC, mutta jäätäminenkin (nuoskatykky) voi jatkua vielä EFMA 22.12.2023 klo 12 UTC
+    lumisade tuulen kanssa ja nollakeli jatkuu tuolloin myös
+    place     = place
+    starttime = start_datetime.strftime("%Y%m%dT%H%M")
+    endtime   = end_datetime.strftime("%Y%m%dT%H%M") """
+
+    # Tarkistetaan ensin tulosvälimuisti ja paikallinen raakadatavälimuisti, ladataan vain puuttuvat aikavälit.
+    frames, failures = fetch_icing_batch([(FMISID, sensor_id)], starttime, endtime)
+    if (FMISID, sensor_id) in failures:
+        return pd.DataFrame()
 
-    # Calculate icing variables
-    df_ice = calculate_icing(df)
+    df_ice = frames[(FMISID, sensor_id)]
 
     # If csv output is required uncomment these lines
     # if sensor_id is not None:
@@ -266,4 +800,4 @@ def fetch_icedata(
     #    df_ice.to_csv(f"{starttime}_{endtime}_{place}_{FMISID}_muokattu.csv", index=True)
     
     # Output is dataframe
-    return df_ice
\ No newline at end of file
+    return df_ice
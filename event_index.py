@@ -0,0 +1,317 @@
+"""
+event_index.py
+
+Icing episodes extracted from the calculate_icing output, and a persistent index of
+them for queries across stations and whole seasons. An episode is a run of minutes
+with a positive mm_instant_filtered (the increment of NFC_filtered), where pauses of
+at most EVENT_GAP do not end the episode. Each episode is stored as one record:
+
+    fmisid, sensor_id, stationname, start, end (first and last icing minute, UTC),
+    minutes (icing minutes), total_mm, peak_mm_h (highest one-minute rate as mm/h)
+
+Each station and sensor has one Parquet file of its episodes; the indexed time spans
+are kept in the file metadata, so only spans not indexed yet are computed:
+
+    <root>/<FMISID>_<sensor_id>.parquet
+
+Like the rollups, the increments are computed from the raw_store data with
+surrounding context, and only data that can no longer change is indexed. Episodes
+that meet at the edge of two computed pieces are joined, so the index has the same
+episodes as one continuous detection. The index is built by the prefetch for the
+recent days, by the app's "Find events" and from the command line:
+
+    python -m event_index build --start 2024-10-01 --end 2025-05-01
+    python -m event_index query --start 2025-01-01 --end 2025-02-01 --min-mm 0.5
+
+Functions:
+- detect_events(df, gap): Palauttaa laskennan tuloksen jäätämisjaksot tietueina.
+- build_event_index(stations, start, end, now, root): Laskee ja tallentaa indeksoimattomien aikavälien jaksot.
+- query_events(start, end, min_mm, stations, root): Hakee indeksistä jaksot, jotka osuvat aikavälille.
+"""
+
+import os
+import sys
+import json
+import argparse
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import perf
+import raw_store
+from store_io import atomic_write, MtimeCache, missing_spans, group_by_missing, pieces
+from stations import get_station_registry
+from data_fetchers import fetch_raw_cached, SEASON_CHUNK
+from icing_batch import calculate_icing_batch
+from icing_stream import STREAM_CONTEXT, CENTERED_LOOKAHEAD
+
+EVENT_INDEX_DIR = os.environ.get("ICING_EVENT_INDEX", os.path.join(".icing_cache", "events"))
+
+# Jakso jatkuu, jos jäätämisen tauko on korkeintaan näin pitkä.
+EVENT_GAP = pd.Timedelta(minutes=30)
+
+EVENT_COLUMNS = ["fmisid", "sensor_id", "stationname", "start", "end", "minutes", "total_mm", "peak_mm_h"]
+
+ONE_HOUR = pd.Timedelta(hours=1)
+ONE_MINUTE = pd.Timedelta(minutes=1)
+
+# Ladatut indeksit: polku -> (jaksot, indeksoidut aikavälit).
+_loaded = MtimeCache()
+
+
+def detect_events(df: pd.DataFrame, gap: pd.Timedelta = EVENT_GAP) -> pd.DataFrame:
+    """
+    Extracts the icing episodes of one station.
+
+    Args:
+        df (pd.DataFrame): calculate_icing output with mm_instant_filtered and a
+            sorted DatetimeIndex.
+        gap (pd.Timedelta): Longest pause inside one episode.
+
+    Returns:
+        pd.DataFrame: One row per episode with start, end, minutes, total_mm and
+            peak_mm_h, in time order.
+    """
+    increments = df["mm_instant_filtered"].to_numpy(dtype=float)
+    icing = increments > 0
+    times = df.index[icing]
+    if times.empty:
+        return pd.DataFrame({
+            "start": pd.DatetimeIndex([]), "end": pd.DatetimeIndex([]),
+            "minutes": np.array([], dtype=np.int32),
+            "total_mm": np.array([], dtype=float), "peak_mm_h": np.array([], dtype=float)})
+
+    # Uusi jakso alkaa, kun edellisestä jäätävästä minuutista on kulunut yli gap.
+    episode = np.concatenate(([0], np.cumsum(np.diff(times.asi8) > gap.value)))
+    grouped = pd.Series(increments[icing], index=times).groupby(episode)
+    events = pd.DataFrame({
+        "start": times[np.r_[0, np.flatnonzero(np.diff(episode)) + 1]],
+        "end": times[np.r_[np.flatnonzero(np.diff(episode)), len(times) - 1]],
+        "minutes": grouped.size().to_numpy(dtype=np.int32),
+        "total_mm": grouped.sum().to_numpy(),
+        "peak_mm_h": grouped.max().to_numpy() * 60,
+    })
+    return events
+
+
+def _join_events(events: pd.DataFrame, gap: pd.Timedelta = EVENT_GAP) -> pd.DataFrame:
+    """Joins time-ordered episodes of one station that are at most gap apart."""
+    if len(events) < 2:
+        return events.reset_index(drop=True)
+    events = events.sort_values("start", kind="stable")
+    # Sama sääntö kuin detect_events:ssä: alku yli gap edellisen lopusta aloittaa uuden jakson.
+    previous_end = events["end"].cummax().shift()
+    episode = (events["start"] - previous_end > gap).cumsum().to_numpy()
+    grouped = events.groupby(episode, sort=False)
+    joined = grouped.agg(
+        start=("start", "min"), end=("end", "max"), minutes=("minutes", "sum"),
+        total_mm=("total_mm", "sum"), peak_mm_h=("peak_mm_h", "max"))
+    for column in ("fmisid", "sensor_id", "stationname"):
+        if column in events.columns:
+            joined[column] = grouped[column].first()
+    return joined.reset_index(drop=True)
+
+
+def _index_path(FMISID: int, sensor_id: int, root: str) -> str:
+    return os.path.join(root, f"{FMISID}_{sensor_id if sensor_id is not None else 'default'}.parquet")
+
+
+def _read(path: str) -> tuple[pd.DataFrame, list]:
+    """Reads the episodes and indexed spans of an index file, or nothing if it does not exist."""
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=EVENT_COLUMNS), []
+    table = pq.read_table(path)
+    spans = [
+        (pd.Timestamp(span_start), pd.Timestamp(span_stop))
+        for span_start, span_stop in json.loads(table.schema.metadata[b"indexed_spans"])
+    ]
+    return table.to_pandas(), spans
+
+
+def _load(FMISID: int, sensor_id: int, root: str) -> tuple[pd.DataFrame, list]:
+    """Returns (episodes, indexed spans) of a station, reloading only if the file changed."""
+    return _loaded.load(_index_path(FMISID, sensor_id, root), _read)
+
+
+def _write(FMISID: int, sensor_id: int, events: pd.DataFrame, spans: list, root: str):
+    """Writes the episodes and indexed spans of a station atomically."""
+    table = pa.Table.from_pandas(events[EVENT_COLUMNS], preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[b"indexed_spans"] = json.dumps([[str(a), str(b)] for a, b in spans]).encode()
+    table = table.replace_schema_metadata(metadata)
+    atomic_write(_index_path(FMISID, sensor_id, root), lambda tmp_path: pq.write_table(table, tmp_path))
+
+
+def _union(spans: list) -> list:
+    """Merges overlapping or touching [start, stop) spans."""
+    merged = []
+    for span_start, span_stop in sorted(spans):
+        if merged and span_start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], span_stop))
+        else:
+            merged.append((span_start, span_stop))
+    return merged
+
+
+def _indexable_stop(now: pd.Timestamp) -> pd.Timestamp:
+    """First hour that cannot be indexed yet: its data (and look-ahead) may still change."""
+    return (now - raw_store.CLOSED_DAY_DELAY - CENTERED_LOOKAHEAD).floor("h")
+
+
+def _detect_piece(
+    stations: list[tuple[int, int]],
+    start: pd.Timestamp,
+    stop: pd.Timestamp
+) -> tuple[dict, dict]:
+    """Detects the episodes of [start, stop) from increments computed with surrounding context."""
+    raw, failures = fetch_raw_cached(
+        stations,
+        (start - STREAM_CONTEXT).strftime("%Y%m%dT%H%M"),
+        (stop - ONE_MINUTE + CENTERED_LOOKAHEAD).strftime("%Y%m%dT%H%M"))
+    meta = get_station_registry().get([FMISID for FMISID, _ in raw])
+    found = {}
+    for (FMISID, sensor_id), df in calculate_icing_batch(raw, profile="full").items():
+        if not df.empty:
+            df = df.loc[start:stop - ONE_MINUTE]
+        events = detect_events(df) if not df.empty else pd.DataFrame(columns=EVENT_COLUMNS)
+        events["fmisid"] = FMISID
+        events["sensor_id"] = sensor_id
+        events["stationname"] = meta[FMISID]["stationname"] if FMISID in meta else None
+        found[(FMISID, sensor_id)] = events
+    return found, failures
+
+
+def build_event_index(
+    stations: list[tuple[int, int]],
+    start: pd.Timestamp,
+    end: pd.Timestamp,
+    now: pd.Timestamp = None,
+    root: str = EVENT_INDEX_DIR
+) -> dict[tuple[int, int], str]:
+    """
+    Detects and stores the episodes of the parts of [start, end) not indexed yet.
+
+    Stations missing the same spans are computed together, in pieces of at most
+    SEASON_CHUNK. Only data that is final is indexed.
+
+    Args:
+        stations (list): List of (FMISID, sensor_id) pairs, sensor_id may be None.
+        start (pd.Timestamp): Start of the range (UTC).
+        end (pd.Timestamp): End of the range (UTC), exclusive.
+        now (pd.Timestamp): Current UTC time, defaults to the clock.
+        root (str): Event index directory.
+
+    Returns:
+        dict: (FMISID, sensor_id) -> error message for stations whose download failed.
+    """
+    if now is None:
+        now = pd.Timestamp.now(tz="UTC").tz_localize(None)
+    start = start.floor("h")
+    stop = min(end.ceil("h"), _indexable_stop(now))
+
+    failures = {}
+    if start >= stop:
+        return failures
+
+    # Ryhmitellään asemat puuttuvien aikavälien mukaan, jotta samat välit lasketaan yhdessä.
+    plans = group_by_missing(
+        stations, lambda FMISID, sensor_id: missing_spans(_load(FMISID, sensor_id, root)[1], start, stop))
+
+    for missing, group in plans.items():
+        found = {key: [] for key in group}
+        done = {key: [] for key in group}
+        for piece_start, piece_stop in pieces(missing, SEASON_CHUNK):
+            active = [key for key in group if key not in failures]
+            with perf.stage("event_index", stations=len(active), start=piece_start):
+                detected, piece_failures = _detect_piece(active, piece_start, piece_stop)
+            failures.update(piece_failures)
+            for key, events in detected.items():
+                if key not in failures:
+                    found[key].append(events)
+                    done[key].append((piece_start, piece_stop))
+
+        for (FMISID, sensor_id), parts in found.items():
+            if (FMISID, sensor_id) in failures or not parts:
+                continue
+            old, spans = _load(FMISID, sensor_id, root)
+            parts = [part for part in [old, *parts] if not part.empty]
+            events = _join_events(pd.concat(parts)) if parts else pd.DataFrame(columns=EVENT_COLUMNS)
+            _write(FMISID, sensor_id, events, _union(spans + done[(FMISID, sensor_id)]), root)
+
+    return failures
+
+
+def query_events(
+    start: pd.Timestamp = None,
+    end: pd.Timestamp = None,
+    min_mm: float = 0.0,
+    stations: list[tuple[int, int]] = None,
+    root: str = EVENT_INDEX_DIR
+) -> pd.DataFrame:
+    """
+    Returns the indexed episodes that overlap [start, end).
+
+    Only spans indexed with build_event_index are included.
+
+    Args:
+        start (pd.Timestamp): Start of the range (UTC), None for no limit.
+        end (pd.Timestamp): End of the range (UTC), exclusive, None for no limit.
+        min_mm (float): Smallest total_mm of a returned episode.
+        stations (list): (FMISID, sensor_id) pairs, None for all indexed stations.
+        root (str): Event index directory.
+
+    Returns:
+        pd.DataFrame: EVENT_COLUMNS rows sorted by start.
+    """
+    if stations is None:
+        stations = []
+        if os.path.isdir(root):
+            for name in sorted(os.listdir(root)):
+                if name.endswith(".parquet"):
+                    FMISID, sensor_id = name[:-len(".parquet")].split("_")
+                    stations.append((int(FMISID), None if sensor_id == "default" else int(sensor_id)))
+
+    parts = []
+    for FMISID, sensor_id in stations:
+        events, _ = _load(FMISID, sensor_id, root)
+        if events.empty:
+            continue
+        keep = events["total_mm"] >= min_mm
+        if start is not None:
+            keep &= events["end"] >= start
+        if end is not None:
+            keep &= events["start"] < end
+        parts.append(events[keep])
+
+    if not parts:
+        return pd.DataFrame(columns=EVENT_COLUMNS)
+    return pd.concat(parts).sort_values(["start", "fmisid"], kind="stable").reset_index(drop=True)
+
+
+def main(argv: list[str] = None) -> int:
+    from stations import PLACES, place_station
+
+    parser = argparse.ArgumentParser(description="Build or query the icing event index.")
+    parser.add_argument("command", choices=["build", "query"])
+    parser.add_argument("--start", help="start time (UTC), e.g. 2025-01-01")
+    parser.add_argument("--end", help="end time (UTC), exclusive")
+    parser.add_argument("--min-mm", type=float, default=0.0, help="smallest total of a listed event (query)")
+    args = parser.parse_args(argv)
+
+    start = pd.Timestamp(args.start) if args.start else None
+    end = pd.Timestamp(args.end) if args.end else None
+    if args.command == "build":
+        if start is None or end is None:
+            parser.error("build needs --start and --end")
+        failures = build_event_index([place_station(place) for place in PLACES], start, end)
+        for key, error in failures.items():
+            print(f"Failed: {key[0]}: {error}")
+        return 1 if failures else 0
+
+    events = query_events(start, end, args.min_mm)
+    print(events.to_string(index=False) if not events.empty else "No events.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,264 @@
+"""
+frame_store.py
+
+Process-wide store of computed station frames shared by all Streamlit sessions.
+Sessions keep only FrameHandle objects, the frame itself exists once per distinct
+(FMISID, sensor_id, starttime, endtime, profile, float32) key however many sessions
+look at it. Entries are reference counted: a frame held by a session is never
+evicted, and when the total size exceeds the limit the least recently used
+unreferenced frames are dropped. A handle releases its reference when release()
+is called or when it is garbage collected, e.g. when the session ends.
+
+Frames of ranges whose data can still change (result_cache.is_recent_range) expire
+after RECENT_TTL_SECONDS like in the result cache. An expired frame is loaded again
+on the next acquire, and sessions holding it see it through FrameHandle.expired.
+
+Loading is single-flight: if several sessions ask for the same key at the same
+time, one of them loads it and the others wait for that result instead of
+downloading and computing it again.
+
+Frames are shared objects and must not be modified.
+
+Classes:
+- FrameStore: Viitelaskettu, muistirajattu säilö jaetuille DataFrameille.
+- FrameHandle: Session kevyt viittaus säilön DataFrameen.
+
+Functions:
+- get_frame_store(): Palauttaa prosessin yhteisen säilön.
+"""
+
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+import pandas as pd
+from result_cache import frame_nbytes, is_recent_range, RECENT_TTL_SECONDS
+
+FRAME_STORE_MAX_BYTES = int(os.environ.get("ICING_FRAME_STORE_MB", "1024")) * 1024 * 1024
+
+
+class FrameHandle:
+    """Reference to a frame in a FrameStore, released when dropped."""
+
+    __slots__ = ("key", "_entry", "_finalizer", "__weakref__")
+
+    def __init__(self, store: "FrameStore", key: tuple, entry: "_Entry"):
+        self.key = key
+        self._entry = entry
+        self._finalizer = weakref.finalize(self, store._release, key, entry)
+
+    @property
+    def frame(self) -> pd.DataFrame:
+        """The shared frame, must not be modified."""
+        return self._entry.frame
+
+    @property
+    def expired(self) -> bool:
+        """True when the frame is out of date and acquire would load it again."""
+        return self._entry.expired()
+
+    def release(self):
+        """Releases the reference. Calling again does nothing."""
+        self._finalizer()
+
+
+class _Entry:
+    __slots__ = ("frame", "nbytes", "refs", "expires_at")
+
+    def __init__(self, frame: pd.DataFrame, nbytes: int, expires_at: float = None):
+        self.frame = frame
+        self.nbytes = nbytes
+        self.refs = 0
+        self.expires_at = expires_at
+
+    def expired(self) -> bool:
+        return self.expires_at is not None and self.expires_at <= time.monotonic()
+
+
+class _Loading:
+    """A key being loaded by another caller."""
+
+    __slots__ = ("done", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+
+class FrameStore:
+    """Thread-safe reference-counted frame store, bounded by the bytes of unreferenced frames."""
+
+    def __init__(
+        self,
+        max_bytes: int = FRAME_STORE_MAX_BYTES,
+        recent_ttl: float = RECENT_TTL_SECONDS,
+        sizeof=frame_nbytes
+    ):
+        self.max_bytes = max_bytes
+        self.recent_ttl = recent_ttl
+        self._sizeof = sizeof
+        # Järjestys on LRU-järjestys: vanhin käytetty ensimmäisenä.
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._bytes = 0
+        # RLock, koska kahvan vapautus voi käynnistyä roskienkeruusta kesken lukon hallussa olevaa koodia.
+        self._lock = threading.RLock()
+        self._hits = 0
+        self._loads = 0
+        self._waits = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def acquire(
+        self,
+        keys: list[tuple],
+        loader,
+        endtime: str = None
+    ) -> tuple[dict[tuple, FrameHandle], dict[tuple, str]]:
+        """
+        Returns handles to the frames of keys, loading the missing ones.
+
+        Args:
+            keys (list): Frame keys.
+            loader (callable): Called as loader(missing_keys) and returns (frames, failures),
+                frames mapping key -> DataFrame and failures key -> error message, like
+                fetch_icing_batch. Keys missing from both are reported as failures.
+            endtime (str): End of the range of the keys in format YYYYMMDDTHHMM. Frames
+                of recent ranges (is_recent_range) expire after recent_ttl. None never expires.
+
+        Returns:
+            tuple: (handles, failures), handles maps key -> FrameHandle.
+        """
+        handles = {}
+        failures = {}
+        to_load = []
+        to_wait = {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                entry = self._entries.get(key)
+                if entry is not None and entry.expired():
+                    # Vanhentunut kehys ladataan uudelleen, sitä pitävät sessiot saavat uuden seuraavalla kerralla.
+                    self._drop(key)
+                    self._expirations += 1
+                    entry = None
+                if entry is not None:
+                    self._hits += 1
+                    handles[key] = self._handle(key, entry)
+                elif key in self._loading:
+                    self._waits += 1
+                    to_wait[key] = self._loading[key]
+                else:
+                    self._loading[key] = _Loading()
+                    to_load.append(key)
+
+        if to_load:
+            try:
+                frames, load_failures = loader(to_load)
+            except BaseException as e:
+                # Odottajat saavat virheen, eikä avain jää lataustilaan.
+                self._finish(to_load, {}, {key: str(e) for key in to_load}, None)
+                raise
+            expires_at = None
+            if endtime is not None and is_recent_range(endtime):
+                expires_at = time.monotonic() + self.recent_ttl
+            handles.update(self._finish(to_load, frames, load_failures, expires_at))
+            failures.update({key: load_failures.get(key, "no result") for key in to_load if key not in handles})
+
+        retry = []
+        for key, loading in to_wait.items():
+            loading.done.wait()
+            if loading.error is not None:
+                failures[key] = loading.error
+                continue
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    handles[key] = self._handle(key, entry)
+                else:
+                    retry.append(key)
+        if retry:
+            # Harvinainen tapaus: valmis kehys ehdittiin poistaa ennen kuin sitä ehdittiin käyttää.
+            more, more_failures = self.acquire(retry, loader, endtime)
+            handles.update(more)
+            failures.update(more_failures)
+
+        return handles, failures
+
+    def _finish(
+        self,
+        keys: list[tuple],
+        frames: dict,
+        failures: dict,
+        expires_at: float
+    ) -> dict[tuple, FrameHandle]:
+        """Stores loaded frames, wakes up the waiting callers and returns the loader's handles."""
+        handles = {}
+        sizes = {key: self._sizeof(frames[key]) for key in keys if key in frames and key not in failures}
+        with self._lock:
+            for key in keys:
+                loading = self._loading.pop(key)
+                if key in sizes:
+                    entry = _Entry(frames[key], sizes[key], expires_at)
+                    self._entries[key] = entry
+                    self._bytes += entry.nbytes
+                    self._loads += 1
+                    handles[key] = self._handle(key, entry)
+                else:
+                    loading.error = failures.get(key, "no result")
+                loading.done.set()
+            self._evict()
+        return handles
+
+    def _handle(self, key: tuple, entry: _Entry) -> FrameHandle:
+        # Kutsutaan lukko hallussa.
+        entry.refs += 1
+        self._entries.move_to_end(key)
+        return FrameHandle(self, key, entry)
+
+    def _release(self, key: tuple, entry: _Entry):
+        with self._lock:
+            entry.refs -= 1
+            # Vanhentuneen kehyksen tilalle ladattu uusi kehys on eri merkintä, sen viitteisiin ei kosketa.
+            if entry.refs == 0 and self._entries.get(key) is entry:
+                self._evict()
+
+    def _drop(self, key: tuple):
+        # Kutsutaan lukko hallussa.
+        entry = self._entries.pop(key)
+        self._bytes -= entry.nbytes
+
+    def _evict(self):
+        """Drops unreferenced frames, least recently used first, until the size fits the limit."""
+        # Kutsutaan lukko hallussa.
+        if self._bytes <= self.max_bytes:
+            return
+        for key in [key for key, entry in self._entries.items() if entry.refs == 0]:
+            if self._bytes <= self.max_bytes:
+                break
+            self._drop(key)
+            self._evictions += 1
+
+    def stats(self) -> dict:
+        """Returns entry counts, sizes and hit, load, wait, eviction and expiration counters."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "referenced": sum(1 for entry in self._entries.values() if entry.refs),
+                "references": sum(entry.refs for entry in self._entries.values()),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "loads": self._loads,
+                "waits": self._waits,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+            }
+
+
+_store = FrameStore()
+
+
+def get_frame_store() -> FrameStore:
+    """Returns the process-wide frame store."""
+    return _store
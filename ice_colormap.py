@@ -0,0 +1,61 @@
+"""
+ice_colormap.py
+
+Precomputed lookup table of the cmocean "ice" colormap used for the map markers,
+so drawing the map does not import cmocean and matplotlib. ICE_COLORS[i] is
+matplotlib.colors.to_hex(cmocean.cm.ice(i)), the same color cmocean.cm.ice(x)
+gives for every x in [i / 256, (i + 1) / 256).
+
+Regenerate after a cmocean update with:
+
+    python ice_colormap.py > ice_colormap_new.py
+"""
+
+ICE_COLORS = (
+    "#040613", "#050614", "#050715", "#060817", "#070918", "#080a1a", "#090b1b", "#0a0c1d",
+    "#0b0d1e", "#0c0d1f", "#0d0e21", "#0e0f22", "#0f1024", "#101125", "#111227", "#121328",
+    "#13132a", "#14142b", "#15152c", "#16162e", "#17172f", "#171831", "#181832", "#191934",
+    "#1a1a35", "#1b1b37", "#1c1c38", "#1d1c3a", "#1e1d3b", "#1f1e3d", "#1f1f3e", "#201f40",
+    "#212041", "#222143", "#232244", "#242246", "#252347", "#252449", "#26254a", "#27254c",
+    "#28264e", "#29274f", "#292851", "#2a2852", "#2b2954", "#2c2a55", "#2c2b57", "#2d2b59",
+    "#2e2c5a", "#2f2d5c", "#2f2e5e", "#302f5f", "#312f61", "#313062", "#323164", "#333266",
+    "#333267", "#343369", "#35346b", "#35356c", "#36356e", "#363670", "#373771", "#383873",
+    "#383975", "#393976", "#393a78", "#3a3b7a", "#3a3c7b", "#3a3d7d", "#3b3e7f", "#3b3e80",
+    "#3c3f82", "#3c4084", "#3c4185", "#3d4287", "#3d4389", "#3d448a", "#3e458c", "#3e468d",
+    "#3e478f", "#3e4890", "#3e4992", "#3e4993", "#3f4a95", "#3f4b96", "#3f4c97", "#3f4e99",
+    "#3f4f9a", "#3f509b", "#3f519d", "#3f529e", "#3f539f", "#3f54a0", "#3f55a1", "#3f56a2",
+    "#3f57a3", "#3f58a4", "#3f59a5", "#3e5aa6", "#3e5ca7", "#3e5da8", "#3e5ea9", "#3e5faa",
+    "#3e60ab", "#3e61ab", "#3e62ac", "#3e63ad", "#3e65ad", "#3e66ae", "#3e67af", "#3e68af",
+    "#3e69b0", "#3e6ab0", "#3f6bb1", "#3f6cb2", "#3f6eb2", "#3f6fb3", "#3f70b3", "#3f71b4",
+    "#4072b4", "#4073b4", "#4074b5", "#4075b5", "#4176b6", "#4178b6", "#4279b7", "#427ab7",
+    "#427bb7", "#437cb8", "#437db8", "#447eb9", "#447fb9", "#4580b9", "#4581ba", "#4682ba",
+    "#4684bb", "#4785bb", "#4786bb", "#4887bc", "#4988bc", "#4989bc", "#4a8abd", "#4b8bbd",
+    "#4b8cbd", "#4c8dbe", "#4d8ebe", "#4e8fbf", "#4e90bf", "#4f91bf", "#5092c0", "#5194c0",
+    "#5195c0", "#5296c1", "#5397c1", "#5498c2", "#5599c2", "#559ac2", "#569bc3", "#579cc3",
+    "#589dc3", "#599ec4", "#5a9fc4", "#5ba0c5", "#5ca1c5", "#5da2c5", "#5ea3c6", "#5fa4c6",
+    "#5fa6c7", "#60a7c7", "#61a8c7", "#62a9c8", "#63aac8", "#64abc9", "#65acc9", "#67adc9",
+    "#68aeca", "#69afca", "#6ab0cb", "#6bb1cb", "#6cb2cb", "#6db3cc", "#6eb4cc", "#6fb5cd",
+    "#71b6cd", "#72b8ce", "#73b9ce", "#74bace", "#75bbcf", "#77bccf", "#78bdd0", "#79bed0",
+    "#7bbfd0", "#7cc0d1", "#7dc1d1", "#7fc2d2", "#80c3d2", "#82c4d3", "#83c5d3", "#85c6d3",
+    "#86c7d4", "#88c8d4", "#89c9d5", "#8bcad5", "#8ccbd6", "#8eccd6", "#90cdd7", "#92ced7",
+    "#93cfd8", "#95d0d8", "#97d1d9", "#99d2d9", "#9ad3da", "#9cd4da", "#9ed5db", "#a0d6dc",
+    "#a2d6dc", "#a4d7dd", "#a6d8de", "#a8d9de", "#a9dadf", "#abdbe0", "#addce0", "#afdde1",
+    "#b1dee2", "#b3dfe3", "#b5e0e3", "#b7e1e4", "#b9e2e5", "#bae3e6", "#bce4e7", "#bee5e7",
+    "#c0e6e8", "#c2e6e9", "#c4e7ea", "#c6e8eb", "#c8e9ec", "#c9eaed", "#cbebee", "#cdecef",
+    "#cfedef", "#d1eef0", "#d3eff1", "#d5f0f2", "#d6f1f3", "#d8f2f4", "#daf3f5", "#dcf4f6",
+    "#def5f7", "#e0f6f8", "#e1f7f9", "#e3f9fa", "#e5fafb", "#e7fbfb", "#e8fcfc", "#eafdfd",
+)
+
+
+if __name__ == "__main__":
+    import numpy as np
+    import cmocean
+    import matplotlib.colors as mcolors
+
+    cmap = cmocean.cm.ice
+    colors = [mcolors.to_hex(rgba) for rgba in cmap(np.arange(cmap.N))]
+    with open(__file__, encoding="utf-8") as f:
+        source = f.read()
+    head, rest = source.split("ICE_COLORS = (\n", 1)
+    rows = ["    " + ", ".join(f'"{color}"' for color in colors[i:i + 8]) + "," for i in range(0, len(colors), 8)]
+    print(head + "ICE_COLORS = (\n" + "\n".join(rows) + "\n)" + rest.split("\n)", 1)[1], end="")
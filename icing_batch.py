@@ -0,0 +1,346 @@
+"""
+icing_batch.py
+
+Batch version of calculate_icing for many stations at once. All stations are aligned
+onto one shared 1-minute grid as a stations x minutes NumPy array, and every step of
+calculate_icing is done as whole-array operations along the time axis:
+
+- trailing 15 min minimum of the previous minutes (shift(1) + rolling '15min1s')
+- centered 10 min mean of NFC_orig (rolling '10min1s', center=True)
+- NFC, threshold filter and the mm conversions
+- melt-gap filling (fill_melt_gaps) and the cumulative sums
+
+On the grid the time windows become fixed offsets: the windowed means are differences
+of cumulative sums and the trailing minimum is built by doubling the window, so every
+step is O(minutes) for all stations together instead of one pandas call per station.
+For the regular 1-minute series FMI returns the result equals calculate_icing up to
+floating point rounding in the rolling mean. calculate_icing works on rows: its
+shift(1) treats the rows on both sides of an absent minute as consecutive, while on
+the grid the absent minute is NaN. Stations that are missing rows (absent, not NaN)
+or whose timestamps are not on whole minutes therefore fall back to calculate_icing,
+so the result always equals it. FMI returns a row for every minute of the range, so
+the fallback is rare.
+
+Functions:
+- calculate_icing_batch(frames, profile, float32): Laskee jäätämismuuttujat kaikille asemille kerralla.
+- calibration_sweep(frames, thresholds, min_minutes, mean_minutes, mm_per_hz, start, end, freq): Laskee kertymät
+  kaikille parametriyhdistelmille yhdellä kertaa, parametreista riippumattomat vaiheet jaetaan.
+"""
+
+import logging
+import numpy as np
+import pandas as pd
+from data_fetchers import calculate_icing, select_output, DERIVED_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# Liukuva minimi ajanhetkelle t lasketaan edeltävistä arvoista t-16min ... t-1min
+# (shift(1) ja ikkuna '15min1s', joka sisältää rivit t-15min ... t).
+MIN_WINDOW = 16
+# Keskitetty '10min1s' keskiarvo sisältää rivit t-5min ... t+5min.
+MEAN_HALF_WINDOW = 5
+# Täyttö: viimeisin ei-NaN-arvo korkeintaan 15 min vanha, keskiarvo ikkunasta [t_valid - 15min, t_valid].
+GAP_MINUTES = 15
+RAIN_NOISE_THRESHOLD = 0.17
+MM_PER_HZ = 0.00381
+
+
+def _shift(a: np.ndarray, k: int) -> np.ndarray:
+    """Shifts a stations x minutes array k minutes forward in time, padding with NaN."""
+    out = np.full_like(a, np.nan)
+    out[:, k:] = a[:, :-k]
+    return out
+
+
+def _trailing_min(fz: np.ndarray, width: int = MIN_WINDOW) -> np.ndarray:
+    """Minimum of the width previous minutes, NaN-skipping like rolling().min()."""
+    # Ikkunan minimi tuplaamalla: 1 -> 2 -> 4 -> 8 -> 16 minuuttia, fmin ohittaa NaN-arvot.
+    # Muun kuin kahden potenssin levyinen ikkuna yhdistetään kahdesta päällekkäisestä ikkunasta.
+    result = fz
+    span = 1
+    while span * 2 <= width:
+        result = np.fmin(result, _shift(result, span))
+        span *= 2
+    if span < width:
+        result = np.fmin(result, _shift(result, width - span))
+    return _shift(result, 1)
+
+
+def _window_mean(a: np.ndarray, before: int, after: int) -> np.ndarray:
+    """NaN-skipping mean of the window [t - before, t + after], NaN where the window has no values."""
+    width = before + after + 1
+    rows, n = a.shape
+    # Reunat täytetään NaN-arvoilla ja lasketaan kumulatiiviset summat,
+    # jolloin jokaisen ikkunan summa on kahden alkion erotus.
+    padded = np.full((rows, n + width - 1), np.nan)
+    padded[:, before:before + n] = a
+    valid = ~np.isnan(padded)
+    sums = np.zeros((rows, n + width))
+    np.cumsum(np.where(valid, padded, 0.0), axis=1, out=sums[:, 1:])
+    counts = np.zeros((rows, n + width), dtype=np.int32)
+    np.cumsum(valid, axis=1, out=counts[:, 1:])
+
+    total = sums[:, width:] - sums[:, :-width]
+    count = counts[:, width:] - counts[:, :-width]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(count > 0, total / count, np.nan)
+
+
+def _fill_melt_gaps(values: np.ndarray, present: np.ndarray) -> np.ndarray:
+    """Array version of fill_melt_gaps for a stations x minutes grid."""
+    missing = np.isnan(values) & present
+    if not missing.any():
+        return values
+
+    positions = np.arange(values.shape[1])
+    latest_valid = np.maximum.accumulate(np.where(np.isnan(values), -1, positions), axis=1)
+
+    # Keskiarvo ikkunasta [t_valid - 15min, t_valid] jokaiselle sarakkeelle kerralla.
+    window_means = _window_mean(values, GAP_MINUTES, 0)
+
+    fillable = missing & (latest_valid >= 0) & (positions - latest_valid <= GAP_MINUTES)
+    rows, cols = np.nonzero(fillable)
+    filled = values.copy()
+    filled[rows, cols] = window_means[rows, latest_valid[rows, cols]]
+    return filled
+
+
+def _cumsum(values: np.ndarray, ffill: bool) -> np.ndarray:
+    """pandas cumsum (NaN skipped), optionally followed by ffill, along the time axis."""
+    valid = ~np.isnan(values)
+    cumul = np.cumsum(np.where(valid, values, 0.0), axis=1)
+    if ffill:
+        return np.where(np.logical_or.accumulate(valid, axis=1), cumul, np.nan)
+    return np.where(valid, cumul, np.nan)
+
+
+def _grid(frames: dict) -> tuple:
+    """
+    Aligns minute frames onto one shared grid.
+
+    Returns:
+        tuple: (keys, grid, fz, present, positions), fz and present are
+            stations x minutes arrays and positions the grid positions of each frame's rows.
+    """
+    start = min(df.index[0] for df in frames.values())
+    end = max(df.index[-1] for df in frames.values())
+    grid = pd.date_range(start, end, freq="min")
+
+    keys = list(frames)
+    fz = np.full((len(keys), len(grid)), np.nan)
+    present = np.zeros(fz.shape, dtype=bool)
+    positions = []
+    for row, key in enumerate(keys):
+        df = frames[key]
+        pos = grid.get_indexer(df.index)
+        fz[row, pos] = df["fzfreq"].to_numpy(dtype=float)
+        present[row, pos] = True
+        positions.append(pos)
+    return keys, grid, fz, present, positions
+
+
+def _on_grid(df: pd.DataFrame) -> bool:
+    """True if the frame's rows are unique whole minutes, so it can be put on the grid."""
+    return (df.index == df.index.floor("min")).all() and df.index.is_unique
+
+
+def _complete(df: pd.DataFrame) -> bool:
+    """True if an on-grid frame has a row for every minute between its first and last row."""
+    return len(df) == (df.index[-1] - df.index[0]) // pd.Timedelta(minutes=1) + 1
+
+
+def calculate_icing_batch(
+    frames: dict,
+    profile: str = "full",
+    float32: bool = False
+) -> dict:
+    """
+    Calculates the icing variables for many stations with array operations.
+
+    Args:
+        frames (dict): key -> raw frame indexed by utctime with a fzfreq column,
+            e.g. the frames returned by fetch_raw_stations.
+        profile (str): Output profile, see select_output.
+        float32 (bool): Float32 output mode, see select_output.
+
+    Returns:
+        dict: key -> frame equal to calculate_icing of the station's frame.
+            Empty input frames are returned as they are.
+    """
+    results = {}
+    grid_frames = {}
+    for key, df in frames.items():
+        if df.empty:
+            results[key] = df
+        elif _on_grid(df) and _complete(df):
+            grid_frames[key] = df
+        else:
+            # Puuttuvat rivit tai epätasaiset minuutit: rivipohjainen shift(1) ei vastaa ruudukkoa.
+            results[key] = calculate_icing(df.copy(), profile, float32)
+
+    if not grid_frames:
+        return results
+
+    keys, grid, fz, present, positions = _grid(grid_frames)
+
+    # Samat vaiheet kuin calculate_icing:ssä, mutta kaikille asemille kerralla.
+    # Tulokset kirjoitetaan yhteen (sarakkeet x asemat x minuutit) -taulukkoon,
+    # josta kunkin aseman DataFrame saadaan ilman sarakekohtaisia kopioita.
+    out = np.empty((len(DERIVED_COLUMNS), len(keys), len(grid)))
+    columns = {column: out[i] for i, column in enumerate(DERIVED_COLUMNS)}
+
+    columns["moving_minimun_15minutes"][:] = _trailing_min(fz)
+    np.subtract(columns["moving_minimun_15minutes"], fz, out=columns["NFC_orig"])
+    # Keskiarvo vain aseman omille riveille, ruudukon täyterivit jäävät NaN-arvoiksi.
+    columns["NFC_mean_10min"][:] = np.where(
+        present, _window_mean(columns["NFC_orig"], MEAN_HALF_WINDOW, MEAN_HALF_WINDOW), np.nan)
+    np.maximum(columns["NFC_orig"], 0, out=columns["NFC"])
+    with np.errstate(invalid="ignore"):
+        columns["NFC_filtered"][:] = np.where(
+            columns["NFC_mean_10min"] < RAIN_NOISE_THRESHOLD, 0, columns["NFC_mean_10min"])
+    np.multiply(columns["NFC_orig"], MM_PER_HZ, out=columns["mm_orig"])
+    columns["cumul_mm_orig"][:] = _cumsum(columns["mm_orig"], ffill=False)
+    np.multiply(columns["NFC_mean_10min"], MM_PER_HZ, out=columns["mm_mean_10min"])
+    columns["cumul_mm_mean_10min"][:] = _cumsum(columns["mm_mean_10min"], ffill=False)
+    columns["mm_instant"][:] = _fill_melt_gaps(columns["NFC"] * MM_PER_HZ, present)
+    columns["cumul_mm"][:] = _cumsum(columns["mm_instant"], ffill=True)
+    columns["mm_instant_filtered"][:] = _fill_melt_gaps(columns["NFC_filtered"] * MM_PER_HZ, present)
+    columns["cumul_mm_filtered"][:] = _cumsum(columns["mm_instant_filtered"], ffill=True)
+
+    for row, key in enumerate(keys):
+        df = grid_frames[key]
+        pos = positions[row]
+        # Yhtenäinen ajanjakso (tavallinen tapaus) saadaan viipaleena, muuten indeksoidaan.
+        if pos[-1] - pos[0] + 1 == len(pos):
+            block = out[:, row, pos[0]:pos[-1] + 1]
+        else:
+            block = out[:, row, pos]
+        derived = pd.DataFrame(block.T, index=df.index, columns=DERIVED_COLUMNS, copy=False)
+        results[key] = select_output(pd.concat([df, derived], axis=1), profile, float32)
+
+    return {key: results[key] for key in frames}
+
+
+# Kalibroinnin ikkunoiden oletukset minuutteina kuten calculate_icing:ssä: minimi edeltävistä
+# 15 min (+1) arvoista ja keskitetty 10 min keskiarvo (t-5min ... t+5min).
+MIN_MINUTES = MIN_WINDOW - 1
+MEAN_MINUTES = 2 * MEAN_HALF_WINDOW
+# Yhdellä kertaa käsiteltävien (kynnysarvo, asema, minuutti) -solujen enimmäismäärä, rajaa muistinkäytön.
+SWEEP_MAX_CELLS = 20_000_000
+
+
+def _period_sums(values: np.ndarray, starts: np.ndarray, window: slice) -> np.ndarray:
+    """Sums the NaN-skipped values of the window columns over the periods beginning at starts."""
+    return np.add.reduceat(np.nan_to_num(values[:, window], nan=0.0), starts, axis=1)
+
+
+def calibration_sweep(
+    frames: dict,
+    thresholds: list[float] = (RAIN_NOISE_THRESHOLD,),
+    min_minutes: list[int] = (MIN_MINUTES,),
+    mean_minutes: list[int] = (MEAN_MINUTES,),
+    mm_per_hz: list[float] = (MM_PER_HZ,),
+    start: pd.Timestamp = None,
+    end: pd.Timestamp = None,
+    freq: str = "D"
+) -> pd.DataFrame:
+    """
+    Evaluates a grid of calculate_icing parameters for many stations in one pass.
+
+    The stations are put on the shared minute grid once. The trailing minimum and
+    NFC are computed once per min_minutes, the centered mean once per
+    (min_minutes, mean_minutes), and all thresholds are filtered, gap-filled and
+    summed together as one (thresholds x stations) x minutes array. The mm/Hz factor
+    only scales the sums, so it costs nothing. With the default values the sums
+    equal the mm_instant and mm_instant_filtered of calculate_icing_batch for stations
+    without missing rows. Absent minutes are NaN on the grid here, they are not
+    handed to calculate_icing like in calculate_icing_batch.
+
+    Args:
+        frames (dict): (FMISID, sensor_id) -> raw frame with fzfreq on whole minutes.
+        thresholds (list): Rain-noise thresholds of NFC_mean_10min (Hz).
+        min_minutes (list): Trailing minimum windows, the minimum for t is taken
+            over the min_minutes + 1 previous minutes (15 in calculate_icing).
+        mean_minutes (list): Centered mean windows, the mean for t is taken over
+            t - mean_minutes // 2 ... t + mean_minutes // 2 (10 in calculate_icing).
+        mm_per_hz (list): Frequency change to ice thickness factors.
+        start (pd.Timestamp): First minute summed, earlier rows are only context.
+        end (pd.Timestamp): Last minute summed (inclusive), later rows are only context.
+        freq (str): Period of the sums, "h" or "D", or None for one total over the range.
+
+    Returns:
+        pd.DataFrame: One row per station, period and parameter combination with the
+            columns fmisid, sensor_id, period, min_minutes, mean_minutes, threshold,
+            mm_per_hz, mm (sum of mm_instant) and mm_filtered (sum of mm_instant_filtered).
+    """
+    grid_frames = {}
+    for key, df in frames.items():
+        if df.empty:
+            continue
+        if _on_grid(df):
+            grid_frames[key] = df
+        else:
+            logger.warning("Calibration skips %s: rows are not on whole minutes", key)
+    if not grid_frames:
+        return pd.DataFrame(columns=[
+            "fmisid", "sensor_id", "period", "min_minutes", "mean_minutes",
+            "threshold", "mm_per_hz", "mm", "mm_filtered"])
+
+    keys, grid, fz, present, _ = _grid(grid_frames)
+    thresholds = np.asarray(thresholds, dtype=float)
+    factors = np.asarray(mm_per_hz, dtype=float)
+
+    # Summattava alue ja jaksojen alut sen sisällä.
+    first = grid.searchsorted(start) if start is not None else 0
+    last = grid.searchsorted(end, side="right") if end is not None else len(grid)
+    if first >= last:
+        raise ValueError("No rows between start and end")
+    window = slice(first, last)
+    if freq is None:
+        starts = np.array([0])
+        periods = grid[first:first + 1]
+    else:
+        labels = grid[window].floor(freq)
+        starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+        periods = labels[starts]
+
+    rows = len(keys)
+    # Kynnysarvot käsitellään ryhmissä, joiden solumäärä mahtuu SWEEP_MAX_CELLS:iin.
+    per_chunk = max(1, SWEEP_MAX_CELLS // max(1, rows * len(grid)))
+
+    parts = []
+    for minimum in dict.fromkeys(min_minutes):
+        nfc_orig = _trailing_min(fz, minimum + 1) - fz
+        # Suodattamaton kertymä riippuu vain minimin ikkunasta. Täyttö on lineaarinen,
+        # joten lasketaan hertseinä ja kerrotaan mm/Hz-kertoimilla vasta summista.
+        mm = _period_sums(_fill_melt_gaps(np.maximum(nfc_orig, 0), present), starts, window)
+
+        for mean in dict.fromkeys(mean_minutes):
+            half = mean // 2
+            nfc_mean = np.where(present, _window_mean(nfc_orig, half, half), np.nan)
+
+            filtered = np.empty((len(thresholds), rows, len(starts)))
+            for i in range(0, len(thresholds), per_chunk):
+                chunk = thresholds[i:i + per_chunk]
+                # (kynnysarvot x asemat) riveiksi, jolloin täyttö ja summat tehdään kaikille kerralla.
+                with np.errstate(invalid="ignore"):
+                    values = np.where(nfc_mean[None] < chunk[:, None, None], 0, nfc_mean[None])
+                values = _fill_melt_gaps(values.reshape(-1, len(grid)), np.tile(present, (len(chunk), 1)))
+                filtered[i:i + len(chunk)] = _period_sums(values, starts, window).reshape(len(chunk), rows, -1)
+
+            # Tulosrivit järjestyksessä (kerroin, kynnysarvo, asema, jakso).
+            shape = (len(factors), len(thresholds), rows, len(starts))
+            index = np.indices(shape).reshape(len(shape), -1)
+            parts.append(pd.DataFrame({
+                "fmisid": [keys[i][0] for i in index[2]],
+                "sensor_id": [keys[i][1] for i in index[2]],
+                "period": periods[index[3]],
+                "min_minutes": minimum,
+                "mean_minutes": mean,
+                "threshold": thresholds[index[1]],
+                "mm_per_hz": factors[index[0]],
+                "mm": (factors[:, None, None, None] * mm[None, None]).repeat(len(thresholds), axis=1).ravel(),
+                "mm_filtered": (factors[:, None, None, None] * filtered[None]).ravel(),
+            }))
+
+    return pd.concat(parts, ignore_index=True)
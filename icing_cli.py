@@ -0,0 +1,248 @@
+"""
+icing_cli.py
+
+Command-line batch computation of the icing variables, without the Streamlit UI.
+Stations are split into groups that are fetched and computed in a process pool
+(fetch_icing_season, so long ranges are streamed week by week), and every group's
+result is written as Hive-partitioned Parquet:
+
+    <output>/icing/fmisid=<FMISID>/date=<YYYY-MM-DD>/part-0.parquet
+    <output>/summary.parquet
+
+Rerunning the same stations and dates replaces their partitions, so the command
+can be used for nightly recomputation. Examples:
+
+    python icing_cli.py --start 2024-10-01 --end 2025-05-01 --output data/season
+    python icing_cli.py --stations Oulu Vantaa 101840 --start 2025-01-01 --end 2025-01-08 \\
+        --profile plot --float32 --workers 2 --output data/week
+    python icing_cli.py --start 2024-10-01 --end 2025-05-01 --resolution hourly --output data/season-hourly
+
+With --resolution the station files hold 10-minute, hourly or daily aggregates
+(resample_icing) instead of minute rows, the summary is always computed from the
+minute data.
+
+The exit code is 1 if any station failed to download.
+
+Functions:
+- run_batch(stations, start, end, output, workers, profile, float32, resolution): Laskee asemat prosessipoolissa ja kirjoittaa Parquet-tiedostot.
+- summarize(df): Palauttaa aseman yhteenvetorivin lasketusta datasta.
+"""
+
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as pa_ds
+from data_fetchers import fetch_icing_season, OUTPUT_PROFILES, STATIONS_PER_REQUEST
+from result_cache import get_result_cache
+from resample import resample_icing, RESOLUTIONS
+from stations import get_station_registry
+
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+
+
+def summarize(df: pd.DataFrame) -> dict:
+    """
+    Returns the summary row of one station's computed data.
+
+    Args:
+        df (pd.DataFrame): calculate_icing output of one station, not empty.
+
+    Returns:
+        dict: Covered period, row and valid minute counts and the final
+            accumulations of the range.
+    """
+    row = {
+        "first_time": df.index[0],
+        "last_time": df.index[-1],
+        "rows": len(df),
+        "valid_minutes": int(df["fzfreq"].notna().sum()),
+    }
+    # Kertymä on aikavälin viimeinen arvo, kuten kartalla.
+    for column in ("cumul_mm", "cumul_mm_filtered"):
+        if column in df.columns:
+            row[column] = float(df[column].iloc[-1])
+    return row
+
+
+def _write_station(df: pd.DataFrame, FMISID: int, output: str):
+    """Writes one station's rows partitioned by fmisid and UTC date, replacing earlier runs."""
+    df = df.reset_index()
+    df["fmisid"] = FMISID
+    df["date"] = df["utctime"].dt.strftime("%Y-%m-%d")
+    pa_ds.write_dataset(
+        pa.Table.from_pandas(df, preserve_index=False),
+        os.path.join(output, "icing"),
+        format="parquet",
+        partitioning=["fmisid", "date"],
+        partitioning_flavor="hive",
+        basename_template="part-{i}.parquet",
+        existing_data_behavior="delete_matching")
+
+
+def _init_worker():
+    # Jokainen asema lasketaan kerran, joten tulosvälimuisti vain kuluttaisi työprosessin muistia.
+    get_result_cache().max_bytes = 0
+
+
+def _run_group(
+    stations: list[tuple[int, int, str]],
+    starttime: str,
+    endtime: str,
+    output: str,
+    profile: str,
+    float32: bool,
+    resolution: str = "1min"
+) -> list[dict]:
+    """Fetches, computes and writes one group of stations, returns their summary rows."""
+    t0 = time.perf_counter()
+    keys = [(FMISID, sensor_id) for FMISID, sensor_id, _ in stations]
+    frames, failures = fetch_icing_season(keys, starttime, endtime, profile, float32)
+    # Aseman nimi ja sijainti tulevat yhteenvetoon rekisteristä, datatiedostoissa niitä ei toisteta.
+    meta = get_station_registry().get([FMISID for FMISID, _ in keys])
+
+    rows = []
+    for FMISID, sensor_id, place in stations:
+        row = {"fmisid": FMISID, "sensor_id": sensor_id, "place": place}
+        if FMISID in meta:
+            row.update(stationname=meta[FMISID]["stationname"], lat=meta[FMISID]["lat"], lon=meta[FMISID]["lon"])
+        df = frames.get((FMISID, sensor_id))
+        if (FMISID, sensor_id) in failures:
+            row.update(status="failed", error=failures[(FMISID, sensor_id)])
+        elif df is None or df.empty:
+            row.update(status="no data")
+        else:
+            _write_station(resample_icing(df, resolution), FMISID, output)
+            row.update(status="ok", **summarize(df))
+        rows.append(row)
+
+    seconds = time.perf_counter() - t0
+    for row in rows:
+        row["group_seconds"] = seconds
+    return rows
+
+
+def run_batch(
+    stations: list[tuple[int, int, str]],
+    start: pd.Timestamp,
+    end: pd.Timestamp,
+    output: str,
+    workers: int = DEFAULT_WORKERS,
+    profile: str = "full",
+    float32: bool = False,
+    resolution: str = "1min"
+) -> pd.DataFrame:
+    """
+    Computes the icing variables of the stations in a process pool and writes the results.
+
+    Stations are grouped like fetch_raw_stations groups requests, so one worker
+    downloads its group with shared requests.
+
+    Args:
+        stations (list): (FMISID, sensor_id, place) tuples.
+        start (pd.Timestamp): Start of the range (UTC).
+        end (pd.Timestamp): End of the range (UTC), inclusive.
+        output (str): Output directory.
+        workers (int): Size of the process pool, 1 runs in this process.
+        profile (str): Output profile of calculate_icing.
+        float32 (bool): Float32 output mode of calculate_icing.
+        resolution (str): Resolution of the written rows, see resample.RESOLUTIONS.
+
+    Returns:
+        pd.DataFrame: Summary table, one row per station, also written to summary.parquet.
+    """
+    starttime = start.strftime("%Y%m%dT%H%M")
+    endtime = end.strftime("%Y%m%dT%H%M")
+    os.makedirs(output, exist_ok=True)
+
+    # Ryhmissä sama sensor_id, kuten fetch_raw_stations niputtaa pyynnöt.
+    by_sensor = {}
+    for station in stations:
+        by_sensor.setdefault(station[1], []).append(station)
+    groups = [
+        group[i:i + STATIONS_PER_REQUEST]
+        for group in by_sensor.values()
+        for i in range(0, len(group), STATIONS_PER_REQUEST)
+    ]
+
+    rows = []
+    args = (starttime, endtime, output, profile, float32, resolution)
+    if workers <= 1 or len(groups) == 1:
+        _init_worker()
+        for group in groups:
+            rows.extend(_run_group(group, *args))
+            print(f"Done: {', '.join(place for _, _, place in group)}")
+    else:
+        # spawn kuten render_service: työprosessit eivät peri säikeitä tai avoimia yhteyksiä.
+        with ProcessPoolExecutor(
+                max_workers=min(workers, len(groups)),
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker) as executor:
+            futures = {executor.submit(_run_group, group, *args): group for group in groups}
+            for future in as_completed(futures):
+                rows.extend(future.result())
+                print(f"Done: {', '.join(place for _, _, place in futures[future])}")
+
+    # Yhteenveto samassa järjestyksessä kuin asemat annettiin.
+    by_key = {(row["fmisid"], row["sensor_id"]): row for row in rows}
+    summary = pd.DataFrame([by_key[(FMISID, sensor_id)] for FMISID, sensor_id, _ in stations])
+    summary.to_parquet(os.path.join(output, "summary.parquet"), index=False)
+    return summary
+
+
+def _parse_stations(names: list[str]) -> list[tuple[int, int, str]]:
+    """Resolves place names or FMISIDs to (FMISID, sensor_id, place)."""
+    from stations import PLACES, place_station
+
+    if not names:
+        names = list(PLACES)
+    by_id = {FMISID: place for place, FMISID in PLACES.items()}
+    stations = []
+    for name in names:
+        if name in PLACES:
+            place = name
+        elif name.isdigit():
+            place = by_id.get(int(name))
+            if place is None:
+                stations.append((int(name), None, name))
+                continue
+        else:
+            raise SystemExit(f"Unknown station: {name}. Use a place name or an FMISID.")
+        stations.append((*place_station(place), place))
+    return stations
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compute icing variables for many stations and write Parquet.")
+    parser.add_argument("--stations", nargs="*", default=None,
+                        help="place names or FMISIDs (default: all stations of the app)")
+    parser.add_argument("--start", required=True, help="start time (UTC), e.g. 2024-12-01 or 2024-12-01T06:00")
+    parser.add_argument("--end", required=True, help="end time (UTC), inclusive")
+    parser.add_argument("--output", required=True, help="output directory")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="size of the process pool")
+    parser.add_argument("--profile", default="full", choices=list(OUTPUT_PROFILES))
+    parser.add_argument("--float32", action="store_true", help="store the values as float32")
+    parser.add_argument("--resolution", default="1min", choices=list(RESOLUTIONS),
+                        help="write 10-minute, hourly or daily aggregates instead of minutes")
+    args = parser.parse_args(argv)
+
+    start = pd.Timestamp(args.start)
+    end = pd.Timestamp(args.end)
+    if start >= end:
+        parser.error("--start must be before --end")
+
+    summary = run_batch(
+        _parse_stations(args.stations), start, end, args.output, args.workers, args.profile, args.float32,
+        args.resolution)
+
+    columns = [c for c in ["place", "fmisid", "status", "rows", "cumul_mm", "cumul_mm_filtered"] if c in summary]
+    print(summary[columns].to_string(index=False))
+    return 1 if (summary["status"] == "failed").any() else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""
+icing_stream.py
+
+Incremental version of calculate_icing for near-real-time monitoring. New minutes of
+fzfreq are appended to an IcingStream, which recomputes only a short raw tail and
+carries the cumulative totals forward.
+
+A row depends on at most STREAM_CONTEXT of earlier raw data (15 min trailing minimum,
+centered 10 min mean, 15 + 15 min melt-gap look-back) and on CENTERED_LOOKAHEAD of
+later data (centered mean). Rows older than the look-ahead are final and are never
+recomputed. Concatenating everything returned by update() and flush() gives the same
+frame as calculate_icing on the whole series, up to floating point rounding in the
+rolling mean.
+
+Classes:
+- IcingStream: Ottaa vastaan uusia fzfreq-minuutteja ja päivittää johdetut sarakkeet ja kertymät.
+"""
+
+import numpy as np
+import pandas as pd
+from data_fetchers import calculate_icing
+
+# Raakadataa säilytetään näin pitkältä ajalta ennen ensimmäistä keskeneräistä riviä.
+STREAM_CONTEXT = pd.Timedelta(minutes=90)
+# Keskitetty 10 min keskiarvo riippuu 5 min tulevasta datasta, marginaaliksi 6 min.
+CENTERED_LOOKAHEAD = pd.Timedelta(minutes=6)
+
+# Kumulatiiviset sarakkeet, niiden lähdesarake ja täytetäänkö NaN-arvot edellisellä summalla (ffill).
+CUMULATIVE_COLUMNS = {
+    "cumul_mm_orig": ("mm_orig", False),
+    "cumul_mm_mean_10min": ("mm_mean_10min", False),
+    "cumul_mm": ("mm_instant", True),
+    "cumul_mm_filtered": ("mm_instant_filtered", True),
+}
+
+
+class IcingStream:
+    """
+    Stateful icing calculator for one station.
+
+    Usage:
+        stream = IcingStream()
+        final_rows = stream.update(new_raw)   # rows that will not change any more
+        live_tail = stream.provisional()      # newest rows, recomputed on next update
+        last_rows = stream.flush()            # end of data, finalizes the tail
+    """
+
+    def __init__(self):
+        self._raw = pd.DataFrame()
+        self._provisional = pd.DataFrame()
+        self._final_until = None
+        # Kertymien juokseva summa viimeiseen lopulliseen riviin asti ja onko summassa ollut yhtään arvoa.
+        self._totals = {column: 0.0 for column in CUMULATIVE_COLUMNS}
+        self._seen = {column: False for column in CUMULATIVE_COLUMNS}
+
+    @property
+    def final_until(self) -> pd.Timestamp:
+        """Time of the last final row, None before the first final row."""
+        return self._final_until
+
+    @property
+    def totals(self) -> dict:
+        """Cumulative totals at the last final row (NaN if nothing has accumulated)."""
+        return {
+            column: self._totals[column] if self._seen[column] else np.nan
+            for column in CUMULATIVE_COLUMNS
+        }
+
+    def provisional(self) -> pd.DataFrame:
+        """Returns the computed rows after final_until. They may change on the next update."""
+        return self._provisional
+
+    def update(self, new_raw: pd.DataFrame) -> pd.DataFrame:
+        """
+        Appends new raw rows and returns the rows that became final.
+
+        Args:
+            new_raw (pd.DataFrame): Raw frame indexed by utctime with a fzfreq column,
+                as returned by fetch_raw_stations. Rows must not be older than the
+                last final row.
+
+        Returns:
+            pd.DataFrame: Newly finalized rows with all calculate_icing columns.
+        """
+        if new_raw.empty:
+            return self._provisional.iloc[:0]
+
+        raw = pd.concat([self._raw, new_raw]) if not self._raw.empty else new_raw
+        raw = raw[~raw.index.duplicated(keep="last")].sort_index()
+        self._raw = raw
+
+        final_limit = raw.index.max() - CENTERED_LOOKAHEAD
+        return self._advance(final_limit)
+
+    def flush(self) -> pd.DataFrame:
+        """Finalizes all remaining rows as if the data ended here, like the batch path does."""
+        if self._raw.empty:
+            return self._provisional
+        return self._advance(self._raw.index.max())
+
+    def _advance(self, final_limit: pd.Timestamp) -> pd.DataFrame:
+        """Recomputes the buffered tail and commits the rows up to final_limit."""
+        df = calculate_icing(self._raw.copy())
+        if self._final_until is not None:
+            df = df.loc[df.index > self._final_until]
+        if df.empty:
+            self._provisional = df
+            return df
+
+        df = df.copy()
+        running = self._apply_totals(df)
+
+        n_final = int((df.index <= final_limit).sum())
+        final = df.iloc[:n_final]
+        self._provisional = df.iloc[n_final:]
+
+        if n_final:
+            for column, (cumul, seen) in running.items():
+                self._totals[column] = float(cumul[n_final - 1])
+                self._seen[column] = bool(seen[n_final - 1])
+            self._final_until = final.index.max()
+
+            # Raakadatasta säilytetään vain se osa, jota tulevat rivit vielä tarvitsevat.
+            self._raw = self._raw.loc[self._raw.index > self._final_until - STREAM_CONTEXT]
+
+        return final
+
+    def _apply_totals(self, df: pd.DataFrame) -> dict:
+        """
+        Rewrites the cumulative columns of df so that they continue from the carried totals.
+
+        Returns:
+            dict: column -> (running sum, seen flag) arrays, used to carry the state forward.
+        """
+        running = {}
+        for column, (source, ffill) in CUMULATIVE_COLUMNS.items():
+            values = df[source].to_numpy(dtype=float)
+            valid = ~np.isnan(values)
+            # Sama summausjärjestys kuin eräajossa: edellinen summa ensimmäiseksi alkioksi.
+            cumul = np.cumsum(np.concatenate(([self._totals[column]], np.where(valid, values, 0.0))))[1:]
+            seen = self._seen[column] | np.logical_or.accumulate(valid)
+            if ffill:
+                df[column] = np.where(seen, cumul, np.nan)
+            else:
+                df[column] = np.where(valid, cumul, np.nan)
+            running[column] = (cumul, seen)
+        return running
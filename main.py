@@ -1,31 +1,155 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 from datetime import datetime, time, timedelta, date
 from dateutil.relativedelta import relativedelta
-from data_fetchers import fetch_icedata
-from plotters import plot_icegraph, extract_station_info, plot_icing_map
-from streamlit_folium import st_folium
-from io import BytesIO
-import matplotlib.pyplot as plt
+from data_fetchers import fetch_icing_batch, fetch_icing_season
+from plotters import render_icing_map_html, station_points
+from rollup_store import iter_station_totals
+from event_index import build_event_index, query_events
+from render_service import render_graphs
+from resample import choose_resolution, get_resampled
+import perf
+from prefetch import PREFETCH_ENABLED, start_prefetch
+from frame_store import get_frame_store
+from result_cache import IcingResultCache
+from stations import PLACES, place_station
+
+# Tätä pidemmät aikavälit haetaan ja lasketaan paloittain, pisin sallittu aikaväli on koko jäätämiskausi.
+CHUNKED_RANGE = relativedelta(months=1)
+MAX_RANGE = relativedelta(months=7)
+
 
 def main():
     st.set_page_config(page_title="Icing Map And Graph", layout="centered")
+
+    # Taustahaku pitää kaikkien asemien viimeisimmät päivät valmiina, käynnistyy kerran prosessissa.
+    if PREFETCH_ENABLED:
+        start_prefetch([place_station(place) for place in PLACES])
+
+    # Suorituskykypaneeli: ajon vaiheiden kestot kerätään vain, kun paneeli on päällä.
+    if not st.sidebar.checkbox("Show performance panel", key="show_perf"):
+        run_app()
+        return
+
+    with perf.collect() as records:
+        run_app()
+    show_perf_panel(records)
+
+
+def show_perf_panel(records: list[dict]):
+    """Shows the stage timings of the current run in the sidebar."""
+    st.sidebar.subheader("Performance")
+    if not records:
+        st.sidebar.caption("Nothing was timed in this run.")
+        return
+    total = sum(record["seconds"] for record in records)
+    st.sidebar.caption(f"{len(records)} timed stages, {total:.2f} s in total")
+    st.sidebar.dataframe(perf.summary(records), hide_index=True)
+    with st.sidebar.expander("All records"):
+        st.dataframe(pd.DataFrame(records), hide_index=True)
+
+
+def fetch_graph_frames(stations: list[tuple[int, int]], starttime: str, endtime: str) -> dict:
+    """
+    Returns the graph columns (plot profile, float32) of the stations.
+
+    The frames live in the process-wide frame store, shared by all sessions. The
+    session keeps only the handles, so the frames stay in memory while it shows them.
+    The frame store is their only owner: frames computed here are not put into the
+    result cache, so memory is bounded by FRAME_STORE_MAX_BYTES and the frames in use.
+    Frames the prefetcher already put into the result cache are reused as they are.
+    Frames of recent ranges expire in the store, the session then drops its handle
+    and gets the reloaded frame.
+    """
+    def load(keys: list[tuple]) -> tuple[dict, dict]:
+        missing = [(FMISID, sensor_id) for FMISID, sensor_id, *_ in keys]
+        if pd.Timestamp(endtime) > pd.Timestamp(starttime) + CHUNKED_RANGE:
+            # Pitkä aikaväli haetaan viikon paloissa, jotta muistinkäyttö pysyy rajattuna.
+            progress_bar = st.progress(0.0, text="Fetching season data...")
+            frames, failures = fetch_icing_season(
+                missing, starttime, endtime, profile="plot", float32=True, cache_results=False,
+                progress=lambda done, total: progress_bar.progress(
+                    done / total, text=f"Fetching season data... {done}/{total} weeks"))
+            progress_bar.empty()
+        else:
+            frames, failures = fetch_icing_batch(
+                missing, starttime, endtime, profile="plot", float32=True, cache_results=False)
+        to_key = {(key[0], key[1]): key for key in keys}
+        return ({to_key[k]: df for k, df in frames.items()},
+                {to_key[k]: error for k, error in failures.items()})
+
+    # Sessioon ja säilöön tallennetaan vain kuvaajan tarvitsemat sarakkeet float32-muodossa.
+    keys = {
+        (FMISID, sensor_id): IcingResultCache.make_key(FMISID, sensor_id, starttime, endtime, "plot", True)
+        for FMISID, sensor_id in stations
+    }
+    held = st.session_state.graph_handles
+    for key in [key for key in keys.values() if key in held and held[key].expired]:
+        held.pop(key).release()
+    handles, _ = get_frame_store().acquire(
+        [key for key in keys.values() if key not in held], load, endtime)
+    held.update(handles)
+    return {station: held[key].frame for station, key in keys.items() if key in held}
+
+
+def show_events():
+    """Lists the icing episodes of the map stations and opens the graph of a chosen episode."""
+    st.subheader("Icing Events")
+    min_mm = st.number_input("Smallest event (mm):", min_value=0.0, value=0.1, step=0.1)
+    place_of = {(FMISID, sensor_id): place for place, FMISID, sensor_id in st.session_state.station_keys}
+    _, _, start_datetime, end_datetime = st.session_state.graph_range
+
+    if st.button("Find Events"):
+        with st.spinner("Finding events..."):
+            # Indeksoimattomat välit lasketaan kerran, sen jälkeen haku luetaan indeksistä.
+            start, end = pd.Timestamp(start_datetime), pd.Timestamp(end_datetime)
+            build_event_index(list(place_of), start, end)
+            st.session_state.events = query_events(start, end, min_mm, list(place_of))
+
+    events = st.session_state.get("events")
+    if events is None:
+        return
+    if events.empty:
+        st.info("No indexed events in the range.")
+        return
+
+    table = pd.DataFrame({
+        "Station": [place_of.get((FMISID, sensor_id), FMISID)
+                    for FMISID, sensor_id in zip(events["fmisid"], events["sensor_id"])],
+        "Start": events["start"], "End": events["end"],
+        "Icing (mm)": events["total_mm"].round(2), "Peak (mm/h)": events["peak_mm_h"].round(2),
+    })
+    st.dataframe(table, hide_index=True)
+
+    labels = [f"{place}: {start:%Y-%m-%d %H:%M}, {mm} mm"
+              for place, start, mm in zip(table["Station"], table["Start"], table["Icing (mm)"])]
+    chosen = st.selectbox("Select event to show graph:", range(len(labels)), format_func=labels.__getitem__)
+    if st.button("Show Event Graph"):
+        event = events.iloc[chosen]
+        # Kuvaaja näyttää jakson tunnin marginaaleilla, muut kuvaajat suljetaan, koska aikaväli vaihtuu.
+        # Jakson aikaväli pidetään omassa avaimessaan, jotta kartan aikaväli (ja tapahtumahaku) ei muutu.
+        start = (event["start"] - pd.Timedelta(hours=1)).floor("h").to_pydatetime()
+        end = (event["end"] + pd.Timedelta(hours=1)).ceil("h").to_pydatetime()
+        st.session_state.event_graph_range = (f"{start:%Y%m%dT%H%M}", f"{end:%Y%m%dT%H%M}", start, end)
+        st.session_state.graph_handles = {}
+        name = next(station["name"] for station, (_, FMISID, sensor_id)
+                    in zip(st.session_state.station_data, st.session_state.station_keys)
+                    if (FMISID, sensor_id) == (event["fmisid"], event["sensor_id"]))
+        st.session_state.shown_graphs = [name]
+
+
+def run_app():
     st.title("Icing On Map")
 
-    for key in ["show_map", "station_data", "figure_data", "selected_station", "shown_graphs"]:
+    for key in ["show_map", "station_data", "station_keys", "figure_data", "selected_station", "shown_graphs",
+                "graph_range", "event_graph_range"]:
         if key not in st.session_state:
-            st.session_state[key] = [] if "data" in key or key == "shown_graphs" else None
-
-    places = {
-        "Vantaa": 100968, "Turku": 101065, "Maarianhamina": 100907,
-        "Pori": 101044, "Tampere": 101118, "Halli": 101315, "Tikkakoski": 137208,
-        "Seinäjoki": 137188, "Vaasa": 101462, "Kruunupyy": 101662, "Siilinjärvi": 101570,
-        "Joensuu": 101608, "Utti": 101191, "Lappeenranta": 101237, "Savonlinna": 101430,
-        "Mikkeli": 855522, "Kajaani": 101725, "Oulu": 101786, "Kemi": 101840, "Kuusamo": 101886,
-        "Rovaniemi": 137190, "Ivalo": 102033, "Kittilä": 101986
-    }
+            st.session_state[key] = [] if "data" in key or key in ("shown_graphs", "station_keys") else None
+    if "graph_handles" not in st.session_state:
+        st.session_state.graph_handles = {}
 
-    places = dict(sorted(places.items()))
+    places = dict(sorted(PLACES.items()))
     place_options = ["All Stations"] + list(places.keys())
     selected_places = st.multiselect("Choose stations to plot:", place_options)
 
@@ -50,8 +174,8 @@ def main():
     if start_datetime >= end_datetime:
         st.error("Start Time must be before End Time.")
         return
-    if end_datetime > start_datetime + relativedelta(months=1):
-        st.error("Too long period (max 1 month).")
+    if end_datetime > start_datetime + MAX_RANGE:
+        st.error("Too long period (max 7 months).")
         return
 
     starttime = start_datetime.strftime("%Y%m%dT%H%M")
@@ -61,38 +185,72 @@ def main():
         st.session_state.show_map = True
         st.session_state.station_data = []
         st.session_state.figure_data = []
-        st.session_state.df_data = []
+        st.session_state.station_keys = []
         st.session_state.shown_graphs = []
+        st.session_state.events = None
+        st.session_state.event_graph_range = None
+        # Vanhat kahvat vapautuvat, kun niihin ei enää viitata.
+        st.session_state.graph_handles = {}
 
+        stations = [place_station(place) for place in selected_places]
+        place_of = dict(zip(stations, selected_places))
+        st.session_state.graph_range = (starttime, endtime, start_datetime, end_datetime)
+
+        # Asemat näytetään sitä mukaa kuin ne valmistuvat: tilataulukko ja esikatselukartta päivittyvät
+        # jokaisen aseman jälkeen, lopullinen kartta väreineen piirretään, kun kaikki ovat valmiita.
+        status_table = st.empty()
+        preview_map = st.empty()
+        status = pd.DataFrame({"Station": selected_places, "Status": "waiting", "Icing (mm)": np.nan})
+        totals = {}
+        failures = {}
         with st.spinner("Fetching data..."):
-            for i, place in enumerate(selected_places):
-                FMISID = places[place]
-                sensor_id = None
-                # print(f"{i}, {repr(place)}, {FMISID}, {sensor_id}")
-                # if place in ["Vantaa"]:
-                if place.strip().lower() == "vantaa":
-                    sensor_id = 37
-                    df = fetch_icedata(FMISID, starttime, endtime, place, sensor_id)
+            # Kartta tarvitsee vain kertymät, jotka saadaan tuntirollupeista prefiksisummina.
+            # Minuuttidata haetaan vasta, kun aseman kuvaaja avataan.
+            for key, station, error in iter_station_totals(stations, starttime, endtime):
+                place = place_of[key]
+                row = status["Station"] == place
+                if error is not None:
+                    failures[key] = error
+                    status.loc[row, "Status"] = "failed"
+                elif station is None:
+                    status.loc[row, "Status"] = "no data"
                 else:
-                    df = fetch_icedata(FMISID, starttime, endtime, place)
-                print(f"{i}, {place}, {FMISID}, {sensor_id}")
+                    totals[key] = station
+                    status.loc[row, ["Status", "Icing (mm)"]] = ["ok", round(station["value"], 1)]
 
-                if df is None or df.empty:
-                    st.warning(f"No data for {place}")
-                    continue
+                status_table.dataframe(status, hide_index=True)
+                if totals:
+                    preview_map.map(
+                        station_points(list(totals.values())),
+                        latitude="lat", longitude="lon", color="color", size=8000)
+        preview_map.empty()
+        status_table.empty()
+
+        for place, (FMISID, sensor_id) in zip(selected_places, stations):
+            if (FMISID, sensor_id) in failures:
+                st.warning(f"Download failed for {place}: {failures[(FMISID, sensor_id)]}")
+                continue
 
-                station = extract_station_info(df)
+            station = totals.get((FMISID, sensor_id))
 
-                # fig = plot_icegraph(df, place, FMISID, starttime, endtime)
+            if station is None:
+                st.warning(f"No data for {place}")
+                continue
 
-                st.session_state.station_data.append(station)
-                st.session_state.df_data.append((df, place, FMISID))
-                # st.session_state.figure_data.append(fig)
+            st.session_state.station_data.append(station)
+            st.session_state.station_keys.append((place, FMISID, sensor_id))
 
     if st.session_state.show_map and st.session_state.station_data:
         with st.spinner("Plotting map..."):
-            m = plot_icing_map(st.session_state.station_data)
-            st_folium(m, width=700, height=500)
+            with perf.stage("map", stations=len(st.session_state.station_data)):
+                # Komponentti tuodaan vasta kun kartta piirretään, jotta sovellus käynnistyy nopeasti.
+                # Valmis karttasivu tulee välimuistista, kun asemien arvot eivät ole muuttuneet.
+                from streamlit.components.v1 import html as show_html
+
+                show_html(render_icing_map_html(st.session_state.station_data), width=700, height=500)
+
+    if st.session_state.show_map and st.session_state.station_keys:
+        show_events()
 
     st.title("Icing Graph")
     station_names = sorted([station['name'] for station in st.session_state.station_data])
@@ -101,28 +259,48 @@ def main():
     col1, col2 = st.columns([1, 1])
     with col1:
         if st.button("Show Graph"):
+            if st.session_state.event_graph_range is not None:
+                # Palataan tapahtumakuvaajasta kartan aikaväliin.
+                st.session_state.event_graph_range = None
+                st.session_state.shown_graphs = []
+                st.session_state.graph_handles = {}
             if selected_station not in st.session_state.shown_graphs:
                 st.session_state.shown_graphs.append(selected_station)
     with col2:
         if st.button("Reset Graphs"):
             st.session_state.shown_graphs = []
+            st.session_state.graph_handles = {}
+            st.session_state.event_graph_range = None
 
     with st.spinner("Plotting graph..."):
+        shown = []
         for station_name in st.session_state.shown_graphs:
             idx = next((i for i, s in enumerate(st.session_state.station_data)
                         if s["name"] == station_name), None)
             if idx is not None:
-                df, place, FMISID = st.session_state.df_data[idx]
-                fig = plot_icegraph(
-                    df, place, FMISID, 
-                    start_datetime, 
-                    end_datetime
-                    )
-                # fig = st.session_state.figure_data[idx]
-                buf = BytesIO()
-                fig.savefig(buf, format="png")
-                buf.seek(0)
-                st.image(buf, caption=f"Icing Station: {station_name}", width='stretch')
+                shown.append((station_name, *st.session_state.station_keys[idx]))
+
+        jobs = []
+        names = []
+        if shown:
+            starttime, endtime, start_datetime, end_datetime = (
+                st.session_state.event_graph_range or st.session_state.graph_range)
+            icing_frames = fetch_graph_frames(
+                [(FMISID, sensor_id) for _, _, FMISID, sensor_id in shown], starttime, endtime)
+            # Pitkät aikavälit piirretään 10 min, tunnin tai vuorokauden koosteista.
+            resolution = choose_resolution(start_datetime, end_datetime)
+            for station_name, place, FMISID, sensor_id in shown:
+                df = icing_frames.get((FMISID, sensor_id))
+                if df is None or df.empty:
+                    st.warning(f"No graph data for {place}")
+                    continue
+                df = get_resampled(df, resolution)
+                jobs.append((df, place, FMISID, start_datetime, end_datetime, None, resolution))
+                names.append(station_name)
+
+        # Valmiit kuvat tulevat välimuistista, puuttuvat piirretään rinnakkain.
+        for station_name, image in zip(names, render_graphs(jobs)):
+            st.image(image, caption=f"Icing Station: {station_name}", width='stretch')
 
 if __name__ == "__main__":
     main()
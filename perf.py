@@ -0,0 +1,174 @@
+"""
+perf.py
+
+Lightweight per-stage timing for the fetch, compute and render pipeline. Code wraps
+each stage in perf.stage(name, **fields); the stage is timed with perf_counter and
+emitted as a flat record such as
+
+    {"stage": "download", "seconds": 0.412, "stations": 6, "bytes": 1843200}
+
+Records are collected for the current Streamlit run when perf.collect() is active
+(the sidebar performance panel) and written as JSON lines to the "icing.perf" logger
+when ICING_PERF_LOG=1 is set. When neither is on, stage() returns a shared no-op
+object, so the cost is one context variable lookup per stage.
+
+Worker threads do not inherit the collector automatically, so functions submitted to
+a thread pool are wrapped with perf.propagate().
+
+Functions:
+- stage(name, **fields): Palauttaa ajastimen vaiheelle, tai tyhjän olion kun mittaus ei ole päällä.
+- enabled(): Kertoo, kerätäänkö mittauksia tässä kontekstissa.
+- collect(): Kerää with-lohkon aikana syntyvät mittaukset listaan.
+- propagate(func): Sitoo funktion nykyiseen kontekstiin säiepoolia varten.
+- summary(records): Kokoaa mittaukset vaiheittain taulukoksi.
+"""
+
+import os
+import json
+import time
+import logging
+import functools
+import contextvars
+from contextlib import contextmanager
+import pandas as pd
+
+# Mittaukset lokiin JSON-riveinä, kun ICING_PERF_LOG=1.
+PERF_LOG = os.environ.get("ICING_PERF_LOG", "") not in ("", "0")
+
+logger = logging.getLogger("icing.perf")
+if PERF_LOG and not logger.handlers:
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+
+# Aktiivisen collect()-lohkon mittauslista, None kun mittauksia ei kerätä.
+_records = contextvars.ContextVar("icing_perf_records", default=None)
+
+
+class _Stage:
+    """Times one stage and emits its record on exit."""
+
+    __slots__ = ("name", "fields", "_t0")
+
+    def __init__(self, name: str, fields: dict):
+        self.name = name
+        self.fields = fields
+        self._t0 = 0.0
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def set(self, **fields):
+        """Adds fields (e.g. rows, bytes) that are known only at the end of the stage."""
+        self.fields.update(fields)
+
+    def __exit__(self, exc_type, exc, tb):
+        record = {"stage": self.name, "seconds": time.perf_counter() - self._t0, **self.fields}
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        _emit(record)
+        return False
+
+
+class _NoopStage:
+    """Stand-in returned by stage() when timing is off."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def set(self, **fields):
+        pass
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopStage()
+
+
+def enabled() -> bool:
+    """Returns True if stages are recorded in the current context."""
+    return PERF_LOG or _records.get() is not None
+
+
+def stage(name: str, **fields):
+    """
+    Returns a context manager that times one stage.
+
+    Args:
+        name (str): Stage name, e.g. "download", "parse", "calculate_icing".
+        **fields: Extra record fields such as station, rows or bytes. More can be
+            added inside the block with set().
+
+    Returns:
+        Context manager whose value has a set(**fields) method.
+    """
+    if not PERF_LOG and _records.get() is None:
+        return _NOOP
+    return _Stage(name, fields)
+
+
+def _emit(record: dict):
+    records = _records.get()
+    if records is not None:
+        # list.append on säieturvallinen, joten säiepoolin työt voivat lisätä samaan listaan.
+        records.append(record)
+    if PERF_LOG:
+        logger.info(json.dumps(record, default=str))
+
+
+@contextmanager
+def collect():
+    """
+    Collects the records of all stages run inside the block.
+
+    Yields:
+        list: Record dicts, appended to as stages finish.
+    """
+    records = []
+    token = _records.set(records)
+    try:
+        yield records
+    finally:
+        _records.reset(token)
+
+
+def propagate(func):
+    """
+    Binds func to a copy of the current context, so stages it runs in a worker
+    thread are recorded to the caller's collector. Returns func unchanged when
+    timing is off. Call once per submitted task, a context can be entered by only
+    one thread at a time.
+    """
+    if not enabled():
+        return func
+    return functools.partial(contextvars.copy_context().run, func)
+
+
+def summary(records: list[dict]) -> pd.DataFrame:
+    """
+    Sums the records per stage.
+
+    Args:
+        records (list): Records from collect().
+
+    Returns:
+        pd.DataFrame: One row per stage in first-seen order with count, total and
+            maximum seconds and the summed rows and bytes where recorded.
+    """
+    if not records:
+        return pd.DataFrame(columns=["stage", "count", "total_s", "max_s", "rows", "bytes"])
+    df = pd.DataFrame(records)
+    for column in ("rows", "bytes"):
+        if column not in df.columns:
+            df[column] = pd.NA
+    grouped = df.groupby("stage", sort=False)
+    return pd.DataFrame({
+        "count": grouped.size(),
+        "total_s": grouped["seconds"].sum(),
+        "max_s": grouped["seconds"].max(),
+        "rows": grouped["rows"].sum(min_count=1),
+        "bytes": grouped["bytes"].sum(min_count=1),
+    }).reset_index()
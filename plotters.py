@@ -4,17 +4,31 @@ plotters.py
 Contains functions for extracting station info, generating matplotlib graphs,
 and plotting icing data on a folium map. Also includes UI logic for selecting
 a station and displaying its graph below the map.
+
+folium, matplotlib and streamlit are imported inside the functions that use them,
+so importing this module (and main.py or the headless tools through it) stays fast
+and the plotting stack is loaded only when the first map or graph is drawn.
 """
 
-import folium
-from typing import TypedDict
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-import streamlit as st
+import os
+import threading
+from collections import OrderedDict
+from typing import TypedDict, TYPE_CHECKING
 import pandas as pd
-import cmocean
-import matplotlib.colors as mcolors
+import numpy as np
 from datetime import datetime, time, timedelta, date
+from ice_colormap import ICE_COLORS
+
+if TYPE_CHECKING:
+    import folium
+    from matplotlib.figure import Figure
+
+# Välimuistissa pidettävien karttasivujen määrä (yksi sivu on noin 10 kt + 0.3 kt/asema).
+MAP_HTML_CACHE_SIZE = int(os.environ.get("ICING_MAP_HTML_CACHE_SIZE", "32"))
+
+_map_html_cache: "OrderedDict[tuple, str]" = OrderedDict()
+_map_html_lock = threading.Lock()
+
 
 class StationInfo(TypedDict):
     name: str
@@ -23,114 +37,256 @@ class StationInfo(TypedDict):
     value: float
 
 
-def get_deep_color(value, max_value):
-    # Clampataan arvo välille [0.0, clamp_max]
-    clamp_max = max_value
-    clamped_value = min(max(value, 0.0), clamp_max)
+_ICE_COLORS = np.array(ICE_COLORS)
 
-    # Normalisoidaan arvo välille [0, 1]
-    normalized_value = clamped_value / clamp_max
 
-    # Käännetään järjestys
-    normalized_value = max(0.0, 1-normalized_value)
+def ice_colors(values, max_value: float) -> np.ndarray:
+    """
+    Maps icing values to hex colors of the reversed cmocean ice colormap in one pass.
 
-    # Haetaan deep-paletti cmoceanista
-    # cmap = cmocean.cm.deep
-    cmap = cmocean.cm.ice
-    # cmap = cmocean.cm.matter
+    Args:
+        values (array-like): Icing values (mm).
+        max_value (float): Value that gets the darkest color, larger values are clamped.
 
-    # Haetaan RGBA-väri
-    rgba = cmap(normalized_value)
+    Returns:
+        np.ndarray: Hex color string per value.
+    """
+    values = np.asarray(values, dtype=float)
+    # Normalisoidaan arvo välille [0, 1], kun kaikki arvot ovat nollia, käytetään vaaleinta väriä.
+    # NaN-arvot saavat tummimman värin kuten ennenkin (fmax ohittaa NaN:n).
+    if max_value > 0:
+        normalized = np.clip(values, 0.0, max_value) / max_value
+    else:
+        normalized = np.zeros_like(values)
 
-    # Muutetaan HEX-muotoon
-    hex_color = mcolors.to_hex(rgba)
+    # Käännetään järjestys
+    normalized = np.fmax(0.0, 1 - normalized)
 
-    return hex_color
+    # Haetaan väri valmiiksi lasketusta cmocean.cm.ice -taulukosta samalla indeksoinnilla
+    # kuin matplotlibin Colormap, jolloin cmoceania ja matplotlibia ei tarvitse tuoda.
+    index = np.minimum((normalized * len(_ICE_COLORS)).astype(int), len(_ICE_COLORS) - 1)
+    return _ICE_COLORS[index]
 
 
-def extract_station_info(df) -> StationInfo:
+def get_deep_color(value, max_value):
+    """Returns the hex color of one value, see ice_colors."""
+    # cmap = cmocean.cm.deep
+    # cmap = cmocean.cm.matter
+    return str(ice_colors([value], max_value)[0])
+
+
+def extract_station_info(df, meta: dict) -> StationInfo:
     """
-    Extracts station metadata and cumulative icing value from a DataFrame.
+    Combines station metadata with the cumulative icing value of a DataFrame.
 
     Args:
         df (pd.DataFrame): DataFrame containing station data.
+        meta (dict): Station metadata (stationname, lat, lon) from the station registry.
 
     Returns:
         StationInfo: Dictionary with name, lat, lon, and icing value.
     """
     return {
-        "name": df["stationname"].iloc[0],
-        "lat": float(df["lat"].iloc[0]),
-        "lon": float(df["lon"].iloc[0]),
+        "name": meta["stationname"],
+        "lat": float(meta["lat"]),
+        "lon": float(meta["lon"]),
         "value": float(df["cumul_mm_filtered"].iloc[-1])
     }
 
-def plot_icing_map(station_data: list[StationInfo]) -> folium.Map:
+def station_points(station_data: list[StationInfo]) -> pd.DataFrame:
+    """
+    Returns the stations as a table for a quick preview map (e.g. st.map).
+
+    Colors are scaled with the largest value among the given stations, so they
+    change while more stations arrive. plot_icing_map draws the final colors.
+
+    Args:
+        station_data (list): List of station dictionaries.
+
+    Returns:
+        pd.DataFrame: name, lat, lon, value (mm) and color (hex) per station.
     """
-    Creates a folium map with colored markers for each station.
+    points = pd.DataFrame(station_data, columns=["name", "lat", "lon", "value"])
+    max_value = points["value"].max() if not points.empty else 0.0
+    points["color"] = ice_colors(_round_values(points["value"]), max_value)
+    return points
+
+
+def _round_values(values) -> np.ndarray:
+    """Rounds the values to 0.1 mm as shown on the map."""
+    # Pythonin round pyöristää desimaaliesityksen mukaan samoin kuin tekstin muotoilu, np.round ei aina.
+    return np.array([round(float(value), 1) for value in values], dtype=float)
+
+def plot_icing_map(station_data: list[StationInfo]) -> "folium.Map":
+    """
+    Creates a folium map with a colored marker for each station.
     When a marker is clicked, the station name is shown in popup.
 
+    All markers are one GeoJSON layer whose colors are computed in one pass, so
+    the map stays light also with a dense station network.
+
     Args:
         station_data (list): List of station dictionaries.
 
     Returns:
         folium.Map: Map object with station markers.
     """
+    import folium
+
     m = folium.Map(location=[64.5, 23], zoom_start=5)
-    max_value = max(station['value'] for station in station_data)
-
-    for station in station_data:
-        value = station['value']
-        rounded_value = round(value, 1)
-        color = get_deep_color(rounded_value, max_value)
-
-        # if rounded_value <= 0.0:
-        #     # color = 'gray'
-        #     color = '#E9FFFF'
-        # elif rounded_value <= 0.2:
-        #     # color = 'green'
-        #     color = '#93B3E7'
-        # elif rounded_value <= 0.8:
-        #     # color = 'orange'
-        #     color = '#3979B7'
-        # else:
-        #     # color = 'red'
-        #     color = '#1D2E68'
-
-       # popuphtml = folium.Html(f"<b>{station['name']}</b>", script=True)
-        popup_html = folium.Html(f"<b>{station['name']}</b><br>{rounded_value} mm", script=True)
-        popup = folium.Popup(popup_html, max_width=250)
-
-        folium.CircleMarker(
-            location=[station['lat'], station['lon']],
-            radius=8,
-            popup=popup,
-            # tooltip="Click to select",
-            tooltip=f"{station['name']}: {rounded_value} mm",
-            color=color,
-            fill=True,
-            fill_color=color
-        ).add_to(m)
+    if not station_data:
+        return m
+
+    values = [station['value'] for station in station_data]
+    rounded_values = _round_values(values)
+    colors = ice_colors(rounded_values, max(values))
+
+    # if rounded_value <= 0.0:
+    #     # color = 'gray'
+    #     color = '#E9FFFF'
+    # elif rounded_value <= 0.2:
+    #     # color = 'green'
+    #     color = '#93B3E7'
+    # elif rounded_value <= 0.8:
+    #     # color = 'orange'
+    #     color = '#3979B7'
+    # else:
+    #     # color = 'red'
+    #     color = '#1D2E68'
+
+    features = [
+        {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [station['lon'], station['lat']]},
+            "properties": {
+                "color": str(color),
+                "tooltip": f"{station['name']}: {rounded_value} mm",
+                "popup": f"<b>{station['name']}</b><br>{rounded_value} mm",
+            },
+        }
+        for station, rounded_value, color in zip(station_data, rounded_values.tolist(), colors)
+    ]
+
+    # Väri luetaan pisteen ominaisuuksista selaimessa, joten kaikki asemat ovat yksi taso.
+    folium.GeoJson(
+        {"type": "FeatureCollection", "features": features},
+        name="stations",
+        marker=folium.CircleMarker(radius=8, fill=True),
+        style_function=lambda feature: {
+            "color": feature["properties"]["color"],
+            "fillColor": feature["properties"]["color"],
+            "fillOpacity": 0.2,
+            "opacity": 1.0,
+            "weight": 3,
+        },
+        tooltip=folium.GeoJsonTooltip(fields=["tooltip"], labels=False),
+        popup=folium.GeoJsonPopup(fields=["popup"], labels=False, max_width=250),
+    ).add_to(m)
 
     return m
 
+
+def render_icing_map_html(station_data: list[StationInfo]) -> str:
+    """
+    Returns the map of plot_icing_map as a standalone HTML page.
+
+    Pages are cached by the shown station values (names, locations and values rounded
+    to 0.1 mm), so reruns and repeated ranges with the same totals skip folium entirely.
+
+    Args:
+        station_data (list): List of station dictionaries.
+
+    Returns:
+        str: HTML of the map.
+    """
+    values = [station['value'] for station in station_data]
+    # Värit skaalataan pyöristämättömällä maksimilla, joten se kuuluu avaimeen. Arvot ovat
+    # avaimessa tekstinä, koska NaN ei ole yhtä suuri kuin itsensä.
+    key = (
+        tuple((station['name'], station['lat'], station['lon'], repr(rounded))
+              for station, rounded in zip(station_data, _round_values(values).tolist())),
+        repr(max(values, default=0.0)),
+    )
+    with _map_html_lock:
+        html = _map_html_cache.get(key)
+        if html is not None:
+            _map_html_cache.move_to_end(key)
+            return html
+
+    html = plot_icing_map(station_data).get_root().render()
+
+    with _map_html_lock:
+        _map_html_cache[key] = html
+        while len(_map_html_cache) > MAP_HTML_CACHE_SIZE:
+            _map_html_cache.popitem(last=False)
+    return html
+
 def create_station_selector():
     """
     Displays a dropdown to select a station from session_state.station_data.
     Stores the selected station name in session_state.selected_station.
     """
+    import streamlit as st
+
     station_names = [station['name'] for station in st.session_state.station_data]
     selected = st.selectbox("Valitse asema nähdäksesi kuva:", station_names)
     st.session_state.selected_station = selected
 
+def decimate_minmax(index: pd.DatetimeIndex, values: np.ndarray, n_buckets: int) -> tuple[pd.DatetimeIndex, np.ndarray]:
+    """
+    Reduces a time series to the minimum and maximum point of each time bucket.
+
+    With one bucket per horizontal pixel the decimated line looks the same as the
+    full one: every spike keeps its extreme value. Buckets containing only NaN keep
+    one NaN point, so gaps in the line stay visible.
+
+    Args:
+        index (pd.DatetimeIndex): Sorted time index.
+        values (np.ndarray): Values for the index.
+        n_buckets (int): Number of buckets, normally the plot width in pixels.
+
+    Returns:
+        tuple: (index, values) of at most 2 * n_buckets original points in time order.
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    if n <= 2 * n_buckets or n_buckets < 1:
+        return index, values
+
+    t = index.asi8
+    span = max(int(t[-1] - t[0]), 1)
+    bucket = np.minimum((t - t[0]) // (span / n_buckets), n_buckets - 1).astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    counts = np.diff(np.r_[starts, n])
+
+    nan = np.isnan(values)
+    low = np.where(nan, np.inf, values)
+    high = np.where(nan, -np.inf, values)
+    bucket_min = np.repeat(np.minimum.reduceat(low, starts), counts)
+    bucket_max = np.repeat(np.maximum.reduceat(high, starts), counts)
+
+    # Ensimmäinen minimi- ja maksimikohta jokaisesta ämpäristä. Pelkkiä NaN-arvoja sisältävästä
+    # ämpäristä valitaan sen ensimmäinen piste, jolloin viivaan jää katko.
+    bucket_id = np.repeat(np.arange(len(starts)), counts)
+    min_pos = np.flatnonzero(low == bucket_min)
+    max_pos = np.flatnonzero(high == bucket_max)
+    min_pos = min_pos[np.unique(bucket_id[min_pos], return_index=True)[1]]
+    max_pos = max_pos[np.unique(bucket_id[max_pos], return_index=True)[1]]
+
+    positions = np.union1d(min_pos, max_pos)
+    return index[positions], values[positions]
+
+
 def plot_icegraph(
     df: pd.DataFrame,
     place: str,
     fmisid: int,
     start_datetime: datetime,
     end_datetime: datetime,
-    sensor_id: int = None
-) -> plt.Figure:
+    sensor_id: int = None,
+    decimate: bool = True,
+    resolution: str = "1min"
+) -> "Figure":
     """
     Creates a multi-panel matplotlib figure visualizing icing-related variables over time.
 
@@ -141,15 +297,25 @@ def plot_icegraph(
         start_datetime (datetime): Start time in format YYYYMMDDTHHMM.
         end_datetime (datetime)): End time in format YYYYMMDDTHHMM.
         sensor_id (int, optional): Sensor ID if multiple sensors are used.
+        decimate (bool): Draw only the min/max point per horizontal pixel, so the
+            render time and PNG size do not grow with the length of the range.
+        resolution (str): Resolution of df when it is resampled with resample_icing
+            ("10min", "hourly" or "daily"). The increments are then bucket sums, NFC
+            is the largest minute value of each bucket, and
+            fzfreq and its 15-minute trailing minimum (moving_minimun_15minutes,
+            labelled fz10min) are drawn as bands between their bucket minimum and maximum.
 
     Returns:
-        plt.Figure: A matplotlib figure object with 5 subplots showing:
+        Figure: A matplotlib figure object with 5 subplots showing:
             - Ice accumulation
             - Raw and filtered frequency (fzfreq)
             - Instantaneous ice accretion
             - Net frequency change (NFC)
             - Filtered NFC
     """
+    from matplotlib.figure import Figure
+    import matplotlib.dates as mdates
+
         # Plotattavan jakson pituus
     duration = end_datetime - start_datetime
 
@@ -162,19 +328,36 @@ def plot_icegraph(
     else:
         fzfreq_label = "fzfreq"
 
-    fig, (ax1, ax2, ax3, ax4, ax5) = plt.subplots(5, 1, figsize=(16, 16), sharex=True)
+    # Kuva luodaan suoraan Figure-oliona ilman pyplotin globaalia kuvarekisteriä,
+    # jolloin kuva vapautuu muistista heti, kun siihen ei enää viitata.
+    fig = Figure(figsize=(16, 16))
+    ax1, ax2, ax3, ax4, ax5 = fig.subplots(5, 1, sharex=True)
 
-    ax2.plot(df.index, df["fzfreq"], label=f"{fzfreq_label}", linestyle=':', color='blue')
-    ax2.plot(df.index, df["moving_minimun_15minutes"], label="fz10min", linestyle=':', color='red')
+    # Yksi min/max-pari jokaista kuvan vaakasuuntaista pikseliä kohden.
+    n_buckets = int(fig.get_figwidth() * fig.dpi) if decimate else 0
+
+    def plot_column(ax, column, **kwargs):
+        x, y = decimate_minmax(df.index, df[column].to_numpy(), n_buckets)
+        ax.plot(x, y, **kwargs)
+
+    if "fzfreq_min" in df.columns:
+        # Koostetussa datassa taajuus ja sen liukuva minimi piirretään jakson minimin ja maksimin väliseksi alueeksi.
+        ax2.fill_between(df.index, df["fzfreq_min"], df["fzfreq_max"],
+                         label=f"{fzfreq_label} (min-max)", color='blue', alpha=0.3)
+        ax2.fill_between(df.index, df["moving_minimun_15minutes_min"], df["moving_minimun_15minutes_max"],
+                         label="fz10min (min-max)", color='red', alpha=0.3)
+    else:
+        plot_column(ax2, "fzfreq", label=f"{fzfreq_label}", linestyle=':', color='blue')
+        plot_column(ax2, "moving_minimun_15minutes", label="fz10min", linestyle=':', color='red')
 
-    ax4.plot(df.index, df["NFC"], label="NFC", linestyle='--', color='red')
-    ax5.plot(df.index, df["NFC_filtered"], label="NFC_filtered", linestyle=':', color='red')
+    plot_column(ax4, "NFC", label="NFC", linestyle='--', color='red')
+    plot_column(ax5, "NFC_filtered", label="NFC_filtered", linestyle=':', color='red')
 
-    ax3.plot(df.index, df["mm_instant"], label="mm inst", linestyle='--', color='blue')
-    ax3.plot(df.index, df["mm_instant_filtered"], label="mm instant filtered", linestyle=':', color='red')
+    plot_column(ax3, "mm_instant", label="mm inst", linestyle='--', color='blue')
+    plot_column(ax3, "mm_instant_filtered", label="mm instant filtered", linestyle=':', color='red')
 
-    ax1.plot(df.index, df["cumul_mm_filtered"], label="cumul mm filtered", linestyle='--', color='red')
-    ax1.plot(df.index, df["cumul_mm"], label="cumul mm", linestyle='-.', color='green')
+    plot_column(ax1, "cumul_mm_filtered", label="cumul mm filtered", linestyle='--', color='red')
+    plot_column(ax1, "cumul_mm", label="cumul mm", linestyle='-.', color='green')
 
     axes = [ax1, ax2, ax3, ax4, ax5]
     for ax in axes:
@@ -188,7 +371,7 @@ def plot_icegraph(
             # Väli-merkinnät (minor ticks) joka tunti tai muuten erilainen
             # ax.xaxis.set_minor_locator(mdates.HourLocator(interval=1))
             ax.xaxis.set_minor_locator(mdates.MinuteLocator(interval=15))
-            plt.xlabel("Kellonaika")
+            ax5.set_xlabel("Kellonaika")
 
         elif duration <= timedelta(days=3):
             ax.xaxis.set_major_locator(mdates.HourLocator(byhour=range(0, 24, 3)))
@@ -196,14 +379,14 @@ def plot_icegraph(
 
             # Väli-merkinnät (minor ticks) joka tunti tai muuten erilainen
             ax.xaxis.set_minor_locator(mdates.HourLocator(interval=1))
-            plt.xlabel("Kellonaika")
+            ax5.set_xlabel("Kellonaika")
         elif duration <= timedelta(days=8):
             ax.xaxis.set_major_locator(mdates.HourLocator(byhour=range(0, 24, 6)))
             ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
 
             # Väli-merkinnät (minor ticks) joka tunti
             ax.xaxis.set_minor_locator(mdates.HourLocator(interval=3))
-            plt.xlabel("Kellonaika")
+            ax5.set_xlabel("Kellonaika")
         else:
             ax.xaxis.set_major_locator(mdates.HourLocator(byhour=range(0, 24, 24)))
             # ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
@@ -211,7 +394,7 @@ def plot_icegraph(
 
             # Väli-merkinnät (minor ticks) joka tunti
             ax.xaxis.set_minor_locator(mdates.HourLocator(interval=12))
-            plt.xlabel("Päivän numero")
+            ax5.set_xlabel("Päivän numero")
 
         # ax.xaxis.set_major_locator(mdates.HourLocator(byhour=range(0, 24, 3)))
         # ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
@@ -226,18 +409,23 @@ def plot_icegraph(
     ax2.set_ylabel("FZFREQ/Hz")
     ax2.set_title("FZFREQ raw/min(15min) filtered")
 
-    ax3.set_ylabel("ice intensity/(mm/1min)")
+    bucket = {"1min": "1min", "10min": "10min", "hourly": "1h", "daily": "1d"}[resolution]
+    ax3.set_ylabel(f"ice intensity/(mm/{bucket})")
     ax3.set_title("Instantaneous ice accretion")
 
+    # Koostetussa datassa NFC on jakson suurin minuuttiarvo, yksikkö pysyy samana.
+    nfc_suffix = f" (max per {bucket})" if resolution != "1min" else ""
     ax4.set_ylabel("NFC/dHz")
-    ax4.set_title("Net Frequency Change")
+    ax4.set_title(f"Net Frequency Change{nfc_suffix}")
 
     ax5.set_ylabel("NFC_new/dHz")
-    ax5.set_title("Net Frequency Change Filtered")
+    ax5.set_title(f"Net Frequency Change Filtered{nfc_suffix}")
 
     # plt.xlabel("Kellonaika")
     title = f"{place}#{sensor_id}: {fmisid}" if sensor_id else f"{place}: {fmisid}"
-    plt.suptitle(f"{title}: {starttime}-{endtime} UTC")
-    plt.tight_layout(rect=[0, 0, 1, 0.98])
+    if resolution != "1min":
+        title = f"{title} ({resolution})"
+    fig.suptitle(f"{title}: {starttime}-{endtime} UTC")
+    fig.tight_layout(rect=[0, 0, 1, 0.98])
 
     return fig
\ No newline at end of file
@@ -0,0 +1,251 @@
+"""
+prefetch.py
+
+Background prefetch that keeps the recent data of all stations warm. Every
+PREFETCH_INTERVAL seconds a run
+
+- downloads the newest observations of the last PREFETCH_DAYS days into raw_store,
+- builds the hourly rollups and the icing event index of the hours that became final, and
+- in the app process, recomputes today's graph frames into the result cache.
+
+A "Show Map" for a recent range then reads everything from disk and memory. Each
+run marks the raw store as prefetched (raw_store.mark_prefetched), and while the
+mark is younger than raw_store.PARTIAL_FRESH_FOR the open day written by the run
+is not downloaded again by requests in between. When no prefetcher is running the
+mark gets old and requests always refresh the open day.
+
+Runs never overlap: the scheduler thread runs them one after another, and a file
+lock in the raw store directory makes a run skip if another process (e.g. a second
+app process or the sidecar) is already running one. After a run with failed
+downloads the next run is delayed exponentially, up to PREFETCH_MAX_BACKOFF.
+
+In the app process the scheduler is started by main.py when ICING_PREFETCH=1. As a
+sidecar next to the app:
+
+    python -m prefetch --interval 120 --days 3
+
+Classes:
+- PrefetchScheduler: Hakee asemien uusimmat havainnot taustasäikeessä määrävälein.
+
+Functions:
+- start_prefetch(stations): Käynnistää prosessin yhteisen ajastimen, jos se ei ole jo käynnissä.
+"""
+
+import os
+import time
+import logging
+import argparse
+import threading
+import pandas as pd
+import perf
+import raw_store
+from data_fetchers import fetch_raw_cached, fetch_icing_batch
+from rollup_store import build_rollups
+from event_index import build_event_index
+
+try:
+    import fcntl
+except ImportError:
+    # Windowsissa ei ole fcntl:ää, jolloin päällekkäisyys estetään vain prosessin sisällä.
+    fcntl = None
+
+PREFETCH_ENABLED = os.environ.get("ICING_PREFETCH", "") not in ("", "0")
+PREFETCH_INTERVAL = int(os.environ.get("ICING_PREFETCH_INTERVAL", "120"))
+# Näin monen viimeisen vuorokauden data pidetään lämpimänä.
+PREFETCH_DAYS = 3
+# Rinnakkaisten latausten enimmäismäärä, pienempi kuin käyttäjän pyynnöillä, jotta taustahaku ei kilpaile niiden kanssa.
+PREFETCH_WORKERS = 2
+# Epäonnistuneen ajon jälkeen viive tuplataan, enintään tähän asti.
+PREFETCH_MAX_BACKOFF = 30 * 60
+
+logger = logging.getLogger(__name__)
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+class PrefetchScheduler:
+    """
+    Runs prefetch rounds for a fixed list of stations in a daemon thread.
+
+    Usage:
+        scheduler = PrefetchScheduler(stations)
+        scheduler.start()
+        scheduler.status()    # last run, failures, next delay
+        scheduler.stop()
+    """
+
+    def __init__(
+        self,
+        stations: list[tuple[int, int]],
+        interval: float = PREFETCH_INTERVAL,
+        days: int = PREFETCH_DAYS,
+        max_workers: int = PREFETCH_WORKERS,
+        warm_results: bool = True,
+        root: str = raw_store.RAW_STORE_DIR
+    ):
+        self.stations = list(stations)
+        self.interval = interval
+        self.days = days
+        self.max_workers = max_workers
+        # Tulosvälimuisti on prosessikohtainen, joten sivuvaunuajossa sitä ei kannata lämmittää.
+        self.warm_results = warm_results
+        self.root = root
+        self._run_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._consecutive_failures = 0
+        self._last_run = None
+        self._last_duration = None
+        self._last_failures = {}
+        self._skipped = 0
+
+    def start(self):
+        """Starts the scheduler thread. The first run starts immediately."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="icing-prefetch", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        """Stops the scheduler after the current run."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def next_delay(self) -> float:
+        """Seconds until the next run: the interval, doubled for every consecutive failed run."""
+        return min(self.interval * 2 ** self._consecutive_failures, max(self.interval, PREFETCH_MAX_BACKOFF))
+
+    def status(self) -> dict:
+        """Returns the state of the last run."""
+        return {
+            "last_run": self._last_run,
+            "last_duration_s": self._last_duration,
+            "failures": dict(self._last_failures),
+            "consecutive_failures": self._consecutive_failures,
+            "skipped_runs": self._skipped,
+            "next_delay_s": self.next_delay(),
+        }
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                # Taustasäie ei saa kaatua, virhe lasketaan epäonnistuneeksi ajoksi.
+                logger.exception("Prefetch run failed: %s", e)
+                self._consecutive_failures += 1
+            self._stop.wait(self.next_delay())
+
+    def run_once(self, now: pd.Timestamp = None) -> bool:
+        """
+        Runs one prefetch round, unless one is already running in this or another process.
+
+        Returns:
+            bool: True if the round ran, False if it was skipped.
+        """
+        if not self._run_lock.acquire(blocking=False):
+            self._skipped += 1
+            return False
+        try:
+            with _ProcessLock(os.path.join(self.root, "prefetch.lock")) as locked:
+                if not locked:
+                    self._skipped += 1
+                    return False
+                self._run(now)
+                return True
+        finally:
+            self._run_lock.release()
+
+    def _run(self, now: pd.Timestamp = None):
+        if now is None:
+            now = pd.Timestamp.now(tz="UTC").tz_localize(None)
+        start = (now - pd.Timedelta(days=self.days)).normalize()
+        starttime = start.strftime("%Y%m%dT%H%M")
+        endtime = now.floor("min").strftime("%Y%m%dT%H%M")
+
+        t0 = time.perf_counter()
+        with perf.stage("prefetch", stations=len(self.stations)) as timer:
+            _, failures = fetch_raw_cached(self.stations, starttime, endtime, self.root, self.max_workers)
+            raw_store.mark_prefetched(self.root)
+            ok = [key for key in self.stations if key not in failures]
+            # Rollupit ja tulokset lasketaan juuri tallennetusta datasta ilman uusia latauksia.
+            failures.update(build_rollups(ok, start, now, now))
+            failures.update(build_event_index(ok, start, now, now))
+            if self.warm_results:
+                # Sovelluksen oletusaikaväli on kuluva vuorokausi.
+                today = now.normalize()
+                fetch_icing_batch(
+                    ok,
+                    today.strftime("%Y%m%dT%H%M"),
+                    (today + pd.Timedelta(days=1)).strftime("%Y%m%dT%H%M"),
+                    profile="plot", float32=True)
+            timer.set(failed=len(failures))
+
+        self._last_run = now
+        self._last_duration = time.perf_counter() - t0
+        self._last_failures = failures
+        self._consecutive_failures = self._consecutive_failures + 1 if failures else 0
+        logger.info("Prefetch: %d/%d stations in %.1f s",
+                    len(self.stations) - len(failures), len(self.stations), self._last_duration)
+
+
+class _ProcessLock:
+    """Non-blocking exclusive file lock, the value of the with block tells if it was acquired."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def __enter__(self) -> bool:
+        if fcntl is None:
+            return True
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._file = open(self.path, "a")
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._file.close()
+            self._file = None
+            return False
+        return True
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        return False
+
+
+def start_prefetch(stations: list[tuple[int, int]]) -> PrefetchScheduler:
+    """Returns the process-wide scheduler, starting it on the first call."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = PrefetchScheduler(stations)
+            _scheduler.start()
+        return _scheduler
+
+
+if __name__ == "__main__":
+    from stations import PLACES, place_station
+
+    parser = argparse.ArgumentParser(description="Keep the recent data of all stations warm.")
+    parser.add_argument("--interval", type=float, default=PREFETCH_INTERVAL, help="seconds between runs")
+    parser.add_argument("--days", type=int, default=PREFETCH_DAYS, help="days of recent data to keep warm")
+    parser.add_argument("--workers", type=int, default=PREFETCH_WORKERS, help="concurrent downloads")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    scheduler = PrefetchScheduler(
+        [place_station(place) for place in PLACES],
+        interval=args.interval, days=args.days, max_workers=args.workers, warm_results=False)
+    scheduler.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        scheduler.stop()
@@ -0,0 +1,240 @@
+"""
+raw_store.py
+
+Persistent on-disk store of raw fzfreq observations. Each station and sensor has
+its own directory with one Parquet file per UTC day:
+
+    <root>/<FMISID>_<sensor_id>/<YYYY-MM-DD>.parquet          closed day, never refetched
+    <root>/<FMISID>_<sensor_id>/<YYYY-MM-DD>.partial.parquet  open day, refreshed from its last stored minute
+
+A closed day that came back without any values (an outage, or FMI has not ingested
+it yet) is kept as partial and retried every EMPTY_DAY_RETRY until EMPTY_DAY_FINAL
+has passed since it closed. Only then is it stored as a complete empty day.
+
+The module does no network access itself. data_fetchers asks plan_fetch() which
+sub-ranges are missing, downloads them, hands them to store_fetched() and reads
+the requested range back with read_range().
+
+Functions:
+- plan_fetch(FMISID, sensor_id, start, end, now, root): Palauttaa puuttuvat aikavälit, jotka täytyy ladata.
+- store_fetched(FMISID, sensor_id, df, ranges, now, root): Tallentaa ladatun datan päiväkohtaisiin tiedostoihin.
+- read_range(FMISID, sensor_id, start, end, root): Lukee pyydetyn aikavälin tallennetuista päivistä.
+- mark_prefetched(root, now): Merkitsee taustahaun ajetuksi, jolloin tuoreita avoimia päiviä ei ladata uudelleen.
+"""
+
+import os
+import pandas as pd
+from store_io import atomic_write
+
+RAW_STORE_DIR = os.environ.get("ICING_RAW_STORE", os.path.join(".icing_cache", "raw"))
+
+# Päivä katsotaan suljetuksi vasta, kun sen päättymisestä on kulunut tämän verran.
+# Näin myöhässä saapuvat havainnot ehtivät mukaan ennen kuin päivä jäädytetään.
+CLOSED_DAY_DELAY = pd.Timedelta(hours=1)
+# Avointa päivää ei ladata uudelleen, jos se on päivitetty tätä lyhyempi aika sitten ja
+# taustahaku (prefetch.py) on merkinnyt ajon tätä lyhyempi aika sitten. Taustahaku pitää
+# päivät tätä tuoreempina, jolloin pyyntö ei lataa mitään. Ilman taustahakua avoin päivä
+# ladataan aina uudelleen viimeisestä tallennetusta minuutista.
+PARTIAL_FRESH_FOR = pd.Timedelta(seconds=int(os.environ.get("ICING_RAW_FRESH_SECONDS", "180")))
+
+# Suljettu päivä ilman yhtään arvoa ladataan uudelleen tällä välillä, kunnes
+# sen sulkeutumisesta on kulunut EMPTY_DAY_FINAL. Sen jälkeen päivä on aidosti tyhjä.
+EMPTY_DAY_RETRY = pd.Timedelta(seconds=int(os.environ.get("ICING_RAW_EMPTY_RETRY_SECONDS", "3600")))
+EMPTY_DAY_FINAL = pd.Timedelta(days=3)
+
+# Tallennettavat sarakkeet. Vanhemmissa tiedostoissa on myös aseman nimi ja sijainti
+# jokaisella rivillä, ne jätetään lukiessa pois (ne tulevat nyt asemarekisteristä).
+RAW_COLUMNS = ["fzfreq"]
+
+# Taustahaun ajomerkki säilön juurihakemistossa, yhteinen sovellukselle ja sivuvaunuprosessille.
+PREFETCH_MARKER = "prefetch.heartbeat"
+
+ONE_DAY = pd.Timedelta(days=1)
+ONE_MINUTE = pd.Timedelta(minutes=1)
+
+
+def _station_dir(FMISID: int, sensor_id: int, root: str) -> str:
+    return os.path.join(root, f"{FMISID}_{sensor_id if sensor_id is not None else 'default'}")
+
+
+def _day_path(FMISID: int, sensor_id: int, day: pd.Timestamp, complete: bool, root: str) -> str:
+    suffix = ".parquet" if complete else ".partial.parquet"
+    return os.path.join(_station_dir(FMISID, sensor_id, root), f"{day:%Y-%m-%d}{suffix}")
+
+
+def _is_closed(day: pd.Timestamp, now: pd.Timestamp) -> bool:
+    return day + ONE_DAY + CLOSED_DAY_DELAY <= now
+
+
+def _has_values(df: pd.DataFrame) -> bool:
+    return "fzfreq" in df.columns and bool(df["fzfreq"].notna().any())
+
+
+def _written_since(path: str, since: pd.Timestamp) -> bool:
+    """True if the file was modified after since (naive UTC)."""
+    try:
+        return pd.Timestamp(os.path.getmtime(path), unit="s") > since
+    except OSError:
+        return False
+
+
+def _days(start: pd.Timestamp, end: pd.Timestamp) -> pd.DatetimeIndex:
+    return pd.date_range(start.normalize(), end.normalize(), freq="D")
+
+
+def _load_day(FMISID: int, sensor_id: int, day: pd.Timestamp, root: str) -> tuple[pd.DataFrame, bool]:
+    """Returns (frame, complete) for a stored day, or (None, False) if nothing is stored."""
+    for complete in (True, False):
+        path = _day_path(FMISID, sensor_id, day, complete, root)
+        if os.path.exists(path):
+            df = pd.read_parquet(path)
+            extra = [column for column in df.columns if column not in RAW_COLUMNS]
+            return (df.drop(columns=extra) if extra else df), complete
+    return None, False
+
+
+def _write_day(FMISID: int, sensor_id: int, day: pd.Timestamp, df: pd.DataFrame, complete: bool, root: str):
+    """Writes a day partition atomically and removes the partial file once the day is complete."""
+    atomic_write(_day_path(FMISID, sensor_id, day, complete, root), df.to_parquet)
+
+    if complete:
+        partial = _day_path(FMISID, sensor_id, day, False, root)
+        if os.path.exists(partial):
+            os.remove(partial)
+
+
+def plan_fetch(
+    FMISID: int,
+    sensor_id: int,
+    start: pd.Timestamp,
+    end: pd.Timestamp,
+    now: pd.Timestamp,
+    root: str = RAW_STORE_DIR
+) -> list[tuple[pd.Timestamp, pd.Timestamp]]:
+    """
+    Lists the sub-ranges that have to be downloaded to cover [start, end].
+
+    Missing days are always fetched whole, so that every closed day on disk is
+    complete. An open (partial) day is fetched from its last stored minute onwards,
+    unless both the day and the last prefetch run (mark_prefetched) are less than
+    PARTIAL_FRESH_FOR old. A closed day stored
+    without values is fetched again once EMPTY_DAY_RETRY has passed.
+    Nothing after now is requested. Adjacent ranges are merged.
+
+    Args:
+        FMISID (int): FMI station ID.
+        sensor_id (int): Sensor ID, or None for single-sensor sites.
+        start (pd.Timestamp): Requested start time (UTC).
+        end (pd.Timestamp): Requested end time (UTC), inclusive.
+        now (pd.Timestamp): Current UTC time.
+        root (str): Store directory.
+
+    Returns:
+        list: Inclusive (start, end) ranges to download.
+    """
+    latest = now.floor("min")
+    prefetched = _written_since(os.path.join(root, PREFETCH_MARKER), now - PARTIAL_FRESH_FOR)
+    ranges = []
+    for day in _days(start, end):
+        if day > latest:
+            break
+        day_end = min(day + ONE_DAY - ONE_MINUTE, latest)
+
+        df, complete = _load_day(FMISID, sensor_id, day, root)
+        if complete:
+            continue
+        if prefetched and df is not None and not _is_closed(day, now) and _written_since(
+                _day_path(FMISID, sensor_id, day, False, root), now - PARTIAL_FRESH_FOR):
+            continue
+        if df is not None and df.empty and _is_closed(day, now) and _written_since(
+                _day_path(FMISID, sensor_id, day, False, root), now - EMPTY_DAY_RETRY):
+            continue
+        if df is not None and not df.empty:
+            # Avoimen päivän päivitys alkaa viimeisestä tallennetusta minuutista.
+            range_start = df.index.max()
+        else:
+            range_start = day
+
+        if ranges and ranges[-1][1] + ONE_MINUTE >= range_start:
+            ranges[-1] = (ranges[-1][0], day_end)
+        else:
+            ranges.append((range_start, day_end))
+    return ranges
+
+
+def store_fetched(
+    FMISID: int,
+    sensor_id: int,
+    df: pd.DataFrame,
+    ranges: list[tuple[pd.Timestamp, pd.Timestamp]],
+    now: pd.Timestamp,
+    root: str = RAW_STORE_DIR):
+    """
+    Merges freshly downloaded raw data into the day partitions.
+
+    Args:
+        FMISID (int): FMI station ID.
+        sensor_id (int): Sensor ID, or None for single-sensor sites.
+        df (pd.DataFrame): Raw frame indexed by utctime covering the fetched ranges.
+            May be empty if the station returned no data.
+        ranges (list): The (start, end) ranges that were downloaded.
+        now (pd.Timestamp): UTC time of the download.
+        root (str): Store directory.
+    """
+    for range_start, range_end in ranges:
+        for day in _days(range_start, range_end):
+            new = df.loc[day:day + ONE_DAY - ONE_MINUTE] if not df.empty else df
+            old, _ = _load_day(FMISID, sensor_id, day, root)
+
+            if old is not None and not old.empty:
+                merged = pd.concat([old, new]) if not new.empty else old
+                merged = merged[~merged.index.duplicated(keep="last")].sort_index()
+            else:
+                merged = new
+
+            complete = _is_closed(day, now)
+            if complete and not _has_values(merged) and day + ONE_DAY + EMPTY_DAY_FINAL > now:
+                # Tyhjää päivää ei jäädytetä heti: data voi puuttua katkon tai myöhästymisen takia.
+                complete = False
+            if not complete and "fzfreq" in merged.columns:
+                # Hännän NaN-arvot voivat olla vielä saapumatta olevia havaintoja, joten niitä ei tallenneta.
+                valid = merged["fzfreq"].notna().to_numpy()
+                last = valid.nonzero()[0]
+                merged = merged.iloc[:last[-1] + 1] if len(last) else merged.iloc[:0]
+
+            _write_day(FMISID, sensor_id, day, merged, complete, root)
+
+
+def read_range(
+    FMISID: int,
+    sensor_id: int,
+    start: pd.Timestamp,
+    end: pd.Timestamp,
+    root: str = RAW_STORE_DIR) -> pd.DataFrame:
+    """
+    Reads the stored raw data for [start, end].
+
+    Returns:
+        pd.DataFrame: Raw frame indexed by utctime, empty if nothing is stored.
+    """
+    parts = []
+    for day in _days(start, end):
+        df, _ = _load_day(FMISID, sensor_id, day, root)
+        if df is not None and not df.empty:
+            parts.append(df)
+    if not parts:
+        return pd.DataFrame()
+    return pd.concat(parts).sort_index().loc[start:end]
+
+
+def mark_prefetched(root: str = RAW_STORE_DIR):
+    """
+    Records that a prefetch run has just refreshed the store.
+
+    For PARTIAL_FRESH_FOR after this, plan_fetch does not download open days that
+    were written within that time.
+    """
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, PREFETCH_MARKER), "a"):
+        pass
+    os.utime(os.path.join(root, PREFETCH_MARKER))
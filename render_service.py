@@ -0,0 +1,102 @@
+"""
+render_service.py
+
+Renders the icing graphs as PNG images. Finished images are cached by a content
+hash of the station frame and the plotted range, so Streamlit reruns do not draw
+or encode the same figure again. Figures are created with the object-oriented
+Figure API and dropped right after encoding, nothing is left in pyplot's global
+figure registry. When several graphs have to be drawn they are rendered in
+parallel in a process pool.
+
+Functions:
+- render_png(df, place, fmisid, start_datetime, end_datetime, sensor_id, resolution): Piirtää yhden kuvaajan PNG-tavuiksi.
+- render_graphs(jobs, max_workers): Palauttaa usean kuvaajan PNG:t välimuistista tai piirtää puuttuvat rinnakkain.
+"""
+
+import os
+import threading
+import multiprocessing
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import pandas as pd
+import perf
+from result_cache import IcingResultCache, frame_digest
+from plotters import plot_icegraph
+
+PNG_CACHE_MAX_BYTES = int(os.environ.get("ICING_PNG_CACHE_MB", "64")) * 1024 * 1024
+MAX_RENDER_WORKERS = min(4, os.cpu_count() or 1)
+
+_png_cache = IcingResultCache(max_bytes=PNG_CACHE_MAX_BYTES, sizeof=len)
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_png_cache() -> IcingResultCache:
+    """Returns the process-wide PNG cache."""
+    return _png_cache
+
+
+def render_png(
+    df: pd.DataFrame,
+    place: str,
+    fmisid: int,
+    start_datetime: datetime,
+    end_datetime: datetime,
+    sensor_id: int = None,
+    resolution: str = "1min"
+) -> bytes:
+    """Draws the icing graph of one station and returns it encoded as PNG."""
+    fig = plot_icegraph(df, place, fmisid, start_datetime, end_datetime, sensor_id, resolution=resolution)
+    buf = BytesIO()
+    fig.savefig(buf, format="png")
+    # Figure ei ole pyplotin rekisterissä, joten viittauksen poisto riittää vapauttamaan sen.
+    fig.clear()
+    return buf.getvalue()
+
+
+def _render_job(job: tuple) -> bytes:
+    return render_png(*job)
+
+
+def _get_pool(max_workers: int) -> ProcessPoolExecutor:
+    """Returns the shared render process pool, created on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, koska Streamlit-prosessissa on säikeitä eikä fork ole silloin turvallinen.
+            _pool = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def render_graphs(jobs: list[tuple], max_workers: int = MAX_RENDER_WORKERS) -> list[bytes]:
+    """
+    Returns PNG images for several graphs, rendering only those not in the cache.
+
+    Args:
+        jobs (list): Tuples of render_png arguments
+            (df, place, fmisid, start_datetime, end_datetime, sensor_id, resolution).
+        max_workers (int): Size of the render process pool. With 1, or when only
+            one graph is missing, rendering happens in the calling process.
+
+    Returns:
+        list: PNG bytes in the same order as jobs.
+    """
+    cache = get_png_cache()
+    keys = [frame_digest(job[0], *job[1:]) for job in jobs]
+    images = [cache.get(key) for key in keys]
+
+    missing = [i for i, image in enumerate(images) if image is None]
+    with perf.stage("render", graphs=len(jobs), cached=len(jobs) - len(missing)) as timer:
+        if len(missing) > 1 and max_workers > 1:
+            rendered = list(_get_pool(max_workers).map(_render_job, [jobs[i] for i in missing]))
+        else:
+            rendered = [_render_job(jobs[i]) for i in missing]
+        timer.set(bytes=sum(len(image) for image in rendered))
+
+    for i, image in zip(missing, rendered):
+        cache.put(keys[i], image)
+        images[i] = image
+    return images
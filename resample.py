@@ -0,0 +1,137 @@
+"""
+resample.py
+
+Coarser views of the 1-minute calculate_icing output for long ranges. A frame is
+aggregated into 10-minute, hourly or daily UTC buckets labelled by their start:
+
+    increments (mm_*):                sum over the bucket
+    frequency changes (NFC*):         largest minute value of the bucket
+    accumulations (cumul_*):          last value of the bucket
+    fzfreq and its 15-minute trailing
+    minimum moving_minimun_15minutes:  <column>_min and <column>_max
+    minutes:                          minutes with a fzfreq value
+
+so the bucket sums add up to the same totals and the accumulation curves end at the
+same values as in the minute data. choose_resolution picks the finest resolution
+that keeps a range under RESAMPLE_MAX_POINTS rows, and get_resampled keeps the
+resampled frames in a result cache keyed by the content digest of their base frame,
+so a refreshed base frame never gets the resampled frame of its old contents.
+
+Functions:
+- choose_resolution(start, end, max_points): Valitsee aikavälille tarkimman riittävän harvan resoluution.
+- resample_icing(df, resolution): Koostaa minuuttidatan 10 min, tunnin tai vuorokauden jaksoihin.
+- get_resampled(df, resolution): Palauttaa koostetun datan välimuistista tai laskee sen.
+"""
+
+import os
+import pandas as pd
+from pandas.tseries.frequencies import to_offset
+import perf
+from result_cache import IcingResultCache, frame_digest
+
+# Resoluutio -> pandasin jakson tunnus, karkeimpaan asti järjestyksessä. "1min" on laskennan oma resoluutio.
+RESOLUTIONS = {"1min": None, "10min": "10min", "hourly": "h", "daily": "D"}
+
+# Lisäykset summataan, kertymistä otetaan jakson viimeinen arvo ja taajuuksista ääriarvot.
+# Taajuuden muutoksista otetaan jakson suurin minuuttiarvo, jolloin yksikkö pysyy samana kuin minuuttidatassa.
+SUM_COLUMNS = ["mm_orig", "mm_mean_10min", "mm_instant", "mm_instant_filtered"]
+MAX_COLUMNS = ["NFC_orig", "NFC_mean_10min", "NFC", "NFC_filtered"]
+LAST_COLUMNS = ["cumul_mm_orig", "cumul_mm_mean_10min", "cumul_mm", "cumul_mm_filtered"]
+MIN_MAX_COLUMNS = ["fzfreq", "moving_minimun_15minutes"]
+
+# Rivejä enintään näin monta, kuvaaja harventaa vielä tästä pikselin tarkkuuteen.
+RESAMPLE_MAX_POINTS = int(os.environ.get("ICING_RESAMPLE_MAX_POINTS", "6000"))
+RESAMPLE_CACHE_MAX_BYTES = int(os.environ.get("ICING_RESAMPLE_CACHE_MB", "128")) * 1024 * 1024
+
+_cache = IcingResultCache(max_bytes=RESAMPLE_CACHE_MAX_BYTES)
+
+
+def get_resample_cache() -> IcingResultCache:
+    """Returns the process-wide cache of resampled frames."""
+    return _cache
+
+
+def choose_resolution(start: pd.Timestamp, end: pd.Timestamp, max_points: int = RESAMPLE_MAX_POINTS) -> str:
+    """
+    Returns the finest resolution with at most max_points rows for [start, end).
+
+    Args:
+        start (pd.Timestamp): Start of the range.
+        end (pd.Timestamp): End of the range.
+        max_points (int): Largest acceptable number of rows.
+
+    Returns:
+        str: Key of RESOLUTIONS, "daily" if every resolution has more rows.
+    """
+    span = pd.Timestamp(end) - pd.Timestamp(start)
+    for resolution, rule in RESOLUTIONS.items():
+        if span / pd.Timedelta(to_offset(rule or "min")) <= max_points:
+            return resolution
+    return "daily"
+
+
+def resample_icing(df: pd.DataFrame, resolution: str) -> pd.DataFrame:
+    """
+    Aggregates a calculate_icing output frame into buckets of the resolution.
+
+    Columns not produced by calculate_icing are dropped. Buckets without any minute
+    rows in the frame are left out, buckets whose minutes are all NaN get NaN.
+
+    Args:
+        df (pd.DataFrame): Output of calculate_icing (any profile, float32 or not).
+        resolution (str): Key of RESOLUTIONS.
+
+    Returns:
+        pd.DataFrame: One row per bucket, indexed by the bucket start. "1min" returns df as is.
+    """
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"Unknown resolution: {resolution}. Choose from {list(RESOLUTIONS)}")
+    rule = RESOLUTIONS[resolution]
+    if rule is None:
+        return df
+
+    grouped = df.resample(rule)
+    parts = []
+    sums = [column for column in SUM_COLUMNS if column in df.columns]
+    if sums:
+        parts.append(grouped[sums].sum(min_count=1))
+    maxes = [column for column in MAX_COLUMNS if column in df.columns]
+    if maxes:
+        parts.append(grouped[maxes].max())
+    lasts = [column for column in LAST_COLUMNS if column in df.columns]
+    if lasts:
+        parts.append(grouped[lasts].last())
+    for column in MIN_MAX_COLUMNS:
+        if column in df.columns:
+            parts.append(grouped[column].min().rename(f"{column}_min"))
+            parts.append(grouped[column].max().rename(f"{column}_max"))
+    if "fzfreq" in df.columns:
+        parts.append(grouped["fzfreq"].count().rename("minutes"))
+
+    out = pd.concat(parts, axis=1) if parts else pd.DataFrame(index=grouped.size().index)
+    # resample luo myös tyhjät välijaksot, niitä ei ollut alkuperäisessä datassa.
+    counts = grouped.size()
+    return out[counts.reindex(out.index).to_numpy() > 0]
+
+
+def get_resampled(df: pd.DataFrame, resolution: str) -> pd.DataFrame:
+    """
+    Returns resample_icing(df, resolution), cached under the content digest of df.
+
+    Args:
+        df (pd.DataFrame): Base frame.
+        resolution (str): Key of RESOLUTIONS.
+
+    Returns:
+        pd.DataFrame: Resampled frame, shared and must not be modified.
+    """
+    if RESOLUTIONS.get(resolution, "") is None:
+        return df
+    # Avain lasketaan sisällöstä: päivittynyt pohjadata saa aina uuden avaimen, vanhat poistuvat LRU:na.
+    cache_key = (frame_digest(df), resolution)
+    resampled = _cache.get(cache_key)
+    if resampled is None:
+        with perf.stage("resample", rows=len(df), resolution=resolution):
+            resampled = resample_icing(df, resolution)
+        _cache.put(cache_key, resampled)
+    return resampled
@@ -0,0 +1,178 @@
+"""
+result_cache.py
+
+Bounded in-memory cache for computed calculate_icing frames. Entries are keyed by
+(FMISID, sensor_id, starttime, endtime, profile, float32) and evicted least recently
+used first when the total size in bytes exceeds the limit. Ranges that end after
+the raw store's closed-day cutoff (now - raw_store.CLOSED_DAY_DELAY) get a short
+time-to-live, because new and late observations keep arriving for them. Historical
+ranges stay until they are evicted.
+
+The cache is shared by all Streamlit sessions of the process, so every operation
+holds a lock. Cached frames are shared objects and must not be modified by callers.
+
+Functions:
+- frame_nbytes(df): Palauttaa DataFramen muistinkäytön tavuina.
+- frame_digest(df, *parts): Laskee DataFramen sisällöstä ja lisätiedoista tiiviin tunnisteen.
+- is_recent_range(endtime, now): Kertoo, voiko aikavälin data vielä muuttua.
+- get_result_cache(): Palauttaa prosessin yhteisen välimuistin.
+"""
+
+import os
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+import pandas as pd
+import raw_store
+
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("ICING_RESULT_CACHE_MB", "512")) * 1024 * 1024
+# Sulkemattomiin päiviin ulottuvat aikavälit vanhenevat näin monen sekunnin jälkeen.
+RECENT_TTL_SECONDS = 120
+
+
+def frame_nbytes(df: pd.DataFrame) -> int:
+    """Returns the memory footprint of a DataFrame in bytes, including the index."""
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def frame_digest(df: pd.DataFrame, *parts) -> str:
+    """
+    Returns a SHA-256 digest of the frame contents (index included) and the extra parts.
+
+    Args:
+        df (pd.DataFrame): Station frame.
+        *parts: Other values that affect the output, e.g. the plotted range and title.
+
+    Returns:
+        str: Hex digest.
+    """
+    digest = hashlib.sha256()
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    digest.update(",".join(map(str, df.columns)).encode())
+    digest.update(repr(parts).encode())
+    return digest.hexdigest()
+
+
+def is_recent_range(endtime: str, now: pd.Timestamp = None) -> bool:
+    """
+    Returns True if data of a range ending at endtime can still change upstream.
+
+    The cutoff is the same as for closing days in raw_store: observations up to
+    CLOSED_DAY_DELAY old may still arrive late.
+
+    Args:
+        endtime (str): End of the range in format YYYYMMDDTHHMM (UTC).
+        now (pd.Timestamp): Current UTC time, defaults to the clock.
+    """
+    if now is None:
+        now = pd.Timestamp.now(tz="UTC").tz_localize(None)
+    return pd.Timestamp(endtime) >= now - raw_store.CLOSED_DAY_DELAY
+
+
+class IcingResultCache:
+    """Thread-safe LRU cache of computed icing frames, bounded by total bytes."""
+
+    def __init__(
+        self,
+        max_bytes: int = RESULT_CACHE_MAX_BYTES,
+        recent_ttl: float = RECENT_TTL_SECONDS,
+        sizeof=frame_nbytes
+    ):
+        self.max_bytes = max_bytes
+        self.recent_ttl = recent_ttl
+        # Arvon koon laskeva funktio, jotta samaa välimuistia voi käyttää myös esim. PNG-tavuille.
+        self._sizeof = sizeof
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    @staticmethod
+    def make_key(
+        FMISID: int,
+        sensor_id: int,
+        starttime: str,
+        endtime: str,
+        profile: str = "full",
+        float32: bool = False
+    ) -> tuple:
+        return (FMISID, sensor_id, starttime, endtime, profile, float32)
+
+    def get(self, key: tuple) -> pd.DataFrame:
+        """Returns the cached frame for key, or None on a miss or an expired entry."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            df, nbytes, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                self._bytes -= nbytes
+                self._expirations += 1
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return df
+
+    def put(self, key: tuple, df: pd.DataFrame, endtime: str = None):
+        """
+        Stores a computed frame.
+
+        Args:
+            key (tuple): Cache key from make_key.
+            df (pd.DataFrame): Output of calculate_icing.
+            endtime (str): End of the range in format YYYYMMDDTHHMM. Ranges for which
+                is_recent_range is true get the short TTL. None never expires.
+        """
+        nbytes = self._sizeof(df)
+        if nbytes > self.max_bytes:
+            return
+
+        expires_at = None
+        if endtime is not None and is_recent_range(endtime):
+            expires_at = time.monotonic() + self.recent_ttl
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (df, nbytes, expires_at)
+            self._bytes += nbytes
+
+            # Poistetaan vähiten käytettyjä, kunnes koko mahtuu rajaan.
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_bytes, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_bytes
+                self._evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        """Returns hit, miss, eviction and expiration counters and the current size."""
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+_cache = IcingResultCache()
+
+
+def get_result_cache() -> IcingResultCache:
+    """Returns the process-wide result cache."""
+    return _cache
@@ -0,0 +1,358 @@
+"""
+rollup_store.py
+
+Persistent hourly rollups of the icing increments, for range totals without minute data.
+Each station and sensor has one Parquet file with one row per UTC hour:
+
+    <root>/<FMISID>_<sensor_id>.parquet
+    columns: mm, mm_filtered (sums of mm_instant and mm_instant_filtered over the hour),
+             minutes (minutes with a value)
+
+The station name and location of the totals come from the station registry.
+
+The increments are computed from the raw_store data with STREAM_CONTEXT of earlier
+data and CENTERED_LOOKAHEAD of later data, so every hour has the same values as in a
+continuous calculation. An hour is rolled up only once its data can no longer change.
+A range total is a difference of two prefix sums over the stored hours, and only the
+partial hours at the range edges (and the newest hours) are computed from minutes.
+
+Because the windows at the range start see the data before it, a total can differ
+slightly from the last cumul_mm_filtered of calculate_icing run on the range alone,
+which starts its trailing windows empty.
+
+Functions:
+- build_rollups(stations, start, end, now, root): Laskee ja tallentaa puuttuvat tuntikertymät.
+- station_totals(stations, starttime, endtime, now, root): Palauttaa asemien kertymät aikavälille prefiksisummista.
+- iter_station_totals(stations, starttime, endtime, max_workers, now, root): Palauttaa kertymät asema kerrallaan
+  sitä mukaa kuin niiden hakuryhmät valmistuvat.
+- rollup_frame(FMISID, sensor_id, start, end, freq, root): Palauttaa tallennetut tunti- tai vuorokausikertymät.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+import perf
+import raw_store
+from store_io import atomic_write, MtimeCache, missing_spans, group_by_missing, pieces
+from stations import get_station_registry
+from data_fetchers import fetch_raw_cached, request_groups, SEASON_CHUNK, MAX_FETCH_WORKERS
+from icing_batch import calculate_icing_batch
+from icing_stream import STREAM_CONTEXT, CENTERED_LOOKAHEAD
+
+ROLLUP_STORE_DIR = os.environ.get("ICING_ROLLUP_STORE", os.path.join(".icing_cache", "rollup"))
+
+# Tallennettava sarake ja sen lähde calculate_icing:n tuloksessa.
+ROLLUP_COLUMNS = {"mm": "mm_instant", "mm_filtered": "mm_instant_filtered"}
+
+ONE_HOUR = pd.Timedelta(hours=1)
+ONE_MINUTE = pd.Timedelta(minutes=1)
+
+# Ladatut rollupit prefiksisummineen: polku -> (tunnit, prefiksisummat, taulukko).
+_loaded = MtimeCache()
+
+
+def _rollup_path(FMISID: int, sensor_id: int, root: str) -> str:
+    return os.path.join(root, f"{FMISID}_{sensor_id if sensor_id is not None else 'default'}.parquet")
+
+
+def _write(FMISID: int, sensor_id: int, df: pd.DataFrame, root: str):
+    """Writes the rollup file atomically."""
+    atomic_write(_rollup_path(FMISID, sensor_id, root), df.to_parquet)
+
+
+def _read(path: str) -> tuple:
+    """Reads a rollup file (or nothing if it does not exist) and builds its prefix sums."""
+    df = pd.read_parquet(path) if os.path.exists(path) else pd.DataFrame()
+    hours = df.index.to_numpy(dtype="datetime64[ns]") if not df.empty else np.array([], dtype="datetime64[ns]")
+    # Prefiksisummat alkavat nollalla, jolloin tuntien [i, j) summa on prefix[j] - prefix[i].
+    prefix = {
+        column: np.concatenate(([0.0], np.cumsum(df[column].to_numpy(dtype=float))))
+        if not df.empty else np.zeros(1)
+        for column in [*ROLLUP_COLUMNS, "minutes"]
+    }
+    return hours, prefix, df
+
+
+def _load(FMISID: int, sensor_id: int, root: str) -> tuple:
+    """Returns (hours, prefix sums, frame) for a station, reloading only if the file changed."""
+    return _loaded.load(_rollup_path(FMISID, sensor_id, root), _read)
+
+
+def _rollable_stop(now: pd.Timestamp) -> pd.Timestamp:
+    """First hour that cannot be rolled up yet: its data (and look-ahead) may still change."""
+    return (now - raw_store.CLOSED_DAY_DELAY - CENTERED_LOOKAHEAD - ONE_HOUR).floor("h") + ONE_HOUR
+
+
+def _fetch_increments(
+    stations: list[tuple[int, int]],
+    start: pd.Timestamp,
+    end: pd.Timestamp
+) -> tuple[dict, dict]:
+    """
+    Computes the per-minute increments for [start, end] with surrounding context.
+
+    Returns:
+        tuple: (frames, failures), frames maps (FMISID, sensor_id) to the rows in
+            [start, end] with the ROLLUP_COLUMNS sources.
+    """
+    raw, failures = fetch_raw_cached(
+        stations,
+        (start - STREAM_CONTEXT).strftime("%Y%m%dT%H%M"),
+        (end + CENTERED_LOOKAHEAD).strftime("%Y%m%dT%H%M"))
+    frames = {}
+    for key, df in calculate_icing_batch(raw, profile="full").items():
+        if not df.empty:
+            df = df.loc[start:end, list(ROLLUP_COLUMNS.values())]
+        frames[key] = df
+    return frames, failures
+
+
+def _hourly(df: pd.DataFrame, start: pd.Timestamp, stop: pd.Timestamp) -> pd.DataFrame:
+    """Sums minute increments into the hours [start, stop), hours without data get zeros."""
+    hours = pd.date_range(start, stop - ONE_HOUR, freq="h", name="utctime")
+    out = pd.DataFrame(index=hours)
+    if df.empty:
+        for column in ROLLUP_COLUMNS:
+            out[column] = 0.0
+        out["minutes"] = np.int32(0)
+        return out
+
+    grouped = df.groupby(df.index.floor("h"))
+    for column, source in ROLLUP_COLUMNS.items():
+        out[column] = grouped[source].sum().reindex(hours, fill_value=0.0)
+    out["minutes"] = grouped[ROLLUP_COLUMNS["mm_filtered"]].count().reindex(hours, fill_value=0).astype(np.int32)
+    return out
+
+
+def _stored_spans(hours: np.ndarray) -> list:
+    """Returns the runs of consecutive stored hours as [start, stop) spans."""
+    if not len(hours):
+        return []
+    breaks = np.flatnonzero(np.diff(hours) != np.timedelta64(1, "h")) + 1
+    firsts = hours[np.r_[0, breaks]]
+    lasts = hours[np.r_[breaks - 1, len(hours) - 1]]
+    return [(pd.Timestamp(first), pd.Timestamp(last) + ONE_HOUR) for first, last in zip(firsts, lasts)]
+
+
+def build_rollups(
+    stations: list[tuple[int, int]],
+    start: pd.Timestamp,
+    end: pd.Timestamp,
+    now: pd.Timestamp = None,
+    root: str = ROLLUP_STORE_DIR
+) -> dict[tuple[int, int], str]:
+    """
+    Computes and stores the missing hourly rollups of [start, end).
+
+    Only hours whose data is final are rolled up. Stations missing the same hours are
+    computed together, in pieces of at most SEASON_CHUNK.
+
+    Args:
+        stations (list): List of (FMISID, sensor_id) pairs, sensor_id may be None.
+        start (pd.Timestamp): First hour (UTC).
+        end (pd.Timestamp): End of the last hour (UTC), exclusive.
+        now (pd.Timestamp): Current UTC time, defaults to the clock.
+        root (str): Rollup store directory.
+
+    Returns:
+        dict: (FMISID, sensor_id) -> error message for stations whose download failed.
+    """
+    if now is None:
+        now = pd.Timestamp.now(tz="UTC").tz_localize(None)
+    start = start.floor("h")
+    stop = min(end.ceil("h"), _rollable_stop(now))
+
+    failures = {}
+    if start >= stop:
+        return failures
+
+    # Ryhmitellään asemat puuttuvien tuntien mukaan, jotta samat tunnit lasketaan yhdessä.
+    plans = group_by_missing(
+        stations,
+        lambda FMISID, sensor_id: missing_spans(_stored_spans(_load(FMISID, sensor_id, root)[0]), start, stop))
+
+    for spans, group in plans.items():
+        built = {key: [] for key in group}
+        for piece_start, piece_stop in pieces(spans, SEASON_CHUNK):
+            active = [key for key in group if key not in failures]
+            with perf.stage("rollup_build", stations=len(active), start=piece_start):
+                frames, piece_failures = _fetch_increments(active, piece_start, piece_stop - ONE_MINUTE)
+            failures.update(piece_failures)
+            for key, df in frames.items():
+                if key not in failures:
+                    built[key].append(_hourly(df, piece_start, piece_stop))
+
+        for (FMISID, sensor_id), parts in built.items():
+            if (FMISID, sensor_id) in failures or not parts:
+                continue
+            _, _, old = _load(FMISID, sensor_id, root)
+            merged = pd.concat([old, *parts]) if not old.empty else pd.concat(parts)
+            # Vanhemmissa tiedostoissa olleet aseman nimi ja sijainti jätetään pois.
+            merged = merged[~merged.index.duplicated(keep="last")].sort_index()[[*ROLLUP_COLUMNS, "minutes"]]
+            _write(FMISID, sensor_id, merged, root)
+
+    return failures
+
+
+def station_totals(
+    stations: list[tuple[int, int]],
+    starttime: str,
+    endtime: str,
+    now: pd.Timestamp = None,
+    root: str = ROLLUP_STORE_DIR
+) -> tuple[dict[tuple[int, int], dict], dict[tuple[int, int], str]]:
+    """
+    Returns the icing totals of [starttime, endtime] for several stations.
+
+    Whole final hours come from the rollups as prefix-sum differences, missing ones
+    are built first. The partial hours at the edges and the hours that are not final
+    yet are computed from minute data.
+
+    Args:
+        stations (list): List of (FMISID, sensor_id) pairs, sensor_id may be None.
+        starttime (str): Start time in format YYYYMMDDTHHMM.
+        endtime (str): End time in format YYYYMMDDTHHMM, inclusive.
+        now (pd.Timestamp): Current UTC time, defaults to the clock.
+        root (str): Rollup store directory.
+
+    Returns:
+        tuple: (totals, failures). totals maps (FMISID, sensor_id) to a StationInfo
+            dict (name, lat, lon, value = cumul_mm_filtered) with cumul_mm added,
+            or to None if the station had no data. failures is as in fetch_raw_stations.
+    """
+    if now is None:
+        now = pd.Timestamp.now(tz="UTC").tz_localize(None)
+    start = pd.Timestamp(starttime)
+    end = pd.Timestamp(endtime)
+
+    # Kokonaiset tunnit [first_hour, roll_stop) rollupeista, reunat minuuttidatasta.
+    first_hour = start.ceil("h")
+    roll_stop = min((end + ONE_MINUTE).floor("h"), _rollable_stop(now))
+    if first_hour >= roll_stop:
+        first_hour = roll_stop = None
+        edges = [(start, end)]
+    else:
+        edges = []
+        if start < first_hour:
+            edges.append((start, first_hour - ONE_MINUTE))
+        if roll_stop <= end:
+            edges.append((roll_stop, end))
+
+    failures = {}
+    if first_hour is not None:
+        failures.update(build_rollups(stations, first_hour, roll_stop, now, root))
+
+    sums = {key: {column: 0.0 for column in [*ROLLUP_COLUMNS, "minutes"]} for key in stations}
+
+    if first_hour is not None:
+        with perf.stage("rollup_query", stations=len(stations)):
+            for key in stations:
+                if key in failures:
+                    continue
+                hours, prefix, _ = _load(*key, root)
+                i, j = np.searchsorted(hours, [first_hour.to_datetime64(), roll_stop.to_datetime64()])
+                for column in sums[key]:
+                    sums[key][column] += prefix[column][j] - prefix[column][i]
+
+    for edge_start, edge_end in edges:
+        active = [key for key in stations if key not in failures]
+        if not active:
+            break
+        with perf.stage("rollup_edges", stations=len(active), start=edge_start):
+            frames, edge_failures = _fetch_increments(active, edge_start, edge_end)
+        failures.update(edge_failures)
+        for key, df in frames.items():
+            if key in failures or df.empty:
+                continue
+            for column, source in ROLLUP_COLUMNS.items():
+                sums[key][column] += float(np.nansum(df[source].to_numpy(dtype=float)))
+            sums[key]["minutes"] += int(df[ROLLUP_COLUMNS["mm_filtered"]].count())
+
+    # Nimi ja sijainti haetaan rekisteristä vain asemille, joilla on dataa.
+    meta = get_station_registry().get(
+        [key[0] for key in stations if key not in failures and sums[key]["minutes"]])
+    totals = {}
+    for key in stations:
+        if key in failures:
+            continue
+        if not sums[key]["minutes"]:
+            totals[key] = None
+            continue
+        if key[0] not in meta:
+            failures[key] = "station metadata not available"
+            continue
+        totals[key] = {
+            "name": meta[key[0]]["stationname"],
+            "lat": meta[key[0]]["lat"],
+            "lon": meta[key[0]]["lon"],
+            "value": float(sums[key]["mm_filtered"]),
+            "cumul_mm": float(sums[key]["mm"]),
+        }
+    return totals, failures
+
+
+def iter_station_totals(
+    stations: list[tuple[int, int]],
+    starttime: str,
+    endtime: str,
+    max_workers: int = MAX_FETCH_WORKERS,
+    now: pd.Timestamp = None,
+    root: str = ROLLUP_STORE_DIR
+):
+    """
+    Computes station_totals per request group and yields each station as its group finishes.
+
+    The stations are split with request_groups like in fetch_raw_stations, so each
+    group still downloads its missing data in one request. The groups run
+    concurrently in a bounded thread pool, so the first results arrive after the
+    fastest group instead of the slowest one.
+
+    Yields:
+        tuple: (key, station, error) where station is as in station_totals (None
+            if the station had no data or failed) and error is the download or
+            computation error message or None.
+    """
+    if not stations:
+        return
+    # Asemien metatiedot haetaan yhdellä pyynnöllä, muuten säikeet hakisivat ne yksitellen rekisterin lukon takana.
+    get_station_registry().get([FMISID for FMISID, _ in stations])
+    groups = request_groups(stations)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(groups)))) as executor:
+        futures = {
+            executor.submit(perf.propagate(station_totals), group, starttime, endtime, now, root): group
+            for group in groups
+        }
+        for future in as_completed(futures):
+            group = futures[future]
+            try:
+                totals, failures = future.result()
+            except Exception as e:
+                # Yhden ryhmän virhe ei saa katkaista muiden ryhmien tuloksia.
+                for key in group:
+                    yield key, None, str(e) or type(e).__name__
+                continue
+            for key in group:
+                yield key, totals.get(key), failures.get(key)
+
+
+def rollup_frame(
+    FMISID: int,
+    sensor_id: int,
+    start: pd.Timestamp,
+    end: pd.Timestamp,
+    freq: str = "h",
+    root: str = ROLLUP_STORE_DIR
+) -> pd.DataFrame:
+    """
+    Returns the stored increments of [start, end) per hour ("h") or per UTC day ("D").
+
+    Only hours already rolled up are included, call build_rollups first to fill the range.
+    """
+    _, _, df = _load(FMISID, sensor_id, root)
+    if df.empty:
+        return df
+    df = df.loc[start:end - ONE_MINUTE, [*ROLLUP_COLUMNS, "minutes"]]
+    if freq == "h":
+        return df
+    return df.resample(freq).sum()
@@ -0,0 +1,126 @@
+"""
+stations.py
+
+Station table of the app and a registry of station metadata. The name and location
+of a station do not change between requests, so they are downloaded once per
+station with fetch_station_meta, kept in memory and cached on disk:
+
+    <ICING_STATION_REGISTRY, default .icing_cache/stations.json>
+
+Data requests then carry only the time and frequency columns, and the station name
+and coordinates for the map, the graphs and the exports come from the registry.
+Delete the file to download the metadata again.
+
+Functions:
+- place_station(place): Palauttaa paikkakunnan (FMISID, sensor_id)-parin.
+- get_station_registry(): Palauttaa prosessin yhteisen asemarekisterin.
+
+Classes:
+- StationRegistry: Asemien nimet ja sijainnit muistissa ja levyllä, puuttuvat haetaan kerran.
+"""
+
+import os
+import json
+import logging
+import threading
+from typing import TypedDict
+from data_fetchers import fetch_station_meta, FETCH_ERRORS
+from store_io import atomic_write
+
+logger = logging.getLogger(__name__)
+
+PLACES = {
+    "Vantaa": 100968, "Turku": 101065, "Maarianhamina": 100907,
+    "Pori": 101044, "Tampere": 101118, "Halli": 101315, "Tikkakoski": 137208,
+    "Seinäjoki": 137188, "Vaasa": 101462, "Kruunupyy": 101662, "Siilinjärvi": 101570,
+    "Joensuu": 101608, "Utti": 101191, "Lappeenranta": 101237, "Savonlinna": 101430,
+    "Mikkeli": 855522, "Kajaani": 101725, "Oulu": 101786, "Kemi": 101840, "Kuusamo": 101886,
+    "Rovaniemi": 137190, "Ivalo": 102033, "Kittilä": 101986
+}
+
+# Asemilla, joilla on useampi jäätämisanturi, haetaan pääanturin data sen tunnuksella.
+SENSOR_IDS = {
+    100968: 37,  # Vantaa
+}
+
+STATION_REGISTRY_PATH = os.environ.get("ICING_STATION_REGISTRY", os.path.join(".icing_cache", "stations.json"))
+
+
+class StationMeta(TypedDict):
+    fmisid: int
+    stationname: str
+    lat: float
+    lon: float
+
+
+def place_station(place: str) -> tuple[int, int]:
+    """Returns the (FMISID, sensor_id) pair of a place in PLACES."""
+    FMISID = PLACES[place]
+    return FMISID, SENSOR_IDS.get(FMISID)
+
+
+class StationRegistry:
+    """
+    Thread-safe metadata registry. Stations missing from the registry are downloaded
+    together in one request on first use and written to the disk cache.
+
+    Usage:
+        meta = get_station_registry().get([101786, 100968])
+        meta[101786]["stationname"], meta[101786]["lat"], meta[101786]["lon"]
+    """
+
+    def __init__(self, path: str = STATION_REGISTRY_PATH):
+        self.path = path
+        self._stations = None
+        self._lock = threading.Lock()
+
+    def get(self, FMISIDs: list[int]) -> dict[int, StationMeta]:
+        """
+        Returns the metadata of the stations, downloading the unknown ones.
+
+        Args:
+            FMISIDs (list): FMI station IDs.
+
+        Returns:
+            dict: FMISID -> StationMeta. Stations whose metadata could not be
+                downloaded are left out.
+        """
+        with self._lock:
+            if self._stations is None:
+                self._stations = self._read()
+            missing = [FMISID for FMISID in dict.fromkeys(FMISIDs) if FMISID not in self._stations]
+            if missing:
+                # Lukko pidetään latauksen ajan, jotta samoja asemia ei haeta rinnakkain.
+                try:
+                    fetched = fetch_station_meta(missing)
+                except FETCH_ERRORS as e:
+                    logger.warning("Station metadata download failed for %s: %s", missing, e)
+                    fetched = {}
+                if fetched:
+                    self._stations.update(fetched)
+                    self._write()
+            return {FMISID: self._stations[FMISID] for FMISID in FMISIDs if FMISID in self._stations}
+
+    def _read(self) -> dict[int, StationMeta]:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return {int(FMISID): meta for FMISID, meta in json.load(f).items()}
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self):
+        """Writes the registry atomically."""
+        def write(tmp_path: str):
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({str(FMISID): meta for FMISID, meta in self._stations.items()}, f,
+                          ensure_ascii=False, indent=1)
+
+        atomic_write(self.path, write)
+
+
+_registry = StationRegistry()
+
+
+def get_station_registry() -> StationRegistry:
+    """Returns the process-wide station registry."""
+    return _registry
@@ -0,0 +1,129 @@
+"""
+store_io.py
+
+Shared building blocks of the on-disk stores (raw_store, rollup_store, event_index
+and the station registry):
+
+- atomic writes: a file is written to a temporary file in the same directory and
+  moved into place with os.replace, so concurrent readers never see half a file
+- an in-memory cache of parsed files, reloaded only when the file's mtime changes
+- planning of the [start, stop) spans a store is still missing, grouping stations
+  that miss the same spans and splitting the spans into pieces of bounded length
+
+Functions:
+- atomic_write(path, write): Kirjoittaa tiedoston väliaikaisen tiedoston kautta atomisesti.
+- missing_spans(covered, start, stop): Palauttaa aikavälin osat, joita tallennetut välit eivät kata.
+- group_by_missing(stations, missing): Ryhmittelee asemat puuttuvien aikavälien mukaan.
+- pieces(spans, chunk): Pilkkoo aikavälit enintään chunk-pituisiksi paloiksi.
+
+Classes:
+- MtimeCache: Jäsennetyt tiedostot muistissa, ladataan uudelleen vain tiedoston muuttuessa.
+"""
+
+import os
+import tempfile
+import threading
+import pandas as pd
+
+
+def atomic_write(path: str, write):
+    """
+    Writes a file atomically.
+
+    Args:
+        path (str): Final path of the file, its directory is created if needed.
+        write (callable): Called as write(tmp_path) to write the contents.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    # Kirjoitetaan ensin väliaikaiseen tiedostoon, jotta rinnakkaiset lukijat eivät näe puolikasta tiedostoa.
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class MtimeCache:
+    """
+    Thread-safe cache of parsed files keyed by path and modification time.
+
+    Usage:
+        value = cache.load(path, read)  # read(path) must also handle a missing file
+    """
+
+    def __init__(self):
+        # Polku -> (muokkausaika, jäsennetty arvo).
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def load(self, path: str, read):
+        """Returns read(path), calling it again only if the file changed since the last call."""
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        with self._lock:
+            cached = self._entries.get(path)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+        value = read(path)
+        with self._lock:
+            self._entries[path] = (mtime, value)
+        return value
+
+
+def missing_spans(covered: list, start: pd.Timestamp, stop: pd.Timestamp) -> tuple:
+    """
+    Returns the parts of [start, stop) not covered by the stored spans.
+
+    Args:
+        covered (list): Sorted, non-overlapping [start, stop) spans already stored.
+        start (pd.Timestamp): Start of the wanted range.
+        stop (pd.Timestamp): End of the wanted range, exclusive.
+
+    Returns:
+        tuple: Missing (start, stop) spans in time order, hashable for group_by_missing.
+    """
+    missing = []
+    cursor = start
+    for span_start, span_stop in covered:
+        if span_stop <= cursor:
+            continue
+        if span_start >= stop:
+            break
+        if span_start > cursor:
+            missing.append((cursor, span_start))
+        cursor = max(cursor, span_stop)
+    if cursor < stop:
+        missing.append((cursor, stop))
+    return tuple(missing)
+
+
+def group_by_missing(stations: list[tuple[int, int]], missing) -> dict[tuple, list[tuple[int, int]]]:
+    """
+    Groups stations that miss the same spans, so they can be computed together.
+
+    Args:
+        stations (list): List of (FMISID, sensor_id) pairs.
+        missing (callable): Called as missing(FMISID, sensor_id), returns the missing spans as a tuple.
+
+    Returns:
+        dict: Missing spans -> stations, stations missing nothing are left out.
+    """
+    plans: dict[tuple, list[tuple[int, int]]] = {}
+    for FMISID, sensor_id in stations:
+        spans = missing(FMISID, sensor_id)
+        if spans:
+            plans.setdefault(spans, []).append((FMISID, sensor_id))
+    return plans
+
+
+def pieces(spans: tuple, chunk: pd.Timedelta):
+    """Yields the (start, stop) pieces of the spans, each at most chunk long."""
+    for span_start, span_stop in spans:
+        piece_start = span_start
+        while piece_start < span_stop:
+            piece_stop = min(piece_start + chunk, span_stop)
+            yield piece_start, piece_stop
+            piece_start = piece_stop
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Sovelluksen moduulit ovat repositorion juuressa.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,22 @@
+"""Raw station frames shared by the batch calculation tests."""
+
+import numpy as np
+import pandas as pd
+from benchmarks.synthetic import synthetic_station_frame
+
+START = pd.Timestamp("2024-12-16")
+STATIONS = [101786, 100968, 101065, 101840]
+
+
+def station_frames() -> dict:
+    """Returns new raw frames of four stations with offset ranges and a NaN run, and one empty station."""
+    frames = {}
+    for i, FMISID in enumerate(STATIONS):
+        # Asemien aikavälit alkavat ja loppuvat eri minuuteilla.
+        start = START + pd.Timedelta(minutes=13 * i)
+        end = START + pd.Timedelta(days=2) - pd.Timedelta(minutes=29 * i)
+        frames[(FMISID, None)] = synthetic_station_frame(FMISID, start, end)
+    df = frames[(100968, None)]
+    df.iloc[500:560, df.columns.get_loc("fzfreq")] = np.nan
+    frames[(102033, None)] = pd.DataFrame()
+    return frames
@@ -0,0 +1,36 @@
+"""With the default parameters calibration_sweep must give the daily sums of calculate_icing_batch."""
+
+import numpy as np
+import pandas as pd
+from icing_batch import calculate_icing_batch, calibration_sweep
+from frames import START, station_frames
+
+
+def test_default_calibration_sweep_matches_daily_sums():
+    frames = station_frames()
+    del frames[(102033, None)]
+    start = START + pd.Timedelta(hours=2)
+    end = START + pd.Timedelta(days=2) - pd.Timedelta(hours=2)
+
+    sweep = calibration_sweep(frames, start=start, end=end)
+    batch = calculate_icing_batch(frames)
+
+    for (FMISID, _), df in batch.items():
+        rows = df.loc[start:end]
+        expected = rows.groupby(rows.index.floor("D"))[["mm_instant", "mm_instant_filtered"]].sum()
+        got = sweep[sweep["fmisid"] == FMISID].set_index("period")
+        np.testing.assert_allclose(got["mm"].to_numpy(), expected["mm_instant"].to_numpy(), rtol=1e-9, atol=1e-12)
+        np.testing.assert_allclose(
+            got["mm_filtered"].to_numpy(), expected["mm_instant_filtered"].to_numpy(), rtol=1e-9, atol=1e-12)
+
+
+def test_off_grid_station_is_skipped_with_a_warning(caplog):
+    frames = station_frames()
+    del frames[(102033, None)]
+    key = next(iter(frames))
+    frames[key] = frames[key].set_axis(frames[key].index + pd.Timedelta(seconds=30))
+
+    with caplog.at_level("WARNING", logger="icing_batch"):
+        sweep = calibration_sweep(frames)
+    assert key[0] not in set(sweep["fmisid"])
+    assert "not on whole minutes" in caplog.text
@@ -0,0 +1,28 @@
+"""Result cache ownership of fetch_icing_batch."""
+
+import pandas as pd
+import data_fetchers
+from benchmarks.synthetic import synthetic_station_frame
+from result_cache import IcingResultCache
+
+START = pd.Timestamp("2024-12-16")
+
+
+def test_cache_results_false_leaves_result_cache_alone(monkeypatch):
+    cache = IcingResultCache()
+    monkeypatch.setattr(data_fetchers, "get_result_cache", lambda: cache)
+    monkeypatch.setattr(data_fetchers, "fetch_raw_cached", lambda stations, starttime, endtime: (
+        {key: synthetic_station_frame(key[0], pd.Timestamp(starttime), pd.Timestamp(endtime)) for key in stations}, {}))
+    stations = [(101786, None), (100968, None)]
+
+    frames, _ = data_fetchers.fetch_icing_batch(
+        stations, "20241216T0000", "20241216T1200", "plot", True, cache_results=False)
+    assert set(frames) == set(stations)
+    assert cache.stats()["entries"] == 0
+
+    # Välimuistissa jo olevat kehykset käytetään sellaisenaan.
+    data_fetchers.fetch_icing_batch(stations[:1], "20241216T0000", "20241216T1200", "plot", True)
+    cached = cache.get(cache.make_key(101786, None, "20241216T0000", "20241216T1200", "plot", True))
+    frames, _ = data_fetchers.fetch_icing_batch(
+        stations[:1], "20241216T0000", "20241216T1200", "plot", True, cache_results=False)
+    assert frames[(101786, None)] is cached
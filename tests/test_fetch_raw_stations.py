@@ -0,0 +1,25 @@
+"""Per-request failure handling of fetch_raw_stations."""
+
+import pandas as pd
+import pyarrow as pa
+import requests
+import data_fetchers
+
+
+def test_parse_error_fails_only_its_group(monkeypatch):
+    index = pd.date_range("2025-01-01", periods=3, freq="min", name="utctime")
+
+    def fetch_group(FMISIDs, starttime, endtime, sensor_id=None):
+        if 2 in FMISIDs:
+            raise pa.ArrowInvalid("CSV parse error: expected 3 columns, got 1: <html>")
+        if 3 in FMISIDs:
+            raise requests.ConnectionError("connection refused")
+        return {FMISID: pd.DataFrame({"fzfreq": [1.0, 2.0, 3.0]}, index=index) for FMISID in FMISIDs}
+
+    monkeypatch.setattr(data_fetchers, "_fetch_group", fetch_group)
+    frames, failures = data_fetchers.fetch_raw_stations(
+        [(1, None), (2, None), (3, None)], "20250101T0000", "20250101T0002", stations_per_request=1)
+
+    assert list(frames) == [(1, None)]
+    assert set(failures) == {(2, None), (3, None)}
+    assert "CSV parse error" in failures[(2, None)]
@@ -0,0 +1,67 @@
+"""Parity of the vectorized fill_melt_gaps with the original per-NaN loop of calculate_icing."""
+
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+import pytest
+from data_fetchers import fill_melt_gaps
+
+
+def loop_fill(series: pd.Series) -> pd.Series:
+    """The melt-gap loop of calculate_icing before vectorization, on a Series."""
+    df = series.to_frame("mm_instant").copy()
+    nan_times = df[df["mm_instant"].isna()].index
+    df_orig = df.copy()
+    for mittausaika in nan_times:
+        window_start = mittausaika - timedelta(minutes=15)
+        window_df = df_orig.loc[window_start:mittausaika]
+        valid_df = window_df.dropna(subset=["mm_instant"])
+        if not valid_df.empty:
+            latest_valid_time = valid_df.index.max()
+            start_time = latest_valid_time - timedelta(minutes=15)
+            mean_window_df = df_orig.loc[start_time:latest_valid_time]
+            df.loc[mittausaika, "mm_instant"] = mean_window_df["mm_instant"].mean()
+    return df["mm_instant"]
+
+
+def regular_index(n: int) -> pd.DatetimeIndex:
+    return pd.date_range("2025-01-01", periods=n, freq="min", name="utctime")
+
+
+def irregular_index(n: int, rng: np.random.Generator) -> pd.DatetimeIndex:
+    # 1-3 minuutin välit ja välillä pidempiä katkoja, jolloin ikkunan rivimäärä vaihtelee.
+    steps = rng.choice([1, 1, 1, 2, 3, 7, 20], size=n)
+    return pd.DatetimeIndex(pd.Timestamp("2025-01-01") + pd.to_timedelta(np.cumsum(steps), unit="min"), name="utctime")
+
+
+def with_gaps(index: pd.DatetimeIndex, rng: np.random.Generator) -> pd.Series:
+    n = len(index)
+    values = rng.gamma(0.5, 0.002, size=n)
+    values[:5] = np.nan                 # alussa, ei aiempaa arvoa
+    values[40:44] = np.nan              # lyhyt sulatus
+    values[100:130] = np.nan            # yli 15 min sulatus
+    values[rng.random(n) < 0.05] = np.nan  # yksittäisiä puuttuvia
+    values[-8:] = np.nan                # lopussa
+    return pd.Series(values, index=index, name="mm_instant")
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("irregular", [False, True])
+def test_matches_loop(seed, irregular):
+    rng = np.random.default_rng(seed)
+    index = irregular_index(400, rng) if irregular else regular_index(400)
+    series = with_gaps(index, rng)
+
+    expected = loop_fill(series)
+    result = fill_melt_gaps(series)
+
+    pd.testing.assert_series_equal(result, expected, check_exact=False, rtol=1e-12, atol=0)
+    # Alun NaN jää, ja pitkän sulatuksen loppupää ei täyty.
+    assert result.iloc[:5].isna().all()
+
+
+def test_no_gaps_returns_copy():
+    series = pd.Series(np.arange(10, dtype=float), index=regular_index(10))
+    result = fill_melt_gaps(series)
+    pd.testing.assert_series_equal(result, series)
+    assert result is not series
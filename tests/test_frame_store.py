@@ -0,0 +1,49 @@
+"""Expiry of recent ranges in FrameStore."""
+
+import pandas as pd
+from frame_store import FrameStore
+
+KEY = (101786, None, "20241216T0000", "20241217T0000", "plot", True)
+
+
+class Loader:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, keys):
+        self.calls += 1
+        return {key: pd.DataFrame({"fzfreq": [float(self.calls)]}) for key in keys}, {}
+
+
+def now_endtime():
+    return f"{pd.Timestamp.now(tz='UTC').tz_localize(None):%Y%m%dT%H%M}"
+
+
+def test_recent_range_is_reloaded_after_expiry():
+    store = FrameStore(recent_ttl=0)
+    load = Loader()
+    handles, _ = store.acquire([KEY], load, now_endtime())
+    first = handles[KEY]
+    assert first.expired
+
+    handles, _ = store.acquire([KEY], load, now_endtime())
+    second = handles[KEY]
+    assert load.calls == 2
+    assert second.frame["fzfreq"].iloc[0] == 2.0
+    # Vanha kahva pitää vanhan kehyksen, sen vapautus ei koske uuteen merkintään.
+    assert first.frame["fzfreq"].iloc[0] == 1.0
+    first.release()
+    assert store.stats()["references"] == 1
+    assert store.stats()["expirations"] == 1
+    second.release()
+    assert store.stats()["references"] == 0
+
+
+def test_historical_range_is_kept():
+    store = FrameStore(recent_ttl=0)
+    load = Loader()
+    handles, _ = store.acquire([KEY], load, "20241217T0000")
+    handles[KEY].release()
+    handles, _ = store.acquire([KEY], load, "20241217T0000")
+    assert not handles[KEY].expired
+    assert load.calls == 1
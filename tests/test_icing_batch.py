@@ -0,0 +1,43 @@
+"""calculate_icing_batch must give the same frames as calculate_icing per station."""
+
+import numpy as np
+import pandas as pd
+import pytest
+from benchmarks.synthetic import synthetic_station_frame
+from data_fetchers import calculate_icing
+from icing_batch import calculate_icing_batch
+from frames import START, station_frames
+
+
+@pytest.mark.parametrize("profile, float32", [("full", False), ("plot", True), ("map-only", False)])
+def test_batch_matches_calculate_icing(profile, float32):
+    frames = station_frames()
+    result = calculate_icing_batch(frames, profile, float32)
+
+    assert set(result) == set(frames)
+    for key, raw in frames.items():
+        if raw.empty:
+            assert result[key].empty
+            continue
+        expected = calculate_icing(raw.copy(), profile, float32)
+        rtol = 1e-6 if float32 else 1e-9
+        pd.testing.assert_frame_equal(result[key], expected, check_exact=False, rtol=rtol, atol=1e-11)
+
+
+def test_off_grid_station_falls_back():
+    raw = synthetic_station_frame(101786, START, START + pd.Timedelta(hours=6))
+    raw.index = raw.index + pd.Timedelta(seconds=30)
+    result = calculate_icing_batch({(101786, None): raw})
+    pd.testing.assert_frame_equal(result[(101786, None)], calculate_icing(raw.copy()))
+
+
+def test_station_with_dropped_rows_matches_calculate_icing():
+    frames = station_frames()
+    raw = frames[(101786, None)]
+    # Rivit puuttuvat kokonaan (ei NaN-arvoja), myös sulatusjakson ja kertymän kohdalta.
+    frames[(101786, None)] = raw.drop(raw.index[np.r_[300:320, 700:710, 1500:1510]])
+    result = calculate_icing_batch(frames)
+    for key, raw in frames.items():
+        if not raw.empty:
+            pd.testing.assert_frame_equal(
+                result[key], calculate_icing(raw.copy()), check_exact=False, rtol=1e-9, atol=1e-11)
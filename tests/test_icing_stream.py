@@ -0,0 +1,50 @@
+"""IcingStream must give the same rows as calculate_icing on the whole series."""
+
+import numpy as np
+import pandas as pd
+import pytest
+from benchmarks.synthetic import synthetic_station_frame
+from data_fetchers import calculate_icing
+from icing_stream import IcingStream
+
+START = pd.Timestamp("2024-12-16")
+
+
+def synthetic_day(fmisid: int = 101786) -> pd.DataFrame:
+    return synthetic_station_frame(fmisid, START, START + pd.Timedelta(hours=23, minutes=59))
+
+
+@pytest.mark.parametrize("chunk", [1, 7, 60, 333, 1440])
+def test_chunks_match_batch(chunk):
+    raw = synthetic_day()
+    if chunk == 1:
+        # Minuutti kerrallaan riittää muutama tunti, koko päivä olisi hidas.
+        raw = raw.iloc[:240]
+    expected = calculate_icing(raw.copy())
+
+    stream = IcingStream()
+    parts = [stream.update(raw.iloc[i:i + chunk]) for i in range(0, len(raw), chunk)]
+    parts.append(stream.flush())
+
+    pd.testing.assert_frame_equal(pd.concat(parts), expected, check_exact=False, rtol=1e-9, atol=1e-12)
+    assert stream.totals["cumul_mm_filtered"] == pytest.approx(expected["cumul_mm_filtered"].iloc[-1])
+
+
+def test_random_chunks_with_gaps_match_batch():
+    raw = synthetic_day(100968)
+    # Puuttuvia rivejä ja NaN-jaksoja kuten sulatuksissa ja katkoissa.
+    raw = raw.drop(raw.index[300:340])
+    raw.iloc[700:720, raw.columns.get_loc("fzfreq")] = np.nan
+    expected = calculate_icing(raw.copy())
+
+    rng = np.random.default_rng(0)
+    stream = IcingStream()
+    parts = []
+    i = 0
+    while i < len(raw):
+        n = int(rng.integers(1, 200))
+        parts.append(stream.update(raw.iloc[i:i + n]))
+        i += n
+    parts.append(stream.flush())
+
+    pd.testing.assert_frame_equal(pd.concat(parts), expected, check_exact=False, rtol=1e-9, atol=1e-12)
@@ -0,0 +1,15 @@
+"""Cold import time budgets of the entry modules (benchmarks/import_time.py)."""
+
+import os
+import pytest
+from benchmarks.import_time import BUDGETS, measure
+
+# Hitailla koneilla budjetteja voi väljentää, esim. ICING_IMPORT_TIME_SCALE=2.
+SCALE = float(os.environ.get("ICING_IMPORT_TIME_SCALE", "1.0"))
+
+
+@pytest.mark.parametrize("module", list(BUDGETS))
+def test_import_stays_within_budget(module):
+    result = measure(module, repeat=3)
+    assert not result["heavy"], f"{module} imports {', '.join(result['heavy'])}"
+    assert result["seconds"] <= BUDGETS[module] * SCALE, f"{module}: {result['seconds']:.3f} s"
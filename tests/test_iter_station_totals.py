@@ -0,0 +1,51 @@
+"""Request grouping and error handling of rollup_store.iter_station_totals."""
+
+import pandas as pd
+import rollup_store
+from benchmarks.synthetic import synthetic_station_frame
+from data_fetchers import request_groups
+from stations import place_station, PLACES
+
+
+class Registry:
+    def get(self, FMISIDs):
+        return {FMISID: {"fmisid": FMISID, "stationname": str(FMISID), "lat": 60.0, "lon": 25.0}
+                for FMISID in FMISIDs}
+
+
+def test_failing_group_does_not_stop_the_others(monkeypatch, tmp_path):
+    def station_totals(stations, starttime, endtime, now=None, root=None):
+        if stations[0][1] == 5:
+            raise OSError("disk full")
+        return {key: {"value": 1.0} for key in stations}, {}
+
+    monkeypatch.setattr(rollup_store, "station_totals", station_totals)
+    monkeypatch.setattr(rollup_store, "get_station_registry", lambda: Registry())
+    stations = [(1, None), (2, 5), (3, None)]
+    results = {key: (station, error) for key, station, error in rollup_store.iter_station_totals(
+        stations, "20241216T0000", "20241217T0000", root=str(tmp_path))}
+
+    assert results[(2, 5)] == (None, "disk full")
+    assert results[(1, None)] == ({"value": 1.0}, None)
+    assert results[(3, None)] == ({"value": 1.0}, None)
+
+
+def test_stations_are_fetched_in_request_groups(monkeypatch, tmp_path):
+    calls = []
+
+    def fetch_raw_cached(stations, starttime, endtime):
+        calls.append(list(stations))
+        return {key: synthetic_station_frame(key[0], pd.Timestamp(starttime), pd.Timestamp(endtime))
+                for key in stations}, {}
+
+    monkeypatch.setattr(rollup_store, "fetch_raw_cached", fetch_raw_cached)
+    monkeypatch.setattr(rollup_store, "get_station_registry", lambda: Registry())
+    stations = [place_station(place) for place in PLACES]
+    results = list(rollup_store.iter_station_totals(
+        stations, "20241216T0030", "20241216T2330", now=pd.Timestamp("2024-12-20"), root=str(tmp_path)))
+
+    assert sorted(key for key, _, _ in results) == sorted(stations)
+    assert all(error is None and station["value"] >= 0 for _, station, error in results)
+    groups = request_groups(stations)
+    assert len(groups) == 5
+    assert sorted(map(sorted, calls)) == sorted(sorted(group) for group in groups for _ in range(3))
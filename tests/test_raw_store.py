@@ -0,0 +1,66 @@
+"""Day partition bookkeeping of raw_store."""
+
+import numpy as np
+import pandas as pd
+import raw_store
+
+DAY = pd.Timestamp("2025-01-10")
+
+
+def day_frame(values) -> pd.DataFrame:
+    index = pd.date_range(DAY, periods=len(values), freq="min", name="utctime")
+    return pd.DataFrame({"fzfreq": values}, index=index)
+
+
+def test_closed_day_with_data_is_complete(tmp_path):
+    now = DAY + pd.Timedelta(days=2)
+    ranges = raw_store.plan_fetch(1, None, DAY, DAY + pd.Timedelta(hours=23, minutes=59), now, root=tmp_path)
+    assert ranges == [(DAY, DAY + pd.Timedelta(hours=23, minutes=59))]
+
+    raw_store.store_fetched(1, None, day_frame(np.full(1440, 40000.0)), ranges, now, root=tmp_path)
+    assert raw_store._load_day(1, None, DAY, str(tmp_path))[1]
+    assert raw_store.plan_fetch(1, None, DAY, DAY, now + pd.Timedelta(days=30), root=tmp_path) == []
+
+
+def test_empty_closed_day_is_retried(tmp_path):
+    ranges = [(DAY, DAY + pd.Timedelta(hours=23, minutes=59))]
+    now = DAY + pd.Timedelta(days=1, hours=2)
+    raw_store.store_fetched(1, None, pd.DataFrame(), ranges, now, root=tmp_path)
+
+    df, complete = raw_store._load_day(1, None, DAY, str(tmp_path))
+    assert df is not None and df.empty and not complete
+
+    # Uudelleenyritysvälin sisällä ei ladata, sen jälkeen koko päivä ladataan uudelleen.
+    # Välin alku on tiedoston muokkausaika.
+    written = pd.Timestamp.now(tz="UTC").tz_localize(None)
+    assert raw_store.plan_fetch(1, None, DAY, DAY, written, root=tmp_path) == []
+    later = written + raw_store.EMPTY_DAY_RETRY + pd.Timedelta(seconds=1)
+    assert raw_store.plan_fetch(1, None, DAY, DAY, later, root=tmp_path) == ranges
+
+    # Myöhemmin saapunut data tallentuu ja päivä jäädytetään.
+    raw_store.store_fetched(1, None, day_frame(np.full(1440, 40000.0)), ranges, later, root=tmp_path)
+    df, complete = raw_store._load_day(1, None, DAY, str(tmp_path))
+    assert complete and len(df) == 1440
+
+
+def test_empty_day_is_final_after_grace(tmp_path):
+    ranges = [(DAY, DAY + pd.Timedelta(hours=23, minutes=59))]
+    now = DAY + pd.Timedelta(days=1) + raw_store.EMPTY_DAY_FINAL + pd.Timedelta(hours=1)
+    raw_store.store_fetched(1, None, day_frame(np.full(1440, np.nan)), ranges, now, root=tmp_path)
+    assert raw_store._load_day(1, None, DAY, str(tmp_path))[1]
+
+
+def test_open_day_is_fresh_only_while_prefetch_runs(tmp_path):
+    now = pd.Timestamp.now(tz="UTC").tz_localize(None).floor("min")
+    today = now.normalize()
+    raw_store.store_fetched(1, None, day_frame(np.full(5, 40000.0)).set_axis(
+        pd.date_range(today, periods=5, freq="min", name="utctime")), [(today, now)], now, root=tmp_path)
+
+    # Ilman taustahakua avoin päivä päivitetään viimeisestä minuutista.
+    assert raw_store.plan_fetch(1, None, today, now, now, root=tmp_path) == [(today + pd.Timedelta(minutes=4), now)]
+
+    raw_store.mark_prefetched(root=tmp_path)
+    assert raw_store.plan_fetch(1, None, today, now, now, root=tmp_path) == []
+
+    later = now + raw_store.PARTIAL_FRESH_FOR + pd.Timedelta(minutes=1)
+    assert raw_store.plan_fetch(1, None, today, now, later, root=tmp_path) != []
@@ -0,0 +1,44 @@
+"""Caching of resampled frames and drawing them."""
+
+import pandas as pd
+from benchmarks.synthetic import synthetic_station_frame
+from data_fetchers import calculate_icing
+from render_service import render_png
+from resample import get_resampled, resample_icing
+
+START = pd.Timestamp("2024-12-16")
+END = START + pd.Timedelta(days=3)
+
+
+def icing_frame():
+    return calculate_icing(synthetic_station_frame(101786, START, END))
+
+
+def test_refreshed_base_frame_is_resampled_again():
+    df = icing_frame()
+    old = get_resampled(df, "hourly")
+    assert get_resampled(df.copy(), "hourly") is old
+
+    refreshed = df.copy()
+    refreshed.iloc[-60:, refreshed.columns.get_loc("mm_instant")] += 1.0
+    new = get_resampled(refreshed, "hourly")
+    pd.testing.assert_frame_equal(new, resample_icing(refreshed, "hourly"))
+    assert new["mm_instant"].iloc[-1] != old["mm_instant"].iloc[-1]
+
+
+def test_resampled_frame_is_drawn():
+    df = get_resampled(icing_frame(), "hourly")
+    assert {"moving_minimun_15minutes_min", "moving_minimun_15minutes_max"} <= set(df.columns)
+    png = render_png(df, "Oulu", 101786, START.to_pydatetime(), END.to_pydatetime(), None, "hourly")
+    assert png.startswith(b"\x89PNG")
+
+
+def test_increments_are_summed_and_nfc_keeps_its_unit():
+    df = icing_frame()
+    hourly = resample_icing(df, "hourly")
+    buckets = df.groupby(df.index.floor("h"))
+    pd.testing.assert_series_equal(
+        hourly["mm_instant_filtered"], buckets["mm_instant_filtered"].sum(min_count=1), check_names=False,
+        check_index_type=False, check_freq=False)
+    pd.testing.assert_series_equal(
+        hourly["NFC"], buckets["NFC"].max(), check_names=False, check_index_type=False, check_freq=False)
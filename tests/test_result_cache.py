@@ -0,0 +1,26 @@
+"""Time-to-live of recent ranges in IcingResultCache."""
+
+import pandas as pd
+import raw_store
+from result_cache import IcingResultCache, is_recent_range
+
+NOW = pd.Timestamp("2024-12-16 12:00")
+
+
+def test_recent_range_uses_closed_day_cutoff():
+    cutoff = NOW - raw_store.CLOSED_DAY_DELAY
+    assert is_recent_range(f"{NOW:%Y%m%dT%H%M}", NOW)
+    assert is_recent_range(f"{cutoff:%Y%m%dT%H%M}", NOW)
+    assert is_recent_range(f"{cutoff + pd.Timedelta(minutes=30):%Y%m%dT%H%M}", NOW)
+    assert not is_recent_range(f"{cutoff - pd.Timedelta(minutes=1):%Y%m%dT%H%M}", NOW)
+
+
+def test_range_ending_before_now_but_after_cutoff_expires():
+    cache = IcingResultCache(recent_ttl=0)
+    df = pd.DataFrame({"fzfreq": [1.0]})
+    now = pd.Timestamp.now(tz="UTC").tz_localize(None)
+    recent = f"{now - raw_store.CLOSED_DAY_DELAY / 2:%Y%m%dT%H%M}"
+    cache.put(("recent",), df, recent)
+    cache.put(("old",), df, "20240101T0000")
+    assert cache.get(("recent",)) is None
+    assert cache.get(("old",)) is df
@@ -0,0 +1,38 @@
+"""Station registry downloads and their errors."""
+
+import pyarrow as pa
+import rollup_store
+import stations
+from stations import StationRegistry
+
+
+def test_parse_error_leaves_stations_out(monkeypatch, tmp_path):
+    def fetch_station_meta(FMISIDs):
+        raise pa.ArrowInvalid("CSV parse error")
+
+    monkeypatch.setattr(stations, "fetch_station_meta", fetch_station_meta)
+    registry = StationRegistry(str(tmp_path / "stations.json"))
+    assert registry.get([101786]) == {}
+
+
+def test_iter_station_totals_fetches_metadata_once(monkeypatch, tmp_path):
+    calls = []
+
+    def fetch_station_meta(FMISIDs):
+        calls.append(list(FMISIDs))
+        return {FMISID: {"fmisid": FMISID, "stationname": str(FMISID), "lat": 60.0, "lon": 25.0}
+                for FMISID in FMISIDs}
+
+    def station_totals(keys, starttime, endtime, now=None, root=None):
+        meta = registry.get([key[0] for key in keys])
+        return {key: {"name": meta[key[0]]["stationname"], "value": 1.0} for key in keys}, {}
+
+    registry = StationRegistry(str(tmp_path / "stations.json"))
+    monkeypatch.setattr(stations, "fetch_station_meta", fetch_station_meta)
+    monkeypatch.setattr(rollup_store, "get_station_registry", lambda: registry)
+    monkeypatch.setattr(rollup_store, "station_totals", station_totals)
+    keys = [(FMISID, None) for FMISID in stations.PLACES.values()]
+
+    results = list(rollup_store.iter_station_totals(keys, "20241216T0000", "20241217T0000", root=str(tmp_path)))
+    assert len(results) == len(keys)
+    assert calls == [[FMISID for FMISID, _ in keys]]
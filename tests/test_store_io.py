@@ -0,0 +1,60 @@
+"""Shared store helpers: atomic writes, the mtime cache and span planning."""
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import rollup_store
+from store_io import atomic_write, MtimeCache, missing_spans, group_by_missing, pieces
+
+T0 = pd.Timestamp("2024-12-01")
+H = pd.Timedelta(hours=1)
+
+
+def test_atomic_write_leaves_no_temporary_files(tmp_path):
+    path = str(tmp_path / "sub" / "file.txt")
+    atomic_write(path, lambda tmp: open(tmp, "w").write("ok"))
+    with pytest.raises(RuntimeError):
+        atomic_write(path, lambda tmp: (_ for _ in ()).throw(RuntimeError("failed")))
+    assert open(path).read() == "ok"
+    assert os.listdir(tmp_path / "sub") == ["file.txt"]
+
+
+def test_mtime_cache_reloads_changed_file(tmp_path):
+    path = str(tmp_path / "file.txt")
+    reads = []
+
+    def read(p):
+        reads.append(p)
+        return open(p).read() if os.path.exists(p) else None
+
+    cache = MtimeCache()
+    assert cache.load(path, read) is None
+    atomic_write(path, lambda tmp: open(tmp, "w").write("a"))
+    assert cache.load(path, read) == "a"
+    assert cache.load(path, read) == "a"
+    assert len(reads) == 2
+
+
+def test_missing_spans_and_pieces():
+    covered = [(T0 + 2 * H, T0 + 4 * H), (T0 + 6 * H, T0 + 7 * H)]
+    missing = missing_spans(covered, T0, T0 + 10 * H)
+    assert missing == ((T0, T0 + 2 * H), (T0 + 4 * H, T0 + 6 * H), (T0 + 7 * H, T0 + 10 * H))
+    assert missing_spans(covered, T0 + 2 * H, T0 + 4 * H) == ()
+    assert list(pieces(missing[2:], 2 * H)) == [(T0 + 7 * H, T0 + 9 * H), (T0 + 9 * H, T0 + 10 * H)]
+
+    plans = group_by_missing([(1, None), (2, None), (3, 5)], lambda FMISID, _: missing if FMISID != 2 else ())
+    assert plans == {missing: [(1, None), (3, 5)]}
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_stored_rollup_hours_give_the_missing_hours(seed):
+    rng = np.random.default_rng(seed)
+    hours = pd.date_range(T0, periods=200, freq="h")
+    stored = hours[rng.random(len(hours)) < 0.6]
+    start, stop = hours[rng.integers(0, 50)], hours[rng.integers(150, 200)]
+
+    spans = missing_spans(rollup_store._stored_spans(stored.to_numpy()), start, stop)
+    got = [hour for span_start, span_stop in spans for hour in pd.date_range(span_start, span_stop - H, freq="h")]
+    wanted = pd.date_range(start, stop - H, freq="h")
+    assert got == list(wanted[~wanted.isin(stored)])